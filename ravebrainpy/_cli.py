@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Command line interface, `ravebrainpy <command> ...` or
+`python -m ravebrainpy <command> ...`
+'''
+import sys
+import argparse
+
+def _import(args):
+  from .io import import_cohort
+  subjects = None
+  if args.subjects:
+    subjects = [s for s in args.subjects.split(',') if s.strip()]
+  summary = import_cohort(args.subjects_dir, subjects = subjects,
+    workers = args.workers, threads = args.threads,
+    manifest = args.manifest, resume = not args.no_resume,
+    force = args.force, lock_timeout = args.lock_timeout,
+    verbose = args.verbose)
+  return 1 if summary['failed'] > 0 else 0
+
+def _format_bytes(n):
+  from .io._cohort import _format_bytes
+  return _format_bytes(n)
+
+def _audit(args):
+  from .io import audit_cache
+  failed = False
+  for path in args.paths:
+    report = audit_cache(path, verify = not args.no_verify,
+      workers = args.workers)
+    print('%s: %d cache director%s, %s' % (
+      report['path'], len(report['cache_dirs']),
+      'y' if len(report['cache_dirs']) == 1 else 'ies',
+      _format_bytes(report['total_bytes'])))
+    for c, v in report['categories'].items():
+      if v['count'] > 0:
+        print('  %-10s %6d  %10s' % (c, v['count'],
+          _format_bytes(v['bytes'])))
+    for e in report['orphans']:
+      print('  orphan    %s' % (e['data_path'] or e['digest_path']))
+    for e in report['corrupt']:
+      print('  corrupt   %s (%s)' % (e['data_path'], e['reason']))
+    for e in report['temporary']:
+      print('  temporary %s' % e['data_path'])
+    failed = failed or len(report['corrupt']) > 0
+  return 1 if failed else 0
+
+def _gc(args):
+  from .io import collect_garbage
+  for path in args.paths:
+    re = collect_garbage(path, orphans = True, corrupt = args.corrupt,
+      temporary = True, value_max_age = args.max_age,
+      value_budget = args.budget, dry_run = args.dry_run,
+      workers = args.workers, lock_timeout = args.lock_timeout)
+    for e in re['removed']:
+      print('%s %s' % ('would remove' if args.dry_run else 'removed',
+        e['data_path'] or e['digest_path']))
+    print('%s: %s %s %s' % (re['path'],
+      'would free' if args.dry_run else 'freed',
+      _format_bytes(re['removed_bytes']),
+      ', '.join(['%s %s' % (k, _format_bytes(v))
+        for k, v in re['removed_bytes_by_category'].items()])))
+  return 0
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(prog='ravebrainpy')
+  commands = parser.add_subparsers(dest='command')
+  commands.required = True
+
+  p = commands.add_parser('import',
+    help='import (cache) FreeSurfer subjects')
+  p.add_argument('--subjects-dir', required=True,
+    help='directory of FreeSurfer subjects')
+  p.add_argument('--subjects', default=None,
+    help='comma separated subject names (default: all found)')
+  p.add_argument('--workers', type=int, default=1,
+    help='number of worker processes')
+  p.add_argument('--threads', type=int, default=1,
+    help='numeric (OpenMP/BLAS) threads per worker')
+  p.add_argument('--manifest', default=None,
+    help='manifest of completed subjects (default: '
+    '<subjects-dir>/.ravebrainpy-import.jsonl)')
+  p.add_argument('--no-resume', action='store_true',
+    help='import subjects listed as done in the manifest again')
+  p.add_argument('--force', action='store_true',
+    help='re-create all caches')
+  p.add_argument('--lock-timeout', type=float, default=None,
+    help='seconds to wait for subjects locked by another import')
+  p.add_argument('--verbose', action='store_true')
+  p.set_defaults(run=_import)
+
+  p = commands.add_parser('cache', help='audit or clean cache directories')
+  actions = p.add_subparsers(dest='action')
+  actions.required = True
+  a = actions.add_parser('audit',
+    help='report cache size by category, orphans and corrupt caches')
+  a.add_argument('paths', nargs='+', help='cache directories, '
+    'FreeSurfer subjects or subjects directories')
+  a.add_argument('--no-verify', action='store_true',
+    help='do not check caches against their digests')
+  a.add_argument('--workers', type=int, default=4)
+  a.set_defaults(run=_audit)
+  a = actions.add_parser('gc', help='remove unused cache files')
+  a.add_argument('paths', nargs='+')
+  a.add_argument('--max-age', default=None,
+    help='remove value caches not written for this long, e.g. 30d')
+  a.add_argument('--budget', default=None,
+    help='keep value caches within this size per directory, e.g. 1G')
+  a.add_argument('--corrupt', action='store_true',
+    help='also remove caches failing digest verification')
+  a.add_argument('--dry-run', action='store_true')
+  a.add_argument('--workers', type=int, default=4)
+  a.add_argument('--lock-timeout', type=float, default=None)
+  a.set_defaults(run=_gc)
+
+  args = parser.parse_args(argv)
+  return args.run(args)
+
+if __name__ == '__main__':
+  sys.exit(main())
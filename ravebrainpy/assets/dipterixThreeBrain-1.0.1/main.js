@@ -54602,6 +54602,8 @@ const register_volume2DShader1 = function(THREE){
   THREE.Volume2dArrayShader_xy = {
     uniforms: {
       diffuse: { value: null },
+      overlay: { value: null },
+      overlayAlpha: { value: 0.0 },
 			depth: { value: 0 },
 			size: { value: new THREE.Vector3( 256, 256, 256 ) },
 			threshold: { value : 0.0 },
@@ -54627,6 +54629,8 @@ const register_volume2DShader1 = function(THREE){
       'precision highp sampler2DArray;',
 
       'uniform sampler2DArray diffuse;',
+      'uniform sampler2DArray overlay;',
+      'uniform float overlayAlpha;',
       'in vec2 vUv;',
       'uniform int depth;',
       'uniform float threshold;',
@@ -54636,14 +54640,18 @@ const register_volume2DShader1 = function(THREE){
       'void main() {',
 
       'vec4 color = texture( diffuse, vec3( vUv, depth ) );',
+      // overlay codes: 0 is no value, 1-255 is the value range
+      'float ov = texture( overlay, vec3( vUv, depth ) ).r;',
+      'float has_ov = float( ov > 0.0 ) * overlayAlpha;',
+      'vec3 ov_color = mix( vec3( 0.0, 0.3, 1.0 ), vec3( 1.0, 0.15, 0.0 ), ( ov * 255.0 - 1.0 ) / 254.0 );',
 
-      'float is_opaque = float( color.r > threshold );',
+      'float is_opaque = max( float( color.r > threshold ), has_ov );',
 
       // calculating z-depth, if transparent, make depth 1 (far)
       'gl_FragDepth = (1.0 - is_opaque * renderDepth) * (1.0 - gl_FragCoord.z) + gl_FragCoord.z;',
 
       // lighten a bit
-      'out_FragColor = vec4( color.rrr * 1.5, is_opaque );',
+      'out_FragColor = vec4( mix( color.rrr * 1.5, ov_color, has_ov ), is_opaque );',
 
       '}'
     ].join( '\n' )
@@ -54655,6 +54663,8 @@ const register_volume2DShader1 = function(THREE){
   THREE.Volume2dArrayShader_xz = {
     uniforms: {
       diffuse: { value: null },
+      overlay: { value: null },
+      overlayAlpha: { value: 0.0 },
 			depth: { value: 0 },
 			size: { value: new THREE.Vector3( 256, 256, 256 ) },
 			threshold: { value : 0.0 },
@@ -54681,6 +54691,8 @@ const register_volume2DShader1 = function(THREE){
       'precision highp sampler2DArray;',
 
       'uniform sampler2DArray diffuse;',
+      'uniform sampler2DArray overlay;',
+      'uniform float overlayAlpha;',
       'uniform vec3 size;',
       'in vec2 vUv;',
       'uniform float depth;',
@@ -54691,13 +54703,17 @@ const register_volume2DShader1 = function(THREE){
       'void main() {',
 
       'vec4 color = texture( diffuse, vec3( vUv.x, depth / size.y, floor( vUv.y * size.z ) ) );',
+      // overlay codes: 0 is no value, 1-255 is the value range
+      'float ov = texture( overlay, vec3( vUv.x, depth / size.y, floor( vUv.y * size.z ) ) ).r;',
+      'float has_ov = float( ov > 0.0 ) * overlayAlpha;',
+      'vec3 ov_color = mix( vec3( 0.0, 0.3, 1.0 ), vec3( 1.0, 0.15, 0.0 ), ( ov * 255.0 - 1.0 ) / 254.0 );',
 
-      'float is_opaque = float( color.r > threshold );',
+      'float is_opaque = max( float( color.r > threshold ), has_ov );',
 
       'gl_FragDepth = (1.0 - is_opaque * renderDepth) * (1.0 - gl_FragCoord.z) + gl_FragCoord.z;',
 
       // lighten a bit
-      'out_FragColor = vec4( color.rrr * 1.5, is_opaque );',
+      'out_FragColor = vec4( mix( color.rrr * 1.5, ov_color, has_ov ), is_opaque );',
 
       '}'
     ].join( '\n' )
@@ -54706,6 +54722,8 @@ const register_volume2DShader1 = function(THREE){
   THREE.Volume2dArrayShader_yz = {
     uniforms: {
       diffuse: { value: null },
+      overlay: { value: null },
+      overlayAlpha: { value: 0.0 },
 			depth: { value: 0 },
 			size: { value: new THREE.Vector3( 256, 256, 256 ) },
 			threshold: { value : 0.0 },
@@ -54732,6 +54750,8 @@ const register_volume2DShader1 = function(THREE){
       'precision highp sampler2DArray;',
 
       'uniform sampler2DArray diffuse;',
+      'uniform sampler2DArray overlay;',
+      'uniform float overlayAlpha;',
       'uniform vec3 size;',
       'in vec2 vUv;',
       'uniform float depth;',
@@ -54742,13 +54762,17 @@ const register_volume2DShader1 = function(THREE){
       'void main() {',
 
       'vec4 color = texture( diffuse, vec3( depth / size.x, vUv.x, floor( vUv.y * size.z ) ) );',
+      // overlay codes: 0 is no value, 1-255 is the value range
+      'float ov = texture( overlay, vec3( depth / size.x, vUv.x, floor( vUv.y * size.z ) ) ).r;',
+      'float has_ov = float( ov > 0.0 ) * overlayAlpha;',
+      'vec3 ov_color = mix( vec3( 0.0, 0.3, 1.0 ), vec3( 1.0, 0.15, 0.0 ), ( ov * 255.0 - 1.0 ) / 254.0 );',
 
-      'float is_opaque = float( color.r > threshold );',
+      'float is_opaque = max( float( color.r > threshold ), has_ov );',
 
       'gl_FragDepth = (1.0 - is_opaque * renderDepth) * (1.0 - gl_FragCoord.z) + gl_FragCoord.z;',
 
       // lighten a bit
-      'out_FragColor = vec4( color.rrr * 1.5, is_opaque );',
+      'out_FragColor = vec4( mix( color.rrr * 1.5, ov_color, has_ov ), is_opaque );',
 
       '}'
     ].join( '\n' )
@@ -61276,6 +61300,82 @@ parts will show.
 
 */
 
+const BINARY_TYPES = {
+  'u1' : Uint8Array, 'i1' : Int8Array, 'u2' : Uint16Array,
+  'i2' : Int16Array, 'u4' : Uint32Array, 'i4' : Int32Array,
+  'f4' : Float32Array, 'f8' : Float64Array
+};
+
+function half_to_float( h ){
+  const s = ( h & 0x8000 ) ? -1 : 1,
+        e = ( h >> 10 ) & 0x1f,
+        f = h & 0x3ff;
+  if( e === 0 ){ return( s * Math.pow( 2, -14 ) * ( f / 1024 ) ); }
+  if( e === 31 ){ return( f ? NaN : s * Infinity ); }
+  return( s * Math.pow( 2, e - 15 ) * ( 1 + f / 1024 ) );
+}
+
+// Binary cache written by ravebrainpy (`write_binary`): 'RBPY', header
+// length (uint32), JSON header, then 8-byte aligned little endian arrays
+// in Fortran order
+function decode_binary_cache( buffer ){
+  const magic = String.fromCharCode( ...new Uint8Array( buffer, 0, 4 ) );
+  if( magic !== 'RBPY' ){
+    throw new Error( 'Not a ravebrainpy binary cache' );
+  }
+  const hlen = new DataView( buffer ).getUint32( 4, true ),
+        header = JSON.parse( new TextDecoder( 'utf-8' ).decode(
+          new Uint8Array( buffer, 8, hlen ) ) ),
+        start = 8 + hlen,
+        arrays = {};
+  for( let nm in header.arrays ){
+    const info = header.arrays[ nm ],
+          type = info.dtype.substring( info.dtype.length - 2 );
+    if( type === 'f2' ){
+      const h = new Uint16Array( buffer, start + info.offset, info.nbytes / 2 );
+      arrays[ nm ] = Float32Array.from( h, half_to_float );
+    } else {
+      const cls = BINARY_TYPES[ type ];
+      arrays[ nm ] = new cls( buffer, start + info.offset,
+                              info.nbytes / cls.BYTES_PER_ELEMENT );
+    }
+  }
+  return({ header : header, arrays : arrays });
+}
+
+// One dense uint8 volume per frame of an overlay written by
+// `DataCubeGeom.set_value`: 0 is no value, 1-255 spans the value range
+function datacube_overlay_frames( content ){
+  const header = content.header,
+        q = content.arrays.value,
+        index = content.arrays.index,
+        n_voxels = header.dim[0] * header.dim[1] * header.dim[2],
+        n = index ? index.length : n_voxels,
+        vmin = header.value_range[0],
+        vmax = header.value_range[1],
+        span = vmax > vmin ? vmax - vmin : 1,
+        is_int = header.dtype === 'uint8' || header.dtype === 'uint16',
+        frames = [];
+  for( let t = 0; t < header.n_frames; t++ ){
+    const frame = new Uint8Array( n_voxels );
+    for( let i = 0; i < n; i++ ){
+      const code = q[ i + t * n ];
+      let v;
+      if( is_int ){
+        if( code === header.na_code ){ continue; }
+        v = code * header.scale + vmin;
+      } else {
+        v = code;
+      }
+      if( !isFinite( v ) ){ continue; }
+      v = Math.min( Math.max( ( v - vmin ) / span, 0 ), 1 );
+      frame[ index ? index[ i ] : i ] = 1 + Math.round( v * 254 );
+    }
+    frames.push( frame );
+  }
+  return( frames );
+}
+
 class datacube_DataCube extends AbstractThreeBrainObject {
   constructor(g, canvas){
     super(g, canvas);
@@ -61308,12 +61408,35 @@ class datacube_DataCube extends AbstractThreeBrainObject {
   	texture.needsUpdate = true;
   	this._texture = texture;
 
+    // overlays (`DataCubeGeom.set_value`), one frame shown at a time
+    const overlay_texture = new threeplugins_THREE.DataTexture2DArray(
+      new Uint8Array( cube_dimension[0] * cube_dimension[1] * cube_dimension[2] ),
+      cube_dimension[0], cube_dimension[1], cube_dimension[2] );
+    overlay_texture.format = threeplugins_THREE.RedFormat;
+    overlay_texture.type = threeplugins_THREE.UnsignedByteType;
+    overlay_texture.needsUpdate = true;
+    this._overlay_texture = overlay_texture;
+    this._overlays = {};
+    this._overlay_shown = null;
+    for( let nm in ( g.keyframes || {} ) ){
+      const content = canvas.get_data( 'datacube_overlay_' + nm + '_' + g.name,
+                                       g.name, g.group.group_name );
+      if( content && content.header && content.arrays ){
+        this._overlays[ nm ] = {
+          time : content.header.time,
+          frames : datacube_overlay_frames( content )
+        };
+      }
+    }
+
 
     // Shader - XY plane
   	const shader_xy = threeplugins_THREE.Volume2dArrayShader_xy;
   	let material_xy = new threeplugins_THREE.ShaderMaterial({
   	  uniforms : {
     		diffuse: { value: texture },
+    		overlay: { value: overlay_texture },
+    		overlayAlpha: { value: 0.0 },
     		depth: { value: cube_half_size[2] },  // initial in the center of data cube
     		size: { value: new threeplugins_THREE.Vector3( volume.xLength, volume.yLength, cube_dimension[2] ) },
     		threshold: { value : 0.0 },
@@ -61339,6 +61462,8 @@ class datacube_DataCube extends AbstractThreeBrainObject {
   	let material_xz = new threeplugins_THREE.ShaderMaterial({
   	  uniforms : {
     		diffuse: { value: texture },
+    		overlay: { value: overlay_texture },
+    		overlayAlpha: { value: 0.0 },
     		depth: { value: cube_half_size[1] },  // initial in the center of data cube
     		size: { value: new threeplugins_THREE.Vector3( volume.xLength, cube_dimension[1], volume.zLength ) },
     		threshold: { value : 0.0 },
@@ -61363,6 +61488,8 @@ class datacube_DataCube extends AbstractThreeBrainObject {
   	let material_yz = new threeplugins_THREE.ShaderMaterial({
   	  uniforms : {
     		diffuse: { value: texture },
+    		overlay: { value: overlay_texture },
+    		overlayAlpha: { value: 0.0 },
     		depth: { value: cube_half_size[0] },  // initial in the center of data cube
     		size: { value: new threeplugins_THREE.Vector3( cube_dimension[0], volume.yLength, volume.zLength ) },
     		threshold: { value : 0.0 },
@@ -61446,6 +61573,9 @@ class datacube_DataCube extends AbstractThreeBrainObject {
     this._geometry_yz = geometry_yz;
     this._material_yz = material_yz;
 
+    // the planes share the overlay texture, update it once
+    mesh_xy.userData.pre_render = ( results ) => { return( this.pre_render( results ) ); };
+
     this.object = mesh;
   }
 
@@ -61459,11 +61589,37 @@ class datacube_DataCube extends AbstractThreeBrainObject {
   	this._material_yz.dispose();
   	this._geometry_yz.dispose();
     this._texture.dispose();
+    this._overlay_texture.dispose();
   }
 
   get_track_data( track_name, reset_material ){}
 
-  pre_render( results ){}
+  pre_render( results ){
+    // overlay of the current animation, last frame not after current time
+    const overlay = this._overlays[ this._canvas.shared_data.get( 'animation_name' ) ];
+    let frame = -1;
+    if( overlay ){
+      const current_time = ( results && typeof results.current_time === 'number' ) ?
+                             results.current_time : 0;
+      frame = 0;
+      overlay.time.forEach( ( t, ii ) => {
+        if( t <= current_time ){ frame = ii; }
+      });
+    }
+    const shown = overlay ? [ overlay, frame ] : null;
+    if( shown === this._overlay_shown || ( shown && this._overlay_shown &&
+        shown[0] === this._overlay_shown[0] && shown[1] === this._overlay_shown[1] ) ){
+      return;
+    }
+    this._overlay_shown = shown;
+    if( overlay ){
+      this._overlay_texture.image.data.set( overlay.frames[ frame ] );
+      this._overlay_texture.needsUpdate = true;
+    }
+    [ this._material_xy, this._material_xz, this._material_yz ].forEach( ( m ) => {
+      m.uniforms.overlayAlpha.value = overlay ? 1.0 : 0.0;
+    });
+  }
 }
 
 
@@ -63042,6 +63198,9 @@ class threejs_scene_THREEBRAIN_CANVAS {
     this.loader_manager.onError = function ( url ) { console.debug( 'There was an error loading ' + url ) };
 
     this.json_loader = new threeplugins_THREE.FileLoader( this.loader_manager );
+    // binary caches written by ravebrainpy (`binary_cache`)
+    this.binary_loader = new threeplugins_THREE.FileLoader( this.loader_manager );
+    this.binary_loader.setResponseType( 'arraybuffer' );
     this.font_loader = new threeplugins_THREE.FontLoader( this.loader_manager );
 
   }
@@ -65244,19 +65403,30 @@ class threejs_scene_THREEBRAIN_CANVAS {
           }
           */
 
-          this.load_file(
-            path, ( v ) => {
+          if( cache_info.is_binary ){
+            // header and typed arrays, kept under the group data name
+            this.load_file(
+              path, ( v ) => {
+                g.group_data[nm] = decode_binary_cache( v );
+                item_size -= 1;
+              },
+              'binary_loader'
+            );
+          } else {
+            this.load_file(
+              path, ( v ) => {
 
-          	  const keys = Object.keys(v);
+            	  const keys = Object.keys(v);
 
-          	  keys.forEach((k) => {
-                g.group_data[k] = v[k];
-              });
+            	  keys.forEach((k) => {
+                  g.group_data[k] = v[k];
+                });
 
-              item_size -= 1;
-          	},
-          	onProgress
-          );
+                item_size -= 1;
+            	},
+            	onProgress
+            );
+          }
 
         }
 
@@ -4,6 +4,61 @@
 // This is a global cache that is shared across the widgets.
 const global_cache = window.global_cache || new THREEBRAIN_STORAGE();
 
+// Apply values pushed by the python viewer server (`update_values`)
+const apply_value_updates = (handlers, args) => {
+  const canvas = handlers.canvas,
+        name = args.name || 'Value',
+        values = args.values || {};
+
+  for( let mesh_name in values ){
+    const m = canvas.mesh.get( mesh_name );
+    if( m && typeof m.userData.add_track_data === 'function' ){
+      m.userData.add_track_data( name, args.data_type, values[ mesh_name ],
+                                 args.time );
+    }
+  }
+
+  const cmap = args.colormap;
+  if( cmap ){
+    canvas.add_colormap(
+      cmap.name, cmap.alias, cmap.value_type, cmap.value_names,
+      cmap.value_range, cmap.time_range, cmap.color_keys, cmap.color_vals,
+      cmap.color_levels, cmap.hard_range
+    );
+  }
+
+  canvas.generate_animation_clips( name, true );
+  if( Array.isArray( args.value_range ) ){
+    handlers.shiny.handle_display_data({
+      variable : name, range : args.value_range
+    });
+  }
+  canvas.start_animation( 0 );
+};
+
+// Pages served as viewer sessions (/s/<token>/) listen to server-sent
+// events; messages call `handle_<name>` like shiny messages do
+const listen_to_server = (handlers) => {
+  if( handlers.__event_source || typeof EventSource === 'undefined' ||
+      !/\/s\/[^\/]+\//.test( window.location.pathname ) ){
+    return;
+  }
+  const source = new EventSource( 'events' );
+  source.onmessage = (evt) => {
+    const data = JSON.parse( evt.data ),
+          method_name = 'handle_' + data.name;
+    if( data.name === 'reload' ){
+      // the render directory has been updated
+      window.location.reload();
+    } else if( data.name === 'update_values' ){
+      apply_value_updates( handlers, data.value );
+    } else if( typeof handlers.shiny[ method_name ] === 'function' ){
+      handlers.shiny[ method_name ]( data.value );
+    }
+  };
+  handlers.__event_source = source;
+};
+
 HTMLWidgets.widget({
 
   name: "threejs_brain",
@@ -65,7 +120,19 @@ HTMLWidgets.widget({
       // "find", "renderError", "clearError", "sizing", "name", "type", "initialize", "renderValue", "resize"
 
       renderValue: (x) => {
-        handlers.render_value( x );
+        if( x && x.data_url ){
+          // Widget data is stored in a separate file so the page shows
+          // before the (possibly large) payload is downloaded
+          fetch( x.data_url )
+            .then( (response) => response.json() )
+            .then( (data) => {
+              handlers.render_value( data.x );
+              listen_to_server( handlers );
+            } );
+        } else {
+          handlers.render_value( x );
+          listen_to_server( handlers );
+        }
       },
 
       resize: (width, height) => {
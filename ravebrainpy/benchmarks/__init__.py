@@ -0,0 +1,5 @@
+from __future__ import absolute_import
+from ._synthetic import make_subject, icosphere
+from ._suite import run_benchmarks, measure_geom_memory, CONTACTS
+from ._startup import measure_import, check_import, IMPORT_BUDGET
+from ._startup import DEFERRED_MODULES
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+python -m ravebrainpy.benchmarks --out results.json
+python -m ravebrainpy.benchmarks --import-only
+'''
+import argparse
+from ._suite import run_benchmarks, CONTACTS
+from ._startup import check_import, IMPORT_BUDGET
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(prog='python -m ravebrainpy.benchmarks',
+    description='Time import and render of a synthetic FreeSurfer subject')
+  parser.add_argument('--out', default=None, help='JSON results path')
+  parser.add_argument('--root', default=None,
+    help='directory of the synthetic subject (default: temporary)')
+  parser.add_argument('--subdivisions', type=int, default=7)
+  parser.add_argument('--volume-dim', type=int, default=256)
+  parser.add_argument('--contacts', default=','.join(map(str, CONTACTS)),
+    help='comma separated numbers of electrode contacts')
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--memory', action='store_true',
+    help='record peak memory of each stage')
+  parser.add_argument('--keep', action='store_true',
+    help='keep the synthetic subject')
+  parser.add_argument('--import-only', action='store_true',
+    help='only check the start-up time of `import ravebrainpy.core`')
+  parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET,
+    help='seconds `import ravebrainpy.core` may take (--import-only)')
+  args = parser.parse_args(argv)
+  if args.import_only:
+    re = check_import(budget=args.import_budget, repeat=args.repeat)
+    print('import ravebrainpy.core: median %.3fs, min %.3fs '
+      '(budget %.3fs)' % (re['median'], re['min'], args.import_budget))
+    return
+  contacts = [int(x) for x in args.contacts.split(',') if x.strip()]
+  run_benchmarks(out=args.out, root=args.root,
+    subdivisions=args.subdivisions, volume_dim=args.volume_dim,
+    contacts=contacts, repeat=args.repeat, memory=args.memory,
+    keep=args.keep)
+
+if __name__ == '__main__':
+  main()
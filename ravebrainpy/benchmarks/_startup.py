@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import sys
+import json
+import subprocess
+
+from ..utils import stopifnot
+
+# Seconds `import ravebrainpy.core` may take in a fresh interpreter
+IMPORT_BUDGET = 0.5
+# Modules imported on first use only; importing the package must not
+# load them
+DEFERRED_MODULES = ('pandas', 'nibabel', 'IPython')
+
+_SCRIPT = '''
+import sys, time, json
+start = time.perf_counter()
+import %s
+elapsed = time.perf_counter() - start
+print(json.dumps({ 'seconds' : elapsed, 'loaded' : [
+  m for m in %r if m in sys.modules] }))
+'''
+
+def measure_import(module='ravebrainpy.core', repeat=5, python=None):
+  '''
+  Time importing `module` in fresh interpreters
+
+  Parameters
+  ----------
+  module : module to import
+  repeat : number of interpreters; the first run may include compiling
+           and reading files from disk, see `min`
+  python : interpreter, default is the current one
+
+  Returns
+  -------
+  Result record (see `run_benchmarks`) with `loaded`: modules of
+  DEFERRED_MODULES the import loaded
+  '''
+  if python is None:
+    python = sys.executable
+  times = []
+  loaded = set()
+  for i in range(max(1, int(repeat))):
+    out = subprocess.run([python, '-c', _SCRIPT % (module,
+      DEFERRED_MODULES)], stdout=subprocess.PIPE, check=True)
+    re = json.loads(out.stdout.decode('utf-8').strip().splitlines()[-1])
+    times.append(re['seconds'])
+    loaded.update(re['loaded'])
+  times_sorted = sorted(times)
+  return {
+    'name' : 'import_core',
+    'params' : { 'module' : module },
+    'repeat' : len(times),
+    'times' : times,
+    'min' : times_sorted[0],
+    'median' : times_sorted[len(times) // 2],
+    'stages' : {},
+    'payload_bytes' : 0,
+    'loaded' : sorted(loaded)
+  }
+
+def check_import(budget=IMPORT_BUDGET, module='ravebrainpy.core',
+  repeat=5):
+  '''
+  Raise an error if importing `module` takes longer than `budget`
+  seconds (median of `repeat` fresh interpreters) or loads any of
+  DEFERRED_MODULES
+
+  Returns
+  -------
+  Result record of `measure_import`
+  '''
+  re = measure_import(module=module, repeat=repeat)
+  stopifnot(len(re['loaded']) == 0, msg = 'import %s loads %s' % (
+    module, ', '.join(re['loaded'])))
+  stopifnot(re['median'] <= budget, msg =
+    'import %s takes %.3fs, budget is %.3fs' % (module, re['median'],
+    budget))
+  return re
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import shutil
+import platform
+import tempfile as tpf
+import numpy as np
+
+from ..utils import Instrument, json_dump
+from ._synthetic import make_subject
+from ._startup import measure_import
+
+CONTACTS = (10, 100, 1000, 10000)
+
+def _electrodes(n, n_timepoints=20, seed=0, compact=False):
+  from ..core import GeomGroup, ElectrodeGeom, CompactElectrodeGeom
+  cls = CompactElectrodeGeom if compact else ElectrodeGeom
+  rng = np.random.default_rng(seed)
+  group = GeomGroup('electrodes_benchmark')
+  # contacts on a shell around the synthetic hemispheres
+  direction = rng.normal(size=(n, 3))
+  direction /= np.linalg.norm(direction, axis=1, keepdims=True)
+  position = direction * np.array([70.0, 82.0, 62.0])
+  time_stamp = np.linspace(0, 1, n_timepoints).tolist()
+  values = rng.normal(size=(n, n_timepoints))
+  geoms = []
+  for i in range(n):
+    g = cls(name='Contact %d' % (i + 1),
+      position=position[i].tolist(), group=group)
+    if n_timepoints > 0:
+      g.set_value(name='Value', value=values[i].tolist(),
+        time_stamp=time_stamp)
+    geoms.append(g)
+  return geoms
+
+def measure_geom_memory(n=10000, timepoints=(0, 20)):
+  '''
+  Memory of `n` electrode contacts, `ElectrodeGeom` against
+  `CompactElectrodeGeom`, without values and with time series of each
+  length in `timepoints`
+
+  Returns
+  -------
+  List of records: class, contacts, timepoints, bytes per contact and
+  seconds to create them
+  '''
+  import gc
+  import tracemalloc
+  re = []
+  for t in timepoints:
+    for compact in (False, True):
+      gc.collect()
+      tracemalloc.start()
+      try:
+        start = time.perf_counter()
+        geoms = _electrodes(n, n_timepoints=t, compact=compact)
+        elapsed = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+      finally:
+        tracemalloc.stop()
+      re.append({
+        'name' : 'geom_memory',
+        'params' : {
+          'class' : type(geoms[0]).__name__,
+          'contacts' : n,
+          'timepoints' : t
+        },
+        'bytes_per_geom' : current / n,
+        'seconds' : elapsed
+      })
+      del geoms
+  return re
+
+def _measure(name, fun, repeat=1, params=None, memory=False, setup=None):
+  '''
+  Run `fun` `repeat` times; returns a result record with wall times and
+  the stage breakdown of the last run
+  '''
+  times = []
+  report = None
+  for i in range(repeat):
+    if setup is not None:
+      setup()
+    with Instrument(name=name, memory=memory) as inst:
+      start = time.perf_counter()
+      fun()
+      times.append(time.perf_counter() - start)
+    report = inst.report()
+  return {
+    'name' : name,
+    'params' : params or {},
+    'repeat' : repeat,
+    'times' : times,
+    'min' : min(times),
+    'median' : float(np.median(times)),
+    'stages' : report['stages'],
+    'payload_bytes' : report['payload_bytes']
+  }
+
+def run_benchmarks(out=None, root=None, subject_code='synthetic',
+  subdivisions=7, volume_dim=256, contacts=CONTACTS, repeat=3,
+  memory=False, keep=False, verbose=True):
+  '''
+  Time importing and rendering a synthetic FreeSurfer subject
+
+  Benchmarks:
+    geom_memory : bytes per electrode contact, regular against compact
+                  geometries (`measure_geom_memory`, largest `contacts`)
+    import_core : `import ravebrainpy.core` in fresh interpreters, see
+                  `measure_import`
+    import_freesurfer (cold) : no `RAVEpy` cache
+    import_freesurfer (warm) : all caches valid
+    brain_init : `Brain(subject_code, path)` from the caches
+    render : `Brain.render(start_server=False)`
+    render_electrodes : render with 10, 100, ... contacts (`contacts`)
+                        carrying time series values
+
+  Parameters
+  ----------
+  out : path of the JSON results, or None to only return them
+  root : directory of the synthetic subject; default is a temporary
+         directory, removed afterwards unless `keep`
+  subdivisions, volume_dim : size of the synthetic subject, see
+         `make_subject`; 7 and 256 match a real FreeSurfer subject
+  repeat : number of runs of each benchmark (cold import runs once
+           per repeat on a freshly cleared cache)
+  memory : also record peak memory per stage (slower)
+
+  Returns
+  -------
+  Dictionary of results, also written to `out` as JSON
+  '''
+  from ..io import import_freesurfer
+  from ..core import Brain, render_threejsbrain
+
+  cleanup = root is None
+  if root is None:
+    root = tpf.mkdtemp(prefix='ravebrainpy_bench_')
+  results = []
+  log = print if verbose else (lambda *args: None)
+  try:
+    start = time.perf_counter()
+    fspath = make_subject(root, subject_code=subject_code,
+      subdivisions=subdivisions, volume_dim=volume_dim)
+    generate = time.perf_counter() - start
+    rave_path = os.path.join(fspath, 'RAVEpy')
+    params = { 'subdivisions' : subdivisions, 'volume_dim' : volume_dim }
+
+    results.append(measure_import(repeat=repeat))
+
+    def clear_cache():
+      if os.path.exists(rave_path):
+        shutil.rmtree(rave_path)
+
+    def do_import():
+      import_freesurfer(subject_code, fspath)
+
+    results.append(_measure('import_freesurfer_cold', do_import,
+      repeat=repeat, params=params, memory=memory, setup=clear_cache))
+    results.append(_measure('import_freesurfer_warm', do_import,
+      repeat=repeat, params=params, memory=memory))
+
+    brains = []
+    results.append(_measure('brain_init',
+      lambda: brains.append(Brain(subject_code, fspath)),
+      repeat=repeat, params=params, memory=memory))
+    brain = brains[-1]
+
+    results.append(_measure('render',
+      lambda: brain.render(start_server=False, incremental=False),
+      repeat=repeat, params=params, memory=memory))
+
+    for n in contacts:
+      electrodes = _electrodes(n)
+      def do_render():
+        render_threejsbrain(
+          geoms=brain.get_geometries() + electrodes,
+          global_data=brain.global_data, start_server=False)
+      results.append(_measure('render_electrodes', do_render,
+        repeat=repeat, params=dict(params, contacts=n), memory=memory))
+    for r in results:
+      log('%-24s %-34s median %8.3fs  min %8.3fs' % (
+        r['name'], ' '.join(['%s=%s' % kv for kv in r['params'].items()]),
+        r['median'], r['min']))
+    geom_memory = measure_geom_memory(n=max(contacts)) \
+      if len(contacts) else []
+    for r in geom_memory:
+      log('%-24s %-34s %8.0f bytes/contact' % (
+        r['name'], ' '.join(['%s=%s' % kv for kv in r['params'].items()]),
+        r['bytes_per_geom']))
+  finally:
+    if cleanup and not keep:
+      shutil.rmtree(root, ignore_errors=True)
+
+  re = {
+    'timestamp' : time.time(),
+    'python' : sys.version.split()[0],
+    'platform' : platform.platform(),
+    'numpy' : np.__version__,
+    'subject' : {
+      'subdivisions' : subdivisions,
+      'volume_dim' : volume_dim,
+      'vertices_per_hemisphere' : 10 * 4 ** subdivisions + 2,
+      'generate_seconds' : generate,
+      'path' : None if (cleanup and not keep) else fspath
+    },
+    'results' : results,
+    'geom_memory' : geom_memory
+  }
+  if out is not None:
+    json_dump(re, out)
+  return re
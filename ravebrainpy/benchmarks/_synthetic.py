@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+from ..utils import make_dirs, write_to_file
+
+# FreeSurfer conformed space (LIA, 1mm, 256^3)
+CONFORMED_VOX2RAS = np.array([
+  [-1, 0, 0, 128],
+  [ 0, 0, 1,-128],
+  [ 0,-1, 0, 128],
+  [ 0, 0, 0,   1]
+], dtype=np.float64)
+
+def icosphere(subdivisions=7):
+  '''
+  Unit icosphere with `10 * 4^subdivisions + 2` vertices (163842 for 7,
+  close to a FreeSurfer hemisphere)
+
+  Returns
+  -------
+  Tuple of vertices (N, 3) float64 and faces (M, 3) int32
+  '''
+  t = (1.0 + 5 ** 0.5) / 2
+  vertices = np.array([
+    [-1, t, 0], [1, t, 0], [-1, -t, 0], [1, -t, 0],
+    [0, -1, t], [0, 1, t], [0, -1, -t], [0, 1, -t],
+    [t, 0, -1], [t, 0, 1], [-t, 0, -1], [-t, 0, 1]
+  ], dtype=np.float64)
+  faces = np.array([
+    [0, 11, 5], [0, 5, 1], [0, 1, 7], [0, 7, 10], [0, 10, 11],
+    [1, 5, 9], [5, 11, 4], [11, 10, 2], [10, 7, 6], [7, 1, 8],
+    [3, 9, 4], [3, 4, 2], [3, 2, 6], [3, 6, 8], [3, 8, 9],
+    [4, 9, 5], [2, 4, 11], [6, 2, 10], [8, 6, 7], [9, 8, 1]
+  ], dtype=np.int64)
+  vertices /= np.linalg.norm(vertices, axis=1, keepdims=True)
+
+  for _ in range(subdivisions):
+    n = len(vertices)
+    # one midpoint per unique edge
+    edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]],
+      faces[:, [2, 0]]])
+    edges.sort(axis=1)
+    keys = edges[:, 0] * n + edges[:, 1]
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    a, b = uniq // n, uniq % n
+    mid = vertices[a] + vertices[b]
+    mid /= np.linalg.norm(mid, axis=1, keepdims=True)
+    vertices = np.concatenate([vertices, mid])
+    m = (inverse.reshape((3, -1)) + n)
+    m01, m12, m20 = m[0], m[1], m[2]
+    v0, v1, v2 = faces[:, 0], faces[:, 1], faces[:, 2]
+    faces = np.concatenate([
+      np.stack([v0, m01, m20], axis=1),
+      np.stack([v1, m12, m01], axis=1),
+      np.stack([v2, m20, m12], axis=1),
+      np.stack([m01, m12, m20], axis=1)
+    ])
+  return vertices, faces.astype(np.int32)
+
+def _hemisphere(vertices, hemisphere, rng):
+  # folded ellipsoid: radial modulation plays the role of sulci
+  x, y, z = vertices[:, 0], vertices[:, 1], vertices[:, 2]
+  phase = rng.uniform(0, 2 * np.pi, size=3)
+  sulc = np.sin(9 * x + phase[0]) * np.sin(11 * y + phase[1]) * \
+    np.sin(7 * z + phase[2])
+  radius = 1 + 0.06 * sulc
+  coords = vertices * radius[:, None] * np.array([32.0, 80.0, 60.0])
+  coords[:, 0] += -36 if hemisphere == 'l' else 36
+  coords[:, 2] += 10
+  return coords.astype(np.float32), sulc.astype(np.float32)
+
+def make_subject(root, subject_code='synthetic', subdivisions=7,
+  volume_dim=256, seed=0):
+  '''
+  Write a synthetic FreeSurfer subject with nibabel
+
+  Creates `surf/lh.pial`, `surf/rh.pial` (icosphere-derived, folded),
+  `surf/lh.sulc`, `surf/rh.sulc`, `mri/T1.mgz` (`volume_dim`^3, uint8)
+  and `mri/transforms/talairach.xfm` under `root/subject_code`
+
+  Returns
+  -------
+  Path to the subject (FreeSurfer) directory
+  '''
+  import nibabel
+  rng = np.random.default_rng(seed)
+  fspath = os.path.join(root, subject_code)
+  surf_path = os.path.join(fspath, 'surf')
+  mri_path = os.path.join(fspath, 'mri')
+  make_dirs(surf_path)
+  make_dirs(os.path.join(mri_path, 'transforms'))
+
+  sphere, faces = icosphere(subdivisions)
+  for h in 'lr':
+    coords, sulc = _hemisphere(sphere, h, rng)
+    nibabel.freesurfer.io.write_geometry(
+      os.path.join(surf_path, '%sh.pial' % h), coords, faces)
+    nibabel.freesurfer.io.write_morph_data(
+      os.path.join(surf_path, '%sh.sulc' % h), sulc)
+
+  # T1: bright ellipsoid (brain) inside a dimmer shell (head), LIA
+  d = volume_dim
+  scale = d / 256.0
+  i, j, k = np.ogrid[0:d, 0:d, 0:d]
+  c = (d - 1) / 2.0
+  # LIA voxel axes: i -> left, j -> inferior, k -> anterior
+  r2 = ((i - c) / (70 * scale)) ** 2 + ((j - c) / (65 * scale)) ** 2 + \
+    ((k - c) / (90 * scale)) ** 2
+  volume = np.zeros((d, d, d), dtype=np.uint8)
+  volume[r2 < 1.5] = 40
+  volume[r2 < 1] = 110
+  volume += rng.integers(0, 8, size=(d, d, d), dtype=np.uint8)
+  # 1mm voxels (the importer expects conformed axes), centered
+  affine = CONFORMED_VOX2RAS.copy()
+  affine[:3, 3] = -affine[:3, :3] @ np.array([c + 0.5, c + 0.5, c + 0.5])
+  nibabel.save(nibabel.MGHImage(volume, affine),
+    os.path.join(mri_path, 'T1.mgz'))
+
+  write_to_file('\n'.join([
+    'MNI Transform File',
+    '% synthetic subject generated by ravebrainpy.benchmarks',
+    '',
+    'Transform_Type = Linear;',
+    'Linear_Transform =',
+    '1.05 0.01 -0.02 -1.5',
+    '-0.01 1.02 0.05 -18.2',
+    '0.02 -0.04 1.08 12.7;',
+    ''
+  ]), os.path.join(mri_path, 'transforms', 'talairach.xfm'))
+  return fspath
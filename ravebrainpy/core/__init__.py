@@ -1,11 +1,15 @@
 from __future__ import absolute_import
-from ._renderer import render_threejsbrain, start_viewer
+from ._renderer import render_threejsbrain, start_viewer, RenderCache
 from ._group import GeomGroup
 from ._keyframe import KeyFrame, ColorMap
 from ._geom_abs import AbstractGeom
 from ._geom_sphere import SphereGeom, ElectrodeGeom
+from ._geom_compact import CompactGeom, CompactSphereGeom, CompactElectrodeGeom
+from ._geom_compact import CompactKeyFrame
 from ._geom_blank import BlankGeom
-from ._geom_free import FreeGeom
+from ._geom_free import FreeGeom, check_mesh
 from ._geom_datacube import DataCubeGeom
-from ._brain import BrainSurface, Brain, BrainVolume
+from ._brain import BrainSurface, Brain, BrainVolume, render_brains
+from ._decimate import decimate_series, decimate_keyframes, DECIMATION_METHODS
+from ._vol2surf import sample_volume, vol2surf, cube_vox2ras
 
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import hashlib
+from ..utils import tempdir, make_dirs, make_parent_dir, rand_string
+
+ASSET_DIR = os.path.join(
+  os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets')
+INDEX_TEMPLATE = os.path.join(ASSET_DIR, 'index.html')
+
+# Files that are generated per render, or only needed for debugging
+_EXCLUDE = ('index.html', )
+_DEBUG_EXT = ('.map', )
+
+# debug flag -> shared directory, computed once per process
+_shared_dirs = {}
+
+def _asset_files(debug=False):
+  files = []
+  for (a,b,c) in os.walk(ASSET_DIR, topdown=True):
+    for fn in c:
+      rel = os.path.relpath(path=os.path.join(a, fn), start=ASSET_DIR)
+      if rel in _EXCLUDE:
+        continue
+      if not debug and os.path.splitext(fn)[1] in _DEBUG_EXT:
+        continue
+      files.append(rel)
+  return sorted(files)
+
+def _asset_version(files, length=16):
+  m = hashlib.shake_128()
+  for rel in files:
+    m.update(rel.encode('utf-8'))
+    with open(os.path.join(ASSET_DIR, rel), 'rb') as f:
+      for chunk in iter(lambda: f.read(1 << 20), b''):
+        m.update(chunk)
+  return m.hexdigest(length // 2)
+
+def shared_asset_dir(debug=False, root=None):
+  '''
+  Directory holding one copy of the viewer libraries
+
+  The directory name is the digest of the asset contents, so different
+  package versions never share (or overwrite) each other's files.
+  Source maps are only included when `debug` is True.
+  '''
+  key = (bool(debug), root)
+  path = _shared_dirs.get(key, None)
+  if path is not None and os.path.isdir(path):
+    return path
+
+  files = _asset_files(debug=debug)
+  if root is None:
+    root = os.path.join(tempdir(), 'assets')
+  path = os.path.join(root, _asset_version(files))
+
+  if not os.path.isdir(path):
+    # copy to a private directory first so other processes never see
+    # a partially copied asset directory
+    tmp = '%s.tmp-%s' % (path, rand_string())
+    for rel in files:
+      dst = os.path.join(tmp, rel)
+      make_parent_dir(dst)
+      shutil.copyfile(src=os.path.join(ASSET_DIR, rel), dst=dst)
+    try:
+      os.rename(tmp, path)
+    except OSError as e:
+      # another process has finished first
+      shutil.rmtree(tmp, ignore_errors=True)
+  _shared_dirs[key] = path
+  return path
+
+def link_assets(target_dir, debug=False, copy=False):
+  '''
+  Make viewer libraries available under `target_dir`
+
+  Top-level entries of `shared_asset_dir` are symlinked, which costs
+  the same regardless of asset size. Files are copied if `copy` is
+  True (for example to create a standalone viewer directory) or when
+  the platform does not support symbolic links.
+  '''
+  shared = shared_asset_dir(debug=debug)
+  make_dirs(target_dir)
+  for fn in os.listdir(shared):
+    src = os.path.join(shared, fn)
+    dst = os.path.join(target_dir, fn)
+    if os.path.exists(dst):
+      continue
+    if os.path.islink(dst):
+      # dangling link, e.g. the shared assets were moved
+      os.unlink(dst)
+    if not copy:
+      try:
+        os.symlink(src, dst, target_is_directory=os.path.isdir(src))
+        continue
+      except (OSError, NotImplementedError) as e:
+        pass
+    if os.path.isdir(src):
+      shutil.copytree(src, dst, copy_function=shutil.copyfile)
+    else:
+      shutil.copyfile(src=src, dst=dst)
+  return target_dir
@@ -5,9 +5,10 @@ import numpy as np
 from .. import SURFACE_TYPES, IDENTITY4X4
 from ..utils import stopifnot, as_dict, normalize_path, file_exists
 from ..utils import from_json, spread_list, matmult4x4, inv4x4
-from ..utils import normalize_path
+from ..utils import normalize_path, LazyDict, profiled
 from . import GeomGroup, FreeGeom, DataCubeGeom, BlankGeom
-from . import render_threejsbrain
+from . import render_threejsbrain, RenderCache
+from ._vol2surf import vol2surf
 
 OFFSETS = {
   'inflated' : 50,
@@ -25,6 +26,7 @@ class Brain:
   
   @property
   def xfm(self):
+    self._ensure_transforms()
     x = self._xfm
     return [[x[i+j] for j in range(4)] for i in [0,4,8,12]]
   
@@ -34,6 +36,7 @@ class Brain:
   
   @property
   def Norig(self):
+    self._ensure_transforms()
     x = self._Norig
     return [[x[i+j] for j in range(4)] for i in [0,4,8,12]]
   
@@ -43,6 +46,7 @@ class Brain:
   
   @property
   def Torig(self):
+    self._ensure_transforms()
     x = self._Torig
     return [[x[i+j] for j in range(4)] for i in [0,4,8,12]]
   
@@ -50,28 +54,51 @@ class Brain:
   def Torig(self, x):
     self._Torig = _spread_4x4(x)
   
-  def _import_from_fspath(self, path):
-    stopifnot(path is not None and file_exists(path),
-      msg="Must specify a valid subject's FreeSurfer path")
-    stopifnot(file_exists(os.path.join(path, 'RAVEpy')),
-      msg="Please use 'import_freesurfer' to import FreeSurfer files")
+  def _import_from_fspath(self, path, lazy=False):
+    if not lazy:
+      stopifnot(path is not None and file_exists(path),
+        msg="Must specify a valid subject's FreeSurfer path")
+      stopifnot(file_exists(os.path.join(path, 'RAVEpy')),
+        msg="Please use 'import_freesurfer' to import FreeSurfer files")
     
     path = normalize_path(path)
     _p = self._paths
     _p['root'] = path
     _p['ravepy_path'] = os.path.join(path, 'RAVEpy')
     _p['digest'] = os.path.join( _p['ravepy_path'], 'common.pydigest' )
+    
+    if lazy:
+      # common.pydigest and T1 are loaded on first access
+      self._transforms_pending = True
+      self.volumes.set_loader('T1', lambda : self._load_volume('T1'))
+      return
+    
     # 1. read common.pydigest
-    info = from_json(from_file=_p['digest'])
+    self._load_transforms()
+    
+    # load volumes
+    self._load_volume('T1')
+  
+  def _load_transforms(self):
+    self._transforms_pending = False
+    info = from_json(from_file=self._paths['digest'])
     if 'xfm' in info:
       self.xfm = info['xfm']
     if 'Norig' in info:
       self.Norig = info['Norig']
     if 'Torig' in info:
       self.Torig = info['Torig']
-    
-    # load volumes
-    self._load_volume('T1')
+  
+  def _ensure_transforms(self):
+    if self._transforms_pending:
+      self._load_transforms()
+  
+  def _lazy_surface_loader(self, surface_type, vertex_color):
+    def _loader():
+      surface = self._load_surface(surface_type)
+      self._load_surface_color(surface_type, vertex_color)
+      return surface
+    return _loader
   
   def _load_surface(self, surface_type):
     stopifnot(surface_type in SURFACE_TYPES,
@@ -134,14 +161,23 @@ class Brain:
     
     self.add_vertex_color(name = rvert_name, path = curv_rh)
   
-  def __init__(self, subject_code, path=None, **kwargs):
+  @profiled('Brain.__init__')
+  def __init__(self, subject_code, path=None, lazy=False, **kwargs):
+    '''
+    If `lazy` is True, FreeSurfer files under `path` are not touched 
+    until needed: transforms are read on first access, and surfaces 
+    and volumes are loaded when accessed from `surfaces`/`volumes` 
+    (for example by `get_geometries` or `render`). Loading errors are
+    raised on access; `get_geometries` prints them and skips the item.
+    '''
     self._subject_code = subject_code
     self._xfm = IDENTITY4X4
     self._Norig = IDENTITY4X4
     self._Torig = IDENTITY4X4
+    self._transforms_pending = False
     self.meta = {}
-    self.surfaces = {}
-    self.volumes = {}
+    self.surfaces = LazyDict()
+    self.volumes = LazyDict()
     self.misc = BlankGeom(
       group = GeomGroup('_internal_group_data_%s' % subject_code),
       name = '_misc_%s' % subject_code
@@ -153,11 +189,17 @@ class Brain:
     self.Norig = kwargs.get('Norig', IDENTITY4X4)
     self.Torig = kwargs.get('Torig', IDENTITY4X4)
     
-    if path is not None and file_exists(path):
-      self._import_from_fspath(path)
+    if path is not None and (lazy or file_exists(path)):
+      self._import_from_fspath(path, lazy=lazy)
       surfaces=kwargs.get('surfaces', ['pial'])
       surface_color = kwargs.get('surface_colors', 'sulc')
       
+      if lazy:
+        for surf_type in surfaces:
+          self.surfaces.set_loader(
+            surf_type, self._lazy_surface_loader(surf_type, surface_color))
+        return
+      
       for surf_type in surfaces:
         try:
           self._load_surface(surf_type)
@@ -238,7 +280,13 @@ class Brain:
     elif volumes == False:
       volumes = []
     for v in volumes:
-      item = self.volumes.get( v, None )
+      try:
+        item = self.volumes.get( v, None )
+      except Exception as e:
+        # lazy volumes are loaded here
+        print('Failed to load volume type %s. Reasons:' % v)
+        print(e)
+        continue
       if item is not None and isinstance(item, BrainVolume):
         geoms.append( item._object )
     
@@ -248,7 +296,13 @@ class Brain:
     if surfaces == False:
       surfaces = []
     for s in surfaces:
-      item = self.surfaces.get( s, None )
+      try:
+        item = self.surfaces.get( s, None )
+      except Exception as e:
+        # lazy surfaces are loaded here
+        print('Failed to load surface type %s. Reasons:' % s)
+        print(e)
+        continue
       if item is not None and isinstance(item, BrainSurface):
         geoms.append( item.left_hemisphere )
         geoms.append( item.right_hemisphere )
@@ -259,6 +313,32 @@ class Brain:
     
     return geoms
   
+  def vol2surf(self, volume_type='T1', hemisphere='left', 
+    white='white', pial='pial', depths=[0.5], reduce='mean'):
+    '''
+    Sample a loaded volume onto a hemisphere between `white` and `pial`
+    surfaces (both must be loaded). If `pial` is None, the vertices of
+    `white` are sampled directly.
+    '''
+    stopifnot(volume_type in self.volumes,
+      msg='Volume %s is not loaded' % volume_type)
+    stopifnot(hemisphere in ('left', 'right'),
+      msg='hemisphere must be either "left" or "right"')
+    
+    def _hemisphere(surface_type):
+      if surface_type is None:
+        return None
+      surf = self.surfaces.get(surface_type, None)
+      stopifnot(surf is not None,
+        msg='Surface %s is not loaded' % surface_type)
+      return getattr(surf, '%s_hemisphere' % hemisphere)
+    
+    return vol2surf(
+      self.volumes[volume_type], white = _hemisphere(white), 
+      pial = _hemisphere(pial), Torig = self.Torig, depths = depths, 
+      reduce = reduce)
+  
+  @profiled('Brain.render')
   def render(self, 
     volumes = True, surfaces = True, start_zoom = 1, font_scale = 1,
     background = '#FFFFFF', side_canvas = True, side_width = 150, 
@@ -267,7 +347,17 @@ class Brain:
     palettes = {}, control_presets = [], coords=None,
     value_alias = {},
     value_ranges = {}, controllers = {}, start_server = True,
-    **kwargs):
+    incremental = True, **kwargs):
+    '''
+    Render the brain. With `incremental`, the output directory of the 
+    previous render is updated in place, and only geometries, groups and
+    cache files that have changed since are re-written
+    '''
+    
+    if incremental:
+      if getattr(self, '_render_cache', None) is None:
+        self._render_cache = RenderCache()
+      kwargs.setdefault('render_cache', self._render_cache)
     
     # collect volume information
     geoms = self.get_geometries( 
@@ -275,16 +365,7 @@ class Brain:
 
     global_data = self.global_data
     
-    presets = [
-      'subject2', 'surface_type2', 'hemisphere_material',
-      'map_template', 'electrodes'
-    ]
-    for p in control_presets:
-      if not p in presets:
-        presets.append( p )
-    for p in ['animation', 'display_highlights']:
-      if not p in presets:
-        presets.append( p )
+    presets = _control_presets( control_presets )
     
     if len(list(self.volumes.keys())) == 0:
       side_display = False
@@ -303,6 +384,19 @@ class Brain:
       start_server = start_server, **kwargs
     )
   
+  def save_bundle(self, path, float32=False):
+    '''
+    Save the brain, including cached data, into a single file that can 
+    be loaded (memory-mapped) by `Brain.load_bundle`
+    '''
+    from ._bundle import save_bundle
+    return save_bundle(self, path, float32=float32)
+  
+  @staticmethod
+  def load_bundle(path, mmap=True, cache_dir=None):
+    from ._bundle import load_bundle
+    return load_bundle(path, mmap=mmap, cache_dir=cache_dir)
+  
   def __str__(self):
     s = '''
     Brain - %s
@@ -321,6 +415,7 @@ class Brain:
   
   @property
   def vox2vox_MNI305(self):
+    self._ensure_transforms()
     mat = matmult4x4(
       matmult4x4(self._xfm, self._Norig),
       inv4x4( self._Torig )
@@ -336,6 +431,7 @@ class Brain:
     # It's the same as the following transform
     # (self$Torig %*% solve( self$Norig ) %*% c(0,0,0,1))[1:3]
     
+    self._ensure_transforms()
     re = matmult4x4( self._Norig, inv4x4( self._Torig) )
     return [-re[3], -re[7], -re[11]]
 
@@ -367,6 +463,57 @@ class Brain:
   
 
 
+def _control_presets(control_presets):
+  presets = [
+    'subject2', 'surface_type2', 'hemisphere_material',
+    'map_template', 'electrodes'
+  ]
+  for p in control_presets:
+    if not p in presets:
+      presets.append( p )
+  for p in ['animation', 'display_highlights']:
+    if not p in presets:
+      presets.append( p )
+  return presets
+
+def render_brains(brains, 
+  volumes = True, surfaces = True, side_display = True, 
+  control_presets = [], dedup_cache = True, **kwargs):
+  '''
+  Render multiple subjects in one viewer
+  
+  Cache files are copied by content (see `render_threejsbrain` with
+  `dedup_cache=True`), so meshes shared by subjects, for example
+  template surfaces, are only written once.
+  
+  Parameters
+  ----------
+  brains : list of Brain instances
+  volumes, surfaces : same as `Brain.render`
+  **kwargs : passed to `render_threejsbrain`
+  '''
+  stopifnot(all([isinstance(b, Brain) for b in brains]),
+    msg = 'brains must be a list of Brain instances')
+  stopifnot(len(set([b.subject_code for b in brains])) == len(brains),
+    msg = 'subject codes must be unique')
+  
+  geoms = []
+  global_data = {}
+  for brain in brains:
+    geoms.extend( brain.get_geometries( 
+      volumes = volumes, surfaces = surfaces, electrodes = True ))
+    global_data.update( brain.global_data )
+  
+  if all([len(b.volume_types) == 0 for b in brains]):
+    side_display = False
+  
+  return render_threejsbrain(
+    geoms = geoms, side_display = side_display, 
+    control_presets = _control_presets( control_presets ),
+    global_data = global_data, dedup_cache = dedup_cache, **kwargs
+  )
+
+
 class BrainVolume:
   def __init__(self, subject_code, volume_type, volume, position=None):
     self.subject_code = None
@@ -399,6 +546,14 @@ class BrainVolume:
     self.group.position[0] = pos[0]
     self.group.position[1] = pos[1]
     self.group.position[2] = pos[2]
+    self.group.mark_dirty()
+  
+  def set_value(self, *args, **kwargs):
+    '''
+    Attach overlay values to the volume, see `DataCubeGeom.set_value`
+    '''
+    stopifnot(self.has_volume, msg='volume missing data')
+    return self._object.set_value(*args, **kwargs)
   
   def __str__(self):
     return '''Subject\t\t: %s\nVolume type\t: %s''' % (
@@ -436,6 +591,8 @@ class BrainSurface:
       # merge right hemisphere to left
       for nm, re in right_hemisphere.group.group_data.items():
         left_hemisphere.group.group_data[ nm ] = re
+      # changed in place
+      left_hemisphere.group.mark_dirty()
       right_hemisphere.group = left_hemisphere.group
     
     self.group = left_hemisphere.group
@@ -498,6 +655,7 @@ Mesh type\t: %s''' % (
     self.group.position[0] = pos[0]
     self.group.position[1] = pos[1]
     self.group.position[2] = pos[2]
+    self.group.mark_dirty()
   
   @property
   def has_hemispheres(self):
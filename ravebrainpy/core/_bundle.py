@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+from ..utils import stopifnot, from_json, json_dump, normalize_path
+from ..utils import write_binary, read_binary, make_dirs, LazyDict
+from ._group import GeomGroup
+from ._keyframe import KeyFrame, KeyFrame2
+from ._geom_abs import AbstractGeom
+from ._geom_sphere import SphereGeom, ElectrodeGeom
+from ._geom_compact import CompactGeom, CompactSphereGeom
+from ._geom_compact import CompactElectrodeGeom, CompactKeyFrame
+from ._geom_blank import BlankGeom
+from ._geom_free import FreeGeom
+from ._geom_datacube import DataCubeGeom
+from ._brain import Brain, BrainSurface, BrainVolume
+
+BUNDLE_VERSION = 1
+
+# Numeric lists shorter than this are kept in the JSON index
+_MIN_ARRAY_SIZE = 64
+
+# Attributes that are only in-memory caches
+_TRANSIENT = ('cache_env', '_cube', '_revision')
+
+_CLASSES = dict([(cls.__name__, cls) for cls in (
+  GeomGroup, KeyFrame, KeyFrame2, AbstractGeom, SphereGeom,
+  ElectrodeGeom, BlankGeom, FreeGeom, DataCubeGeom, BrainSurface,
+  BrainVolume, CompactGeom, CompactSphereGeom, CompactElectrodeGeom,
+  CompactKeyFrame
+)])
+
+def _object_state(x):
+  '''
+  Attributes of `x`, including `__slots__` of compact classes
+  '''
+  if hasattr(x, '__dict__'):
+    return x.__dict__
+  state = {}
+  for cls in type(x).__mro__:
+    for k in cls.__dict__.get('__slots__', ()):
+      if hasattr(x, k):
+        state[k] = getattr(x, k)
+  return state
+
+def _typed_array(x, float32=False):
+  '''
+  Convert numeric list to typed array, or None. Integers are stored in
+  the smallest type; floating point numbers are kept as they are unless
+  `float32` (lossy)
+  '''
+  if isinstance(x, np.ndarray):
+    arr = x
+  else:
+    if len(x) < _MIN_ARRAY_SIZE:
+      return None
+    try:
+      arr = np.asarray(x)
+    except Exception as e:
+      return None
+  if arr.dtype.kind not in 'biuf' or arr.size < _MIN_ARRAY_SIZE:
+    return None
+  if arr.dtype.kind == 'f':
+    if float32:
+      return arr.astype(np.float32, copy=False)
+    return arr
+  if arr.dtype.kind in 'iu':
+    mn, mx = arr.min(), arr.max()
+    for dtype in (np.uint8, np.int16, np.int32):
+      info = np.iinfo(dtype)
+      if mn >= info.min and mx <= info.max:
+        return arr.astype(dtype, copy=False)
+  return arr
+
+
+class _Packer:
+  def __init__(self, float32=False):
+    self.float32 = float32
+    self.arrays = {}
+    self.objects = {}
+    self._ids = {}
+
+  def array(self, arr):
+    key = 'a%d' % len(self.arrays)
+    self.arrays[key] = arr
+    return { '__array__' : key }
+
+  def obj(self, x):
+    oid = self._ids.get(id(x), None)
+    if oid is None:
+      oid = 'o%d' % len(self._ids)
+      self._ids[id(x)] = oid
+      # register before packing state so cycles end here
+      self.objects[oid] = None
+      state = dict([(k, v) for k, v in _object_state(x).items()
+        if k not in _TRANSIENT])
+      self.objects[oid] = {
+        'class' : type(x).__name__,
+        'state' : self.pack(state)
+      }
+    return { '__object__' : oid }
+
+  def pack(self, x):
+    if type(x).__name__ in _CLASSES:
+      return self.obj(x)
+    if isinstance(x, dict):
+      return dict([(k, self.pack(v)) for k, v in x.items()])
+    if isinstance(x, (set, tuple, )):
+      return {
+        '__set__' if isinstance(x, set) else '__tuple__' :
+        [self.pack(v) for v in x] }
+    if isinstance(x, (list, np.ndarray, )):
+      arr = _typed_array(x, float32 = self.float32)
+      if arr is not None:
+        return self.array(arr)
+      return [self.pack(v) for v in x]
+    if isinstance(x, np.generic):
+      return x.item()
+    return x
+
+
+class _Unpacker:
+  def __init__(self, index, arrays):
+    self.arrays = arrays
+    self.specs = index['objects']
+    self.objects = {}
+    # create instances first so references can be resolved in any order
+    for oid, spec in self.specs.items():
+      cls = _CLASSES[spec['class']]
+      self.objects[oid] = cls.__new__(cls)
+    for oid, spec in self.specs.items():
+      obj = self.objects[oid]
+      state = self.unpack(spec['state'], as_list=True)
+      if hasattr(obj, '__dict__'):
+        obj.__dict__.update(state)
+      else:
+        for k, v in state.items():
+          object.__setattr__(obj, k, v)
+      if isinstance(obj, GeomGroup):
+        obj.cache_env = {}
+      if isinstance(obj, DataCubeGeom):
+        obj._cube = None
+
+  def unpack(self, x, as_list=False):
+    if isinstance(x, dict):
+      if '__object__' in x:
+        return self.objects[x['__object__']]
+      if '__array__' in x:
+        arr = self.arrays[x['__array__']]
+        # objects expect python lists, cache contents can stay arrays;
+        # memory-mapped arrays are not read into lists
+        if as_list and not isinstance(arr, np.memmap):
+          return arr.tolist()
+        return arr
+      if '__set__' in x:
+        return set([self.unpack(v, as_list) for v in x['__set__']])
+      if '__tuple__' in x:
+        return tuple([self.unpack(v, as_list) for v in x['__tuple__']])
+      return dict([(k, self.unpack(v, as_list)) for k, v in x.items()])
+    if isinstance(x, list):
+      return [self.unpack(v, as_list) for v in x]
+    return x
+
+
+def _read_cache(finfo):
+  path = finfo['absolute_path']
+  if finfo.get('is_binary', False):
+    header, arrays = read_binary(path)
+    return { 'header' : header, 'arrays' : arrays }
+  return from_json(from_file=path)
+
+def _write_cache(finfo, content, path):
+  if finfo.get('is_binary', False):
+    header = dict(content['header'])
+    header.pop('arrays', None)
+    write_binary(path, content['arrays'], header)
+  else:
+    # same writer as `json_cache`, so the content does not change
+    json_dump(content, path, backend = 'json')
+
+def _brain_groups(brain):
+  groups = []
+  for g in brain.get_geometries():
+    if g.group is not None and not g.group in groups:
+      groups.append(g.group)
+  return groups
+
+
+def save_bundle(brain, path, float32=False):
+  '''
+  Save `Brain` (transforms, geometries, groups, keyframes and the
+  contents of cache files) into one binary file; see `load_bundle`
+
+  Parameters
+  ----------
+  brain : Brain instance
+  path : path to the bundle
+  float32 : store floating point numbers as float32; the bundle is
+            smaller, but values (and re-created cache files) change
+
+  Returns
+  -------
+  Normalized path to the bundle
+  '''
+  stopifnot(isinstance(brain, Brain), msg='brain must be a Brain instance')
+  path = normalize_path(path)
+  packer = _Packer(float32 = float32)
+
+  # resolve lazy items
+  surfaces = dict(brain.surfaces.items())
+  volumes = dict(brain.volumes.items())
+
+  # cache files are read once and stored as typed arrays
+  cache_files = {}
+  for g in _brain_groups(brain):
+    for nm in g.cached_items:
+      finfo = g.group_data.get(nm, None)
+      if not isinstance(finfo, dict) or not 'absolute_path' in finfo:
+        continue
+      fpath = finfo['absolute_path']
+      if fpath in cache_files or not os.path.exists(fpath):
+        continue
+      cache_files[fpath] = {
+        'file_name' : finfo['file_name'],
+        'is_binary' : finfo.get('is_binary', False),
+        'content' : packer.pack(_read_cache(finfo))
+      }
+
+  brain._ensure_transforms()
+  index = {
+    'ravebrainpy_bundle' : BUNDLE_VERSION,
+    'subject_code' : brain.subject_code,
+    'xfm' : list(brain._xfm),
+    'Norig' : list(brain._Norig),
+    'Torig' : list(brain._Torig),
+    'meta' : packer.pack(brain.meta),
+    'paths' : brain._paths,
+    'misc' : packer.pack(brain.misc),
+    'surfaces' : packer.pack(surfaces),
+    'volumes' : packer.pack(volumes),
+    'electrodes' : packer.pack(brain.electrodes),
+    'cache_files' : cache_files
+  }
+  index['objects'] = packer.objects
+  write_binary(path, packer.arrays, index)
+  return path
+
+
+def load_bundle(path, mmap=True, cache_dir=None):
+  '''
+  Load `Brain` from bundle created by `save_bundle`
+
+  Parameters
+  ----------
+  path : path to the bundle
+  mmap : whether to memory-map typed arrays instead of reading them;
+         numeric data of objects are then read-only arrays instead of
+         lists
+  cache_dir : where to re-create cache files that no longer exist at
+              their original location (needed by the viewer), default
+              is '<path>_cache'
+
+  Returns
+  -------
+  Brain instance
+  '''
+  path = normalize_path(path)
+  index, arrays = read_binary(path, mmap=mmap)
+  stopifnot(index.get('ravebrainpy_bundle', 0) >= 1,
+    msg='%s is not a ravebrainpy bundle' % path)
+  if cache_dir is None:
+    cache_dir = path + '_cache'
+
+  unpacker = _Unpacker(index, arrays)
+
+  brain = Brain.__new__(Brain)
+  brain._subject_code = index['subject_code']
+  brain._transforms_pending = False
+  brain.xfm = index['xfm']
+  brain.Norig = index['Norig']
+  brain.Torig = index['Torig']
+  brain.meta = unpacker.unpack(index['meta'], as_list=True)
+  brain._paths = index['paths']
+  brain.misc = unpacker.unpack(index['misc'])
+  brain.surfaces = LazyDict(unpacker.unpack(index['surfaces']))
+  brain.volumes = LazyDict(unpacker.unpack(index['volumes']))
+  brain.electrodes = unpacker.unpack(index['electrodes'])
+
+  # restore cache files if missing, and prime group caches with the
+  # typed arrays so no JSON needs to be parsed
+  cache_files = index['cache_files']
+  contents = {}
+  relocated = {}
+  for g in _brain_groups(brain):
+    for nm in g.cached_items:
+      finfo = g.group_data.get(nm, None)
+      if not isinstance(finfo, dict) or not 'absolute_path' in finfo:
+        continue
+      fpath = finfo['absolute_path']
+      cf = cache_files.get(fpath, None)
+      if cf is None:
+        continue
+      if not fpath in contents:
+        contents[fpath] = unpacker.unpack(cf['content'])
+      content = contents[fpath]
+
+      if not os.path.exists(fpath):
+        if not fpath in relocated:
+          new_path = os.path.join(cache_dir, g.cache_name(), cf['file_name'])
+          if not os.path.exists(new_path):
+            make_dirs(os.path.dirname(new_path))
+            _write_cache(cf, content, new_path)
+          relocated[fpath] = new_path
+        new_path = relocated[fpath]
+        finfo = dict(finfo)
+        finfo['path'] = new_path
+        finfo['absolute_path'] = new_path
+        g.group_data[nm] = finfo
+
+      if not cf['is_binary']:
+        g.cache_env.update(content)
+
+  # keyframes and geometries pointing to relocated caches
+  for g in unpacker.objects.values():
+    if isinstance(g, (KeyFrame, CompactKeyFrame)) and \
+      g._cache_path in relocated:
+      g._cache_path = relocated[g._cache_path]
+    if getattr(g, 'cache_file', None) in relocated:
+      g.cache_file = relocated[g.cache_file]
+    if isinstance(g, DataCubeGeom):
+      name = 'datacube_value_%s' % g._data_name
+      dim = g.group.cache_env.get('datacube_dim_%s' % g._data_name, None)
+      value = g.group.cache_env.get(name, None)
+      if isinstance(value, np.ndarray) and dim is not None:
+        g._cube = value.reshape([int(x) for x in dim], order='F')
+
+  return brain
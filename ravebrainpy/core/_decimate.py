@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import numpy as np
+from ..utils import stopifnot
+
+DECIMATION_METHODS = ('lttb', 'minmax')
+
+def decimation_options(decimate):
+  '''
+  Normalize decimation options: number of frames, or dictionary with
+  `frames`, `resolution` (time between frames) and `method`
+  '''
+  if decimate is None:
+    return None
+  if not isinstance(decimate, dict):
+    decimate = { 'frames' : decimate }
+  opts = {
+    'frames' : decimate.get('frames', None),
+    'resolution' : decimate.get('resolution', None),
+    'method' : decimate.get('method', 'lttb')
+  }
+  stopifnot(opts['method'] in DECIMATION_METHODS,
+    msg = 'Decimation method must be one of %s' % ', '.join(
+      DECIMATION_METHODS))
+  stopifnot(opts['frames'] is not None or opts['resolution'] is not None,
+    msg = 'Decimation needs `frames` or `resolution`')
+  stopifnot(opts['frames'] is None or int(opts['frames']) >= 3,
+    msg = 'Decimation keeps at least 3 frames')
+  stopifnot(opts['resolution'] is None or opts['resolution'] > 0,
+    msg = 'Decimation `resolution` must be positive')
+  return opts
+
+def target_frames(time, frames=None, resolution=None):
+  '''
+  Number of frames to keep of time axis `time`: at most `frames`, and
+  at most one frame per `resolution` (time units); never less than 3
+  '''
+  n = len(time)
+  k = n
+  if frames is not None:
+    k = min(k, int(frames))
+  if resolution is not None and n > 1:
+    k = min(k, int((time[-1] - time[0]) / resolution) + 1)
+  return min(n, max(k, 3))
+
+def _lttb(time, values, k, shared):
+  # Largest-Triangle-Three-Buckets, one bucket at a time for all series
+  n_series, n = values.shape
+  rows = np.arange(n_series)
+  every = (n - 2) / (k - 2)
+  index = np.empty((n_series, k), dtype=np.int64)
+  index[:, 0] = 0
+  index[:, -1] = n - 1
+  a = np.zeros(n_series, dtype=np.int64)
+  for i in range(k - 2):
+    start = int(i * every) + 1
+    end = int((i + 1) * every) + 1
+    next_end = min(int((i + 2) * every) + 1, n)
+    # average of the next bucket
+    avg_t = time[end:next_end].mean()
+    avg_v = values[:, end:next_end].mean(axis=1)
+    ta = time[a]
+    va = values[rows, a]
+    area = np.abs(
+      (ta - avg_t)[:, None] * (values[:, start:end] - va[:, None]) -
+      (ta[:, None] - time[None, start:end]) * (avg_v - va)[:, None])
+    if shared:
+      j = np.argmax(area.sum(axis=0)) + start
+      j = np.full(n_series, j, dtype=np.int64)
+    else:
+      j = np.argmax(area, axis=1) + start
+    index[:, i + 1] = j
+    a = j
+  return index
+
+def _minmax(time, values, k):
+  # first and last frame, and the minimum and maximum of each bin
+  n_series, n = values.shape
+  n_bins = max(1, min((k - 2) // 2, (n - 2) // 2))
+  edges = np.linspace(1, n - 1, n_bins + 1).astype(np.int64)
+  index = np.empty((n_series, n_bins * 2 + 2), dtype=np.int64)
+  index[:, 0] = 0
+  index[:, -1] = n - 1
+  for i in range(n_bins):
+    start, end = edges[i], edges[i + 1]
+    segment = values[:, start:end]
+    lo = np.argmin(segment, axis=1) + start
+    hi = np.argmax(segment, axis=1) + start
+    # flat bins: keep two distinct frames
+    hi = np.where(lo == hi, np.where(lo == end - 1, start, end - 1), hi)
+    index[:, 2 * i + 1] = np.minimum(lo, hi)
+    index[:, 2 * i + 2] = np.maximum(lo, hi)
+  return index
+
+def decimation_error(time, values, index):
+  '''
+  Error of linear interpolation between the kept frames `index` (one
+  row per series) at all original frames
+
+  Returns
+  -------
+  Tuple of arrays (max absolute error, RMS error), one value per series
+  '''
+  n_series, n = values.shape
+  rows = np.arange(n_series)[:, None]
+  # lay the series end to end so one `np.interp` call handles all
+  span = time[-1] - time[0] + 1.0
+  x = (time - time[0])[None, :] + span * rows
+  recon = np.interp(x.ravel(), x[rows, index].ravel(),
+    values[rows, index].ravel()).reshape(values.shape)
+  err = np.abs(recon - values)
+  return err.max(axis=1), np.sqrt((err ** 2).mean(axis=1))
+
+def decimate_series(time, values, frames=None, resolution=None,
+  method='lttb', shared=False):
+  '''
+  Shape-preserving downsampling of series that share a time axis
+
+  Parameters
+  ----------
+  time : increasing time stamps, length T
+  values : (S, T) array, one row per series (or length T for one)
+  frames, resolution : frames to keep, see `target_frames`
+  method : 'lttb' (Largest-Triangle-Three-Buckets) keeps the visual
+           shape; 'minmax' keeps the minimum and maximum of each bin
+           (the value range is preserved)
+  shared : keep the same frames for all series (LTTB of all series
+           together); required if the series are stored with one time
+           axis
+
+  Returns
+  -------
+  Tuple (index, report): kept frames as an (S, k) integer array (one
+  row if `shared`), and a dictionary with frames before and after,
+  maximum absolute, RMS and relative (to the value range) errors of
+  linear interpolation between kept frames
+  '''
+  time = np.asarray(time, dtype=np.float64)
+  values = np.asarray(values, dtype=np.float64)
+  if values.ndim == 1:
+    values = values[None, :]
+  stopifnot(values.ndim == 2 and values.shape[1] == len(time),
+    msg = '`values` must have one column per time stamp')
+  stopifnot(bool(np.all(np.diff(time) >= 0)),
+    msg = '`time` must be increasing')
+  stopifnot(method in DECIMATION_METHODS,
+    msg = 'Decimation method must be one of %s' % ', '.join(
+      DECIMATION_METHODS))
+  k = target_frames(time, frames = frames, resolution = resolution)
+  n_series, n = values.shape
+  if k >= n:
+    # nothing to remove
+    index = np.tile(np.arange(n), (n_series, 1))
+    max_err = rms_err = rel_err = np.zeros(n_series)
+  else:
+    if method == 'lttb' or shared:
+      index = _lttb(time, values, k, shared)
+    else:
+      index = _minmax(time, values, k)
+    max_err, rms_err = decimation_error(time, values, index)
+    value_range = values.max(axis=1) - values.min(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      rel_err = np.where(value_range > 0, max_err / value_range, 0.0)
+  if shared:
+    index = index[:1]
+  report = {
+    'method' : 'lttb' if shared else method,
+    'series' : n_series,
+    'frames_before' : n,
+    'frames_after' : index.shape[1],
+    'max_abs_error' : float(max_err.max()) if n_series else 0.0,
+    'rms_error' : float(np.sqrt((rms_err ** 2).mean()))
+      if n_series else 0.0,
+    'max_relative_error' : float(rel_err.max()) if n_series else 0.0
+  }
+  return index, report
+
+def _merge_reports(reports):
+  n_series = sum([r['series'] for r in reports])
+  return {
+    'method' : reports[0]['method'],
+    'series' : n_series,
+    'time_axes' : len(reports),
+    'frames_before' : max([r['frames_before'] for r in reports]),
+    'frames_after' : max([r['frames_after'] for r in reports]),
+    'max_abs_error' : max([r['max_abs_error'] for r in reports]),
+    'rms_error' : float(np.sqrt(sum([
+      r['rms_error'] ** 2 * r['series'] for r in reports]) /
+      max(n_series, 1))),
+    'max_relative_error' : max([r['max_relative_error']
+      for r in reports])
+  }
+
+def decimate_keyframes(geoms, frames=None, resolution=None,
+  method='lttb'):
+  '''
+  Decimate continuous keyframes of `geoms` (see `decimate_series`).
+  Keyframes with the same name and time axis, for example one per
+  electrode, are decimated together. The keyframes are not changed;
+  keyframes already written to caches are skipped.
+
+  Returns
+  -------
+  Tuple (report, decimated): report per keyframe name (series and time
+  axes decimated, frames before and after, and the interpolation
+  errors), and the decimated `(time, value)` lists by `id` of keyframe
+  '''
+  # (name, time axis) -> keyframes
+  batches = {}
+  for g in geoms:
+    for nm, kf in g.keyframes.items():
+      if kf.cached or not kf.is_continuous or kf._time is None:
+        continue
+      n = len(kf._time)
+      if target_frames(kf._time, frames = frames,
+        resolution = resolution) >= n:
+        continue
+      batches.setdefault((nm, tuple(kf._time)), []).append(kf)
+  reports = {}
+  decimated = {}
+  for (nm, time), kfs in batches.items():
+    time = np.asarray(time)
+    values = np.array([kf._values for kf in kfs], dtype=np.float64)
+    # time stamps are not required to be sorted
+    order = np.argsort(time, kind='stable')
+    time = time[order]
+    values = values[:, order]
+    index, report = decimate_series(time, values, frames = frames,
+      resolution = resolution, method = method)
+    for kf, idx, v in zip(kfs, index, values):
+      decimated[id(kf)] = (time[idx].tolist(), v[idx].tolist())
+    reports.setdefault(nm, []).append(report)
+  return dict([(nm, _merge_reports(r)) for nm, r in reports.items()]), \
+    decimated
@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import math
-from ..utils import stopifnot, as_dict
+from ..utils import stopifnot, as_dict, Tracked
 from ._keyframe import KeyFrame
-class AbstractGeom:
+class AbstractGeom(Tracked):
+  # class of keyframes created by `set_value`
+  _keyframe_class = KeyFrame
   
   def __init__(self, name, position = [0,0,0], 
                 group = None, layer = [0] ):
@@ -75,7 +77,7 @@ class AbstractGeom:
       value = value.copy()
     
     # Create new keyfrems
-    kf = KeyFrame(name=name, value=value, time=time_stamp, 
+    kf = self._keyframe_class(name=name, value=value, time=time_stamp, 
       dtype='discrete' if type(value[0]) is str else 'continuous',
       target=target)
     
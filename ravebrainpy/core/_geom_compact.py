@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from types import MappingProxyType
+from ..utils import stopifnot, Tracked
+from ._keyframe import KeyFrame
+from ._geom_abs import AbstractGeom
+
+# Shared by all geometries without keyframes (read-only)
+_NO_KEYFRAMES = MappingProxyType({})
+_ORIGIN = (0, 0, 0)
+
+def layer_mask(layer):
+  '''
+  Bitmask of camera layers, e.g. [0, 1] -> 3
+  '''
+  if isinstance(layer, int):
+    return layer
+  mask = 0
+  for l in layer:
+    stopifnot(isinstance(l, int) and 0 <= l < 32,
+      msg = 'layer must be integer from 0-31')
+    mask |= 1 << l
+  return mask
+
+def mask_layer(mask):
+  '''
+  Set of camera layers of a bitmask
+  '''
+  return set([l for l in range(32) if mask >> l & 1])
+
+
+class CompactKeyFrame(Tracked):
+  '''
+  `KeyFrame` without per-instance `__dict__`; same arguments, methods
+  and `to_dict` output
+  '''
+  __slots__ = ('name', 'cached', '_cache_path', 'target', '_dtype',
+    '_time', '_values', '_levels', '_revision')
+
+  __init__ = KeyFrame.__init__
+  to_dict = KeyFrame.to_dict
+  use_cache = KeyFrame.use_cache
+  set_cached = KeyFrame.set_cached
+  is_continuous = KeyFrame.is_continuous
+  time_range = KeyFrame.time_range
+  value_range = KeyFrame.value_range
+  value_names = KeyFrame.value_names
+
+
+class CompactGeom(Tracked):
+  '''
+  Memory-compact variant of `AbstractGeom` for scenes with many
+  geometries (e.g. tens of thousands of electrode contacts)
+
+  Instances have no `__dict__`; layers are kept as a bitmask and
+  geometries without keyframes share one empty mapping. `to_dict`
+  returns the same dictionary as `AbstractGeom`. Differences: `position`
+  is a tuple and `layer` returns a new set, so both must be assigned
+  (`set_position`, `g.layer = [0, 1]`) rather than changed in place.
+  '''
+  __slots__ = ('name', 'time_stamp', 'value', '_keyframes', 'position',
+    'group', 'clickable', '_layer', 'use_cache', 'custom_info',
+    'subject_code', '_revision')
+  geom_type = 'abstract'
+  _keyframe_class = CompactKeyFrame
+
+  def __init__(self, name, position = _ORIGIN, group = None,
+    layer = (0, )):
+    self.name = name
+    self.time_stamp = None
+    self.value = None
+    self._keyframes = None
+    self.clickable = True
+    self.use_cache = False
+    self.custom_info = ''
+    self.subject_code = None
+    self.set_position(position)
+    self.group = group
+    stopifnot(all([l in range(14) for l in layer]), msg='''\
+    layer must be integer from 0-13
+      0: main camera-only
+      1: all cameras
+      13: invisible''')
+    self._layer = layer_mask(layer)
+
+  def set_position(self, *args):
+    AbstractGeom.set_position(self, *args)
+    self.position = tuple(self.position)
+
+  @property
+  def layer(self):
+    return mask_layer(self._layer)
+
+  @layer.setter
+  def layer(self, layer):
+    self._layer = layer_mask(layer)
+
+  @property
+  def keyframes(self):
+    if self._keyframes is None:
+      return _NO_KEYFRAMES
+    return self._keyframes
+
+  def set_value(self, name, value=None, time_stamp=None,
+    target = ".material.color", *args, **kwargs):
+    if self._keyframes is None:
+      self._keyframes = {}
+    try:
+      return AbstractGeom.set_value(self, name, value, time_stamp, target,
+        *args, **kwargs)
+    finally:
+      if len(self._keyframes) == 0:
+        self._keyframes = None
+
+  to_dict = AbstractGeom.to_dict
+  get_data = AbstractGeom.get_data
+  animation_time_range = AbstractGeom.animation_time_range
+  animation_value_range = AbstractGeom.animation_value_range
+  animation_value_names = AbstractGeom.animation_value_names
+  animation_types = AbstractGeom.animation_types
+
+
+class CompactSphereGeom(CompactGeom):
+  '''
+  Memory-compact variant of `SphereGeom`, see `CompactGeom`
+  '''
+  __slots__ = ('radius', 'width_segments', 'height_segments')
+  geom_type = 'sphere'
+
+  def __init__(self, name, position = _ORIGIN, radius = 5, **kwargs):
+    super().__init__(name = name, position = position,
+      group = kwargs.get('group', None),
+      layer = kwargs.get('layer', (0, )))
+    self.radius = radius
+    self.width_segments = kwargs.get('width_segments', 10)
+    self.height_segments = kwargs.get('height_segments', 6)
+
+    if 'value' in kwargs:
+      self.set_value(
+        value = kwargs.get('value', None),
+        time_stamp = kwargs.get('time_stamp', None),
+        name = kwargs.get('value_name', 'default')
+      )
+
+  def to_dict(self):
+    re = super().to_dict()
+    re['radius'] = self.radius
+    re['width_segments'] = self.width_segments
+    re['height_segments'] = self.height_segments
+    return re
+
+
+class CompactElectrodeGeom(CompactSphereGeom):
+  '''
+  Memory-compact variant of `ElectrodeGeom`, see `CompactGeom`.
+  `MNI305_position` is a tuple
+  '''
+  __slots__ = ('is_surface_electrode', 'use_template', 'surface_type',
+    'hemisphere', 'vertex_number', 'MNI305_position')
+
+  def __init__(self, **kwargs):
+    super().__init__(**kwargs)
+    self.is_surface_electrode = True
+    self.use_template = False
+    self.surface_type = 'pial'
+    self.hemisphere = None
+    self.vertex_number = -1
+    self.MNI305_position = _ORIGIN
+
+  def to_dict(self):
+    re = super().to_dict()
+    re['is_electrode'] = True
+    re['is_surface_electrode'] = self.is_surface_electrode
+    re['use_template'] = self.use_template
+    re['surface_type'] = self.surface_type
+    re['hemisphere'] = self.hemisphere
+    re['vertex_number'] = self.vertex_number
+    re['MNI305_position'] = list(self.MNI305_position)
+    re['sub_cortical'] = not self.is_surface_electrode
+    re['search_geoms'] = self.hemisphere
+    return re
@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import os
+import re
 from ..utils import stopifnot, json_cache, rand_string, tempfile
-from ..utils import normalize_path
+from ..utils import binary_cache, quantize
+from ..utils import normalize_path, from_json
 from ._geom_abs import AbstractGeom
 from ._keyframe import KeyFrame2
 from ._group import GeomGroup
@@ -16,18 +18,25 @@ def _spread_cube(cube):
   
 
 class DataCubeGeom(AbstractGeom):
+  # cube loaded from cache, not part of the rendered state
+  _untracked = ('_cube', )
+  
   def __init__(self, name, group, 
     value=None, dim = None, half_size = [128,128,128], position=[0,0,0],
-    cache_file=None, layer = [13], digest=True, **kwargs):
+    cache_file=None, layer = [13], digest=True, digest_header=None,
+    **kwargs):
     super().__init__(name=name,position=position,layer=layer,**kwargs)
     
     if group is None or not isinstance(group, GeomGroup):
       group = GeomGroup(name='default' + rand_string(5))
     self.group = group
+    self.cache_file = None
+    self._dim = None
     
     if cache_file is not None:
       if cache_file == True:
         cache_file = tempfile(ext = '.json')
+      self.cache_file = normalize_path(cache_file)
       
       # case 1: only use cache file
       if value is None:
@@ -46,6 +55,7 @@ class DataCubeGeom(AbstractGeom):
         # still check data
         if dim is None or len(dim) != 3:
           dim = _get_dim(value)
+        self._dim = list(dim)
         value = _spread_cube(value)
         data = {
           'datacube_value_%s' % name : value,
@@ -53,7 +63,8 @@ class DataCubeGeom(AbstractGeom):
           'datacube_half_size_%s' % name : half_size,
         }
         
-        re = json_cache(path = cache_file, data=data, digest=digest)
+        re = json_cache(path = cache_file, data=data, digest=digest,
+          digest_header=digest_header)
       self.group.set_group_data(
         name = 'datacube_value_%s' % name,
         value = re, is_cached = True
@@ -69,6 +80,7 @@ class DataCubeGeom(AbstractGeom):
     else:
       if dim is None or len(dim) != 3:
         dim = _get_dim(value)
+      self._dim = list(dim)
       value = _spread_cube(value)
       self.group.set_group_data(
         name = 'datacube_value_%s' % name,
@@ -85,11 +97,145 @@ class DataCubeGeom(AbstractGeom):
     
     self.geom_type = 'datacube'
     self.clickable = False
+    # name might be changed later (see BrainVolume), but the group data
+    # keys are fixed at creation
+    self._data_name = name
+    self._cube = None
   
-  def set_value(self):
-    print('set_value has not been implemented yet')
-    pass
+  def _get_data_raw(self, *keys):
+    '''
+    Values of group data `keys` (list); each cache file is read once
+    '''
+    files = {}
+    re = []
+    for key in keys:
+      if key in self.group.cache_env:
+        re.append(self.group.cache_env[key])
+        continue
+      v = self.group.group_data.get(key, None)
+      if type(v) is dict and v.get('is_cache', False) == True:
+        # read directly, do not keep the python lists in group.cache_env
+        path = v['absolute_path']
+        if not path in files:
+          files[path] = from_json(from_file = path)
+        v = files[path][key]
+      re.append(v)
+    return re
   
-
-
+  def get_cube(self, force_reload=False):
+    '''
+    Returns the cube as a 3D numpy array, loaded once and kept in memory
+    '''
+    if self._cube is not None and not force_reload:
+      return self._cube
+    import numpy as np
+    name = self._data_name
+    dim, value = self._get_data_raw('datacube_dim_%s' % name, 
+      'datacube_value_%s' % name)
+    self._cube = np.asarray(value).reshape(
+      [int(x) for x in dim], order='F')
+    return self._cube
   
+  def set_value(self, value = None, time_stamp = 0, name = 'Value',
+    dtype = 'uint8', threshold = None, value_range = None,
+    target = '.material.uniforms.overlay', **kwargs):
+    '''
+    Add functional overlay (static or with time frames) to the cube
+    
+    Parameters
+    ----------
+    value : 3D array for static overlay, or 4D array with time as the
+            last dimension; must be aligned with the cube
+    time_stamp : time of each frame
+    name : variable name, used by `ColorMap`
+    dtype : storage type, 'uint8', 'uint16' (quantized within
+            `value_range`), 'float16', or 'float32'
+    threshold : if not None, only voxels whose absolute value is at
+                least `threshold` (in any frame) are stored
+    value_range : quantization range, default is the range of `value`
+    
+    The overlay is written to a binary cache next to the cube cache. The
+    viewer shows it on the cube slices while `name` is the selected
+    animation (the frame at the current time), colored from blue to red
+    within `value_range`; the colors of `ColorMap` are not used.
+    
+    Returns
+    -------
+    KeyFrame2 instance, whose values are the value range
+    '''
+    import numpy as np
+    
+    name = name.strip()
+    # check length of value
+    if value is None or len(value) == 0:
+      # remove keyframe
+      return self.keyframes.pop(name, None)
+    
+    value = np.asarray(value)
+    stopifnot(value.ndim in (3, 4),
+      msg = 'value must be a 3D volume or 4D (volume x time) array')
+    stopifnot(np.issubdtype(value.dtype, np.number),
+      msg = 'DataCubeGeom only supports continuous values')
+    if value.ndim == 3:
+      value = value[..., np.newaxis]
+    dim = list(value.shape[:3])
+    if self._dim is None:
+      # cube loaded from cache file
+      self._dim = list(self._get_data_raw(
+        'datacube_dim_%s' % self._data_name)[0])
+    stopifnot([int(x) for x in self._dim] == dim, 
+      msg = 'value dimension %s does not match the cube %s' % (
+        dim, self._dim))
+    
+    n_frames = value.shape[3]
+    if not isinstance(time_stamp, (list, tuple, np.ndarray, )):
+      time_stamp = [time_stamp]
+    time_stamp = [float(t) for t in time_stamp]
+    stopifnot(len(time_stamp) == n_frames,
+      msg = 'Please specify time_stamp for each frame')
+    
+    # voxels x frames, Fortran order to be consistent with cube cache
+    value = value.reshape((-1, n_frames), order = 'F')
+    header = {
+      'name' : name,
+      'dim' : dim,
+      'n_frames' : n_frames,
+      'time' : time_stamp,
+      'sparse' : threshold is not None,
+      'threshold' : threshold
+    }
+    arrays = {}
+    if threshold is not None:
+      with np.errstate(invalid = 'ignore'):
+        sel = np.any(np.abs(value) >= threshold, axis = 1)
+      index = np.flatnonzero(sel)
+      value = value[index, :]
+      arrays['index'] = index.astype(np.uint32)
+    q, qinfo = quantize(value, dtype = dtype, value_range = value_range)
+    header.update(qinfo)
+    arrays['value'] = q
+    
+    # binary cache file, decoded by the viewer and shown on the cube
+    # slices (frame by time, while its variable is the animation)
+    if self.cache_file is not None:
+      cache_dir, base = os.path.split(os.path.splitext(self.cache_file)[0])
+    else:
+      cache_dir, base = self.group.cache_path, self._data_name
+    cf = os.path.join(cache_dir, re.sub(
+      pattern = r'[^a-zA-Z0-9._-]', 
+      repl = '_', 
+      string = '%s__%s.bin' % (base, name)
+    ))
+    dname = 'datacube_overlay_%s_%s' % (name, self._data_name)
+    finfo = binary_cache(path = cf, arrays = arrays, header = header)
+    
+    # keyframe with summary per frame, values are replaced by the range
+    # once cached (same as FreeGeom)
+    vrange = qinfo['value_range']
+    kf = KeyFrame2(name = name, time = time_stamp, 
+      value = [vrange[1]] * n_frames, target = target)
+    kf.set_cached(path = finfo['absolute_path'], value_range = vrange)
+    
+    self.keyframes[name] = kf
+    self.group.set_group_data(dname, value = finfo, is_cached = True)
+    return kf
@@ -1,13 +1,58 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import os
+import time
 from ..utils import stopifnot, as_dict, json_cache, normalize_path
+from ..utils import record_stage
 from ._keyframe import KeyFrame2 
+from ._decimate import decimate_series, decimation_options
 from ._geom_abs import AbstractGeom
 
+def check_mesh(vertex, face):
+  '''
+  Validate mesh `vertex` (N, 3) positions and `face` (M, 3) vertex 
+  indices (0-based); lists are converted once with `np.asarray`
+  
+  Returns
+  -------
+  Tuple of arrays (vertex, face): real vertex positions keep their 
+  float type, face indices are integers
+  '''
+  import numpy as np
+  vertex = np.asarray(vertex)
+  face = np.asarray(face)
+  if vertex.size == 0:
+    vertex = vertex.reshape((0, 3))
+  if face.size == 0:
+    face = face.reshape((0, 3)).astype(np.int64)
+  stopifnot(vertex.ndim == 2 and vertex.shape[1] == 3, msg = '''
+`vertex` must be a (N, 3) array or a list of 3, for example:
+vertex=[[1,2,3], [1,3,4], ...]''')
+  stopifnot(face.ndim == 2 and face.shape[1] == 3, msg = '''
+`face` must be a (M, 3) array or a list of 3, for example:
+face=[[0,1,2], [0,1,3], ...]''')
+  stopifnot(vertex.dtype.kind in 'iuf', 
+    msg = '`vertex` must be numeric, got %s' % vertex.dtype)
+  if vertex.dtype.kind != 'f':
+    vertex = vertex.astype(np.float64)
+  stopifnot(bool(np.isfinite(vertex).all()), 
+    msg = '`vertex` must not contain NaN or infinite values')
+  if face.dtype.kind == 'f':
+    stopifnot(bool(np.isfinite(face).all()) and 
+      bool((face == np.round(face)).all()),
+      msg = '`face` must contain integer vertex indices')
+    face = face.astype(np.int64)
+  stopifnot(face.dtype.kind in 'iu',
+    msg = '`face` must contain integer vertex indices, got %s' % face.dtype)
+  if face.size > 0:
+    stopifnot(face.min() >= 0 and face.max() < vertex.shape[0],
+      msg = '`face` indices must be within 0-%d (0-based)' % (
+        vertex.shape[0] - 1))
+  return vertex, face
+
 class FreeGeom(AbstractGeom):
   def __init__(self, name, group, vertex=None, face=None,
-    position = [0,0,0], cache_file=None, **kwargs):
+    position = [0,0,0], cache_file=None, digest_header=None, **kwargs):
     
     # Initialization
     super().__init__(name=name, position = position, **kwargs)
@@ -19,6 +64,7 @@ class FreeGeom(AbstractGeom):
     self.clickable = False
     self.hemisphere = None
     self.surface_type = None
+    self._data_name = name
     
     # Set cache_file
     if cache_file is not None:
@@ -42,15 +88,7 @@ class FreeGeom(AbstractGeom):
           'is_cache' : True
         }
     if vertex is not None and face is not None:
-      for v in vertex:
-        stopifnot(len(v) == 3, msg = '''
-Each element of `vertex` must be a list of 3, for example:
-vertex=[[1,2,3], [1,3,4], ...]''')
-      
-      for f in face:
-        stopifnot(len(f) == 3, msg = '''
-Each element of `face` must be a list of 3, for example:
-face=[[0,1,2], [0,1,3], ...]''')
+      vertex, face = check_mesh(vertex, face)
       
       if cache_file is not None:
         data = {
@@ -58,14 +96,18 @@ face=[[0,1,2], [0,1,3], ...]''')
           'free_faces_%s' % name : face
         }
         # Do NOT recache if exists
-        re = json_cache(path = cache_file, data = data)
+        re = json_cache(path = cache_file, data = data, 
+          digest_header = digest_header)
         self.group.set_group_data(
           'free_vertices_%s' % name, value = re, is_cached = True )
         self.group.set_group_data(
           'free_faces_%s' % name, value = re, is_cached = True )
       else:
-        self.group.set_group_data('free_vertices_%s' % name, value = vertex)
-        self.group.set_group_data('free_faces_%s' % name, value = face)
+        # `get_data` returns lists, same as for cached meshes
+        self.group.set_group_data('free_vertices_%s' % name, 
+          value = vertex.tolist())
+        self.group.set_group_data('free_faces_%s' % name, 
+          value = face.tolist())
     else:
       re = {
         'path' : cache_file,
@@ -80,8 +122,25 @@ face=[[0,1,2], [0,1,3], ...]''')
         'free_faces_%s' % name, value = re, is_cached = True )
     pass
   
+  def get_vertices(self, force_reload=False):
+    '''
+    Returns vertex positions as (N, 3) numpy array
+    '''
+    import numpy as np
+    v = self.get_data('free_vertices_%s' % self._data_name,
+      force_reload=force_reload)
+    stopifnot(v is not None, msg='Cannot find vertices for %s' % self.name)
+    return np.asarray(v, dtype=np.float64).reshape((-1, 3))
+  
   def set_value(self, value = None, time_stamp=0, name='Value',
-    target=".geometry.attributes.color.array", **kwargs):
+    target=".geometry.attributes.color.array", decimate=None, **kwargs):
+    '''
+    Set vertex values, one element of `value` (vertex values) per time
+    point in `time_stamp`. `decimate` (number of frames, or dictionary 
+    of `frames`, `resolution` and `method`) keeps the same subset of 
+    time points for all vertices, see `decimate_series`; the report is
+    recorded as stage 'decimate' when instrumented
+    '''
     
     stopifnot(self.cache_file is not None, 
       msg='Must enable cache_file to set values for a Free geometry')
@@ -96,11 +155,25 @@ face=[[0,1,2], [0,1,3], ...]''')
       # remove keyframe
       return self.keyframes.pop(name, None)
     
+    decimate = decimation_options(decimate)
+    if decimate is not None and not isinstance(value[0], str) and \
+      isinstance(time_stamp, (list, tuple, )) and len(time_stamp) > 3:
+      import numpy as np
+      start = time.perf_counter()
+      index, report = decimate_series(time_stamp, 
+        np.asarray(value, dtype=np.float64).reshape(
+          (len(time_stamp), -1)).T, shared = True, **decimate)
+      order = [int(i) for i in index[0]]
+      value = [value[i] for i in order]
+      time_stamp = [time_stamp[i] for i in order]
+      record_stage('decimate', time.perf_counter() - start, 
+        keyframe = name, **report)
+    
     kf = KeyFrame2(name=name, value=value, time=time_stamp,
       dtype = 'discrete' if isinstance(value[0], str) else 'continuous',
       target = target)
     
-    cf = self.cache_file.rstrip('.json') + '__' + name + '.json'
+    cf = os.path.splitext(self.cache_file)[0] + '__' + name + '.json'
     dname = 'free_vertex_colors_%s_%s' % (name, self.name)
     
     kf.use_cache( path = cf, name = dname )
@@ -5,11 +5,12 @@ import os
 from ..utils import *
 MAT4IDENTITY = (1,0,0,0,0,1,0,0,0,0,1,0,0,0,0,1,)
 
-class GeomGroup(object):
+class GeomGroup(Tracked):
   '''
   Geometry group that contains multiple geometries with their shared 
   data
   '''
+  _untracked = ('cache_env', )
   
   def __str__(self):
     template = '''Geometry group <%s>
@@ -110,6 +111,7 @@ Parameters:
     self.group_data[name] = value
     if is_cached:
       self.cached_items.append( name )
+    self.mark_dirty()
     return value
     
   
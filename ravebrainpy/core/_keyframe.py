@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import math
-from ..utils import stopifnot, as_dict, json_cache
+from ..utils import stopifnot, as_dict, json_cache, Tracked
 
-class KeyFrame:
+class KeyFrame(Tracked):
   
   def __init__(self, name, time, value, dtype='continuous',
     target = ".material.color"):
@@ -71,10 +71,19 @@ class KeyFrame:
     json_cache(path=path, data={
       name : self.to_dict()
     })
+    self.set_cached(path)
+  
+  def set_cached(self, path, value_range=None):
+    '''
+    Mark keyframe as cached to `path`; values kept in memory are
+    reduced to the value range (continuous) or levels (discrete)
+    '''
     self._cache_path = path
     self.cached = True
     if self.is_continuous:
-      self._values = [min(self._values), max(self._values)]
+      if value_range is None:
+        value_range = [min(self._values), max(self._values)]
+      self._values = [value_range[0], value_range[1]]
     else:
       self._values = self._levels
     
@@ -105,6 +114,9 @@ class KeyFrame:
 class KeyFrame2(KeyFrame):
   def __init__(self, name, time, value, dtype = "continuous", 
     target = ".geometry.attributes.color.array"):
+    self.cached = False
+    self._cache_path = None
+    self._levels = None
     if dtype == 'continuous':
       # Please make sure vakue and time are valid, no checks here
       self._dtype = 'continuous'
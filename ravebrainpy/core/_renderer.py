@@ -1,15 +1,24 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import os
+import posixpath
 import shutil
 import json
+import gzip
 import atexit
-from ..utils import port_occupied, tempfile, make_parent_dir, make_dirs
-from ..utils import open_browser, start_simple_server
+import time
+from ..utils import tempfile, make_parent_dir, make_dirs
+from ..utils import open_browser, register_session, show_url, content_digest
+from ..utils import stopifnot, to_json, ROUTE_FILE, json_dumps
+from ..utils import unlink, get_session, get_workspace
+from ..utils import get_store, store_object, STORE_PREFIX, CONTENT_DIR
+from ..utils import stage, timed, instrumenting, record_stage, record_payload
 from ._group import GeomGroup
 from ._keyframe import KeyFrame, ColorMap
 from ._geom_abs import AbstractGeom
 from ._geom_blank import BlankGeom
+from ._assets import link_assets, INDEX_TEMPLATE
+from ._decimate import decimate_keyframes, decimation_options
 
 # import ravebrainpy
 # __file__ = ravebrainpy.core
@@ -18,6 +27,7 @@ from ._geom_blank import BlankGeom
 # c.render_threejsbrain(background="#ccff99")
 
 
+@timed('render')
 def render_threejsbrain(
   geoms=[], background = "#FFFFFF", font_scale=1, timestamp=True,
   side_canvas=True, side_zoom=1, side_width=250, side_shift=[0,0],
@@ -27,7 +37,24 @@ def render_threejsbrain(
   value_ranges={}, value_alias={}, show_inactive_electrodes=True, 
   widget_id="threebrain_data", tmp_dirname=None, debug=False,
   token=None, controllers={}, global_data={}, global_files={},
-  start_server=False):
+  start_server=False, dedup_cache=False, copy_assets=False,
+  cache_files='auto', inline_data=False, compress_data=False,
+  render_cache=None, decimate=None):
+  '''
+  Render geometries to a viewer directory
+  
+  If `render_cache` (`RenderCache`) is given, the output directory and
+  serialized geometries, groups and color maps of the previous render 
+  are kept in it, and only what has changed since is re-generated and
+  re-written.
+  
+  `decimate` (number of frames, or dictionary of `frames`, `resolution`
+  and `method`, see `decimate_keyframes`) downsamples long time series
+  of keyframes in the serialized data (the geometries are not changed);
+  the report with the errors introduced is kept in 
+  `render_cache.stats['decimation']`.
+  '''
+  decimate = decimation_options(decimate)
   
   # ------------------------ Data check ---------------------
   if len( camera_center ) != 3:
@@ -75,23 +102,51 @@ def render_threejsbrain(
   
   # 3. color
   # get color schema
-  pnames = list(palettes.keys())
-  animation_types = list(animation_types)
-  color_maps = {}
-  for atype in animation_types:
-    cmap = ColorMap(name = atype, geoms = geoms, 
-      alias = value_alias.get(atype, None))
-    if atype in pnames:
-      cmap.set_colors( palettes[atype] )
-    if cmap.value_type == 'continuous':
-      vrg = value_ranges.get(atype, [])
-      if len(vrg) >= 2:
-        cmap.value_range = [vrg[0], vrg[1]]
-        if len(vrg) >= 4:
-          cmap.hard_range = [vrg[2], vrg[3]]
-          if vrg[2] > vrg[3]:
-            cmap.hard_range = [vrg[3], vrg[2]]
-    color_maps[ atype ] = cmap.to_dict()
+  if render_cache is None:
+    render_cache = RenderCache()
+  render_cache.stats = {}
+  # decimated keyframes only replace the serialized time series, the
+  # keyframes of `geoms` keep all frames
+  decimated = {}
+  decimate_key = None
+  if decimate is not None:
+    decimate_key = tuple(sorted(decimate.items()))
+    with stage('render.decimate'):
+      render_cache.stats['decimation'], decimated = decimate_keyframes(
+        geoms, **decimate)
+  with stage('render.colormap'):
+    pnames = list(palettes.keys())
+    animation_types = list(animation_types)
+    color_maps = {}
+    cmap_cache = {}
+    for atype in animation_types:
+      # color maps only depend on the keyframes of the same name
+      key = (
+        tuple([(id(g), id(g.keyframes[atype]), g.keyframes[atype].revision)
+          for g in geoms if atype in g.keyframes]),
+        repr(palettes.get(atype, None)), repr(value_ranges.get(atype, None)),
+        repr(value_alias.get(atype, None))
+      )
+      cached = render_cache.colormaps.get(atype, None)
+      if cached is not None and cached[0] == key:
+        color_maps[ atype ] = cached[1]
+        cmap_cache[ atype ] = cached
+        continue
+      cmap = ColorMap(name = atype, geoms = geoms, 
+        alias = value_alias.get(atype, None))
+      if atype in pnames:
+        cmap.set_colors( palettes[atype] )
+      if cmap.value_type == 'continuous':
+        vrg = value_ranges.get(atype, [])
+        if len(vrg) >= 2:
+          cmap.value_range = [vrg[0], vrg[1]]
+          if len(vrg) >= 4:
+            cmap.hard_range = [vrg[2], vrg[3]]
+            if vrg[2] > vrg[3]:
+              cmap.hard_range = [vrg[3], vrg[2]]
+      color_maps[ atype ] = cmap.to_dict()
+      cmap_cache[ atype ] = (key, color_maps[ atype ])
+    render_cache.colormaps = cmap_cache
   
   if len(animation_types) > 0:
     if default_colormap is None or not default_colormap in animation_types:
@@ -99,28 +154,59 @@ def render_threejsbrain(
   else:
     default_colormap = None
   
-  # # Check elements
-  geom_dict = [g.to_dict() for g in geoms]
-  group_dict = [g.to_dict() for g in groups]
+  if cache_files == 'auto':
+    cache_files = 'route' if start_server else 'link'
+  stopifnot(cache_files in ('copy', 'link', 'route'), 
+    msg = "cache_files must be one of 'auto', 'copy', 'link', 'route'")
+  # served files in the content store are loaded from the server-wide
+  # `/store/` (same URL in all sessions, cached by browsers)
+  store_url = STORE_URL if cache_files == 'route' and \
+    get_store() is not None else None
   
-  # Generate temporary file
-  tmpdir = tempfile(prefix='py3bviewer_')
+  # # Serialize elements, unchanged ones are taken from the cache
+  geom_strs = render_cache.serialize('geoms', geoms,
+    lambda g: (_geom_key(g), decimate_key),
+    to_dict = lambda g: _geom_dict(g, decimated))
+  group_strs = render_cache.serialize('groups', groups, 
+    lambda g: (g.revision, dedup_cache, store_url),
+    plan = lambda g, gd: _cache_file_plan([g], [gd], dedup = dedup_cache,
+      store_url = store_url))
+  
+  # Generate temporary file, or update the previous one
+  tmpdir = render_cache.tmpdir
+  if tmpdir is None or not os.path.isdir(tmpdir):
+    tmpdir = tempfile(prefix='py3bviewer_', evictable=True)
+    render_cache.reset(tmpdir)
   
   # Copy Group files
   lib_path = 'lib/'
   data_path = os.path.join( tmpdir, 'lib', '%s-0' % widget_id )
   make_dirs(data_path)
   
-  for g in groups:
-    if g.cached_items is not None and len(g.cached_items) > 0:
-      os.mkdir(os.path.join(data_path, g.cache_name()))
-      for f in g.cached_items:
-        re = g.group_data[f]
-        shutil.copyfile(
-          src = re['absolute_path'],
-          dst = os.path.join(data_path, g.cache_name(), re['file_name'])
-        )
-      
+  with stage('render.cache_files'):
+    plan = {}
+    for g in groups:
+      plan.update(render_cache.plans[id(g)])
+      if instrumenting():
+        record_payload('group_cache', g.name, sum([
+          os.path.getsize(src) for src in render_cache.plans[id(g)].values()
+          if os.path.exists(src)]))
+    if cache_files == 'route':
+      # served in place by the viewer server, see `ROUTE_FILE`
+      routes = dict([
+        (posixpath.join(lib_path, '%s-0' % widget_id, rel), src)
+        for rel, src in plan.items()
+      ])
+      render_cache.sync_files({}, data_path, cache_files)
+      if routes != render_cache.routes:
+        to_json(routes, to_file = os.path.join(tmpdir, ROUTE_FILE))
+        render_cache.routes = routes
+    else:
+      if render_cache.routes is not None:
+        unlink(os.path.join(tmpdir, ROUTE_FILE))
+        render_cache.routes = None
+      render_cache.sync_files(plan, data_path, cache_files)
+  
   complete_presets = ["subject2","surface_type2","hemisphere_material",
         "map_template","electrodes","animation","display_highlights"]
   for preset in control_presets:
@@ -155,38 +241,27 @@ def render_threejsbrain(
     'control_display'     : control_display
   }
   
-  data = {
-    "x":{
-      "groups":group_dict, "geoms":geom_dict, "settings": settings
-    },"evals":[],"jsHooks":[]
-  }
-  data_str = json.dumps(data)
-  
-  
-  # move assets to temporary directory
-  pkg_dir, pkg_fname = os.path.split(__file__)
+  with stage('render.widget_data'):
+    data_str = _widget_data_str(group_strs, geom_strs, json_dumps(settings))
+    if not inline_data:
+      # the binding script fetches `data_url`, see threejs_brain.js
+      data_file = os.path.join(tmpdir, DATA_FILE)
+      if data_str != render_cache.data_str or not os.path.exists(data_file):
+        _write_widget_data(data_str, data_file, compress = compress_data)
+        render_cache.stats['data_written'] = True
+        render_cache.data_str = data_str
+      data_str = json.dumps({
+        "x":{ "data_url" : DATA_FILE },"evals":[],"jsHooks":[]
+      })
   
-  # pkg_dir="/Users/beauchamplab/Dropbox/projects/ravebrainpy/ravebrainpy/core"
-  asset_dir = os.path.join( os.path.dirname(pkg_dir), 'assets' )
-  index_path = os.path.join( os.path.dirname(pkg_dir), 'assets', 'index.html' )
+  # viewer libraries are shared across renders
   target_dir = os.path.join( tmpdir, 'lib' )
   target_idx = os.path.join( tmpdir, 'index.html' )
-  
-  for (a,b,c) in os.walk(asset_dir, topdown=True):
-    for fn in c:
-      src = os.path.join(a, fn)
-      dst = os.path.join(
-        target_dir,
-        os.path.relpath(path=src, start=asset_dir)
-      )
-      make_parent_dir(dst)
-      shutil.copyfile(src=src, dst=dst)
-  
-  # shutil.copytree(asset_dir, target_dir, symlinks=False, 
-  #   copy_function=shutil.copyfile, dirs_exist_ok=True)
+  with stage('render.assets'):
+    link_assets( target_dir, debug = debug, copy = copy_assets )
   
   # Generate index.html
-  with open(index_path, 'r') as fidx:
+  with open(INDEX_TEMPLATE, 'r') as fidx:
     content = fidx.readlines()
   
   content = ''.join(content)
@@ -196,27 +271,243 @@ def render_threejsbrain(
   # add data
   content = content.replace("{{WIDGETDATA}}", data_str)
   
-  with open(target_idx, 'w+') as tidx:
-    tidx.writelines(content)
+  if content != render_cache.index or not os.path.exists(target_idx):
+    with open(target_idx, 'w+') as tidx:
+      tidx.writelines(content)
+    render_cache.index = content
+  
+  # old render outputs are removed once over the workspace budget
+  workspace = get_workspace()
+  workspace.touch(tmpdir)
+  workspace.evict(keep = [tmpdir])
   
   if not start_server:
     return tmpdir;
   
-  return start_viewer( tmpdir )
+  with stage('render.server'):
+    return start_viewer( tmpdir )
   
   
 
 
-def start_viewer( tempdir, host="127.0.0.1", port=12355 ):
-  free_port = port
-  for i in range(10000):
-    free_port = port + i
-    if port_occupied(free_port):
-      print('Port %d is in use. Try next port...' % free_port)
-    else:
-      break
-  return start_simple_server(host, free_port, tempdir)
+SHARED_CACHE_DIR = CONTENT_DIR
+# `/store/` relative to a group cache folder
+# (`/s/<token>/lib/<widget_id>-0/<cache_name>/`)
+STORE_URL = '../../../../../%s/' % STORE_PREFIX
+DATA_FILE = 'data.json'
+
+def _write_widget_data(data, path, compress=False):
+  '''
+  Write serialized widget data to `path`; with `compress`, a gzip copy 
+  is written next to it ('<path>.gz') for servers that send 
+  precompressed files
+  '''
+  with open(path, 'w', encoding='utf-8') as f:
+    f.write(data)
+  if compress:
+    with open(path, 'rb') as fin, gzip.open(path + '.gz', 'wb') as fout:
+      shutil.copyfileobj(fin, fout)
+  elif os.path.exists(path + '.gz'):
+    os.remove(path + '.gz')
+  return path
+
+def _widget_data_str(group_strs, geom_strs, settings_str):
+  # `{"x":{...},"evals":[],"jsHooks":[]}` assembled from fragments that
+  # were serialized separately
+  return ''.join([
+    '{"x":{"groups":[', ','.join(group_strs), '],"geoms":[', 
+    ','.join(geom_strs), '],"settings":', settings_str, 
+    '},"evals":[],"jsHooks":[]}'
+  ])
+
+def _geom_dict(g, decimated):
+  re = g.to_dict()
+  for nm, kf in g.keyframes.items():
+    if id(kf) in decimated:
+      kfd = re['keyframes'][nm]
+      kfd['time'], kfd['value'] = decimated[id(kf)]
+  return re
+
+def _geom_key(g):
+  # geometry dictionaries contain group name/layer/position and the 
+  # keyframes, so their revisions are part of the key
+  group = None if g.group is None else (id(g.group), g.group.revision)
+  kfs = tuple([(nm, id(kf), kf.revision) for nm, kf in g.keyframes.items()])
+  return (g.revision, group, kfs)
+
+class RenderCache:
+  '''
+  State of the previous render, so `render_threejsbrain` only 
+  re-serializes and re-writes what has changed: the output directory, 
+  serialized geometries and groups, color maps and the cache files in
+  the data folder. Changes are detected from the revisions recorded by
+  `Tracked` objects (geometries, groups and keyframes).
+  '''
+  def __init__(self):
+    self.fragments = {}
+    self.plans = {}
+    self.colormaps = {}
+    self.reset(None)
+  
+  def reset(self, tmpdir):
+    '''
+    Forget the output directory (serialized fragments are kept)
+    '''
+    self.tmpdir = tmpdir
+    # path relative to data folder -> (source, mtime_ns, size)
+    self.files = {}
+    self.routes = None
+    self.data_str = None
+    self.index = None
+  
+  def serialize(self, kind, objs, key_fun, plan=None, to_dict=None):
+    '''
+    JSON strings of `obj.to_dict()` (or `to_dict(obj)`) for each object,
+    re-using the previous string if `key_fun(obj)` has not changed. 
+    `plan`, if given, is called with the object and its dictionary 
+    before serialization; its result is kept in `plans`
+    '''
+    old = self.fragments.get(kind, {})
+    new = {}
+    re = []
+    n_changed = 0
+    # to_dict and serialization times, only when instrumented
+    timing = instrumenting()
+    t_dict = t_json = 0.0
+    for obj in objs:
+      key = key_fun(obj)
+      item = old.get(id(obj), None)
+      # fragments hold the objects, so ids cannot be re-used by others
+      if item is None or item[0] is not obj or item[1] != key:
+        if timing:
+          t0 = time.perf_counter()
+        d = obj.to_dict() if to_dict is None else to_dict(obj)
+        if plan is not None:
+          self.plans[id(obj)] = plan(obj, d)
+        if timing:
+          t1 = time.perf_counter()
+        item = (obj, key, json_dumps(d))
+        if timing:
+          t_dict += t1 - t0
+          t_json += time.perf_counter() - t1
+        n_changed += 1
+      new[id(obj)] = item
+      re.append(item[2])
+      if timing:
+        record_payload(kind.rstrip('s'), obj.name, len(item[2]))
+    if timing:
+      record_stage('render.to_dict', t_dict, kind = kind, 
+        count = n_changed)
+      record_stage('render.serialize', t_json, kind = kind, 
+        count = n_changed)
+    self.fragments[kind] = new
+    if plan is not None:
+      self.plans = dict([(k, v) for k, v in self.plans.items() if k in new])
+    self.stats['%s_changed' % kind] = n_changed
+    return re
   
+  def sync_files(self, plan, data_path, mode):
+    '''
+    Make the data folder match `plan`; files whose source has not 
+    changed (path, modification time and size) are left as they are
+    '''
+    files = {}
+    n_written = 0
+    for rel, src in plan.items():
+      try:
+        st = os.stat(src)
+        stamp = (src, st.st_mtime_ns, st.st_size, mode)
+      except OSError as e:
+        stamp = None
+      dst = os.path.join(data_path, *rel.split('/'))
+      if stamp is None or self.files.get(rel, None) != stamp or \
+        not os.path.lexists(dst):
+        make_parent_dir(dst)
+        if mode == 'link':
+          _link_file(src, dst)
+        else:
+          shutil.copyfile(src = src, dst = dst)
+        n_written += 1
+      files[rel] = stamp
+    for rel in self.files.keys():
+      if not rel in files:
+        unlink(os.path.join(data_path, *rel.split('/')), recursive=False)
+    self.files = files
+    self.stats['files_written'] = n_written
+    return n_written
 
+def _cache_file_plan(groups, group_dict, dedup=False, store_url=None):
+  '''
+  Decide where cache files go in the viewer data folder
+  
+  If `dedup` is True, files with identical content (for example 
+  template meshes used by many subjects) are placed once under 
+  SHARED_CACHE_DIR, and `group_dict` is changed so that the groups 
+  refer to the shared files. If `store_url` is given, files kept in the
+  content store (see `ContentStore`) are not placed at all; groups 
+  refer to them under `store_url` instead.
+  
+  Returns
+  -------
+  Dictionary of path relative to the data folder ('/' separated) to
+  absolute path of the source file
+  '''
+  plan = {}
+  # absolute path -> shared file name
+  shared = {}
+  for g, gd in zip(groups, group_dict):
+    if g.cached_items is None or len(g.cached_items) == 0:
+      continue
+    for f in g.cached_items:
+      re = g.group_data[f]
+      src = re['absolute_path']
+      if store_url is not None:
+        obj = store_object(src)
+        if obj is not None:
+          gd['group_data'][f]['file_name'] = store_url + \
+            get_store().relpath(obj)
+          continue
+      if not dedup:
+        plan['%s/%s' % (g.cache_name(), re['file_name'])] = src
+        continue
+      fname = shared.get(src, None)
+      if fname is None:
+        ext = os.path.splitext(re['file_name'])[1]
+        fname = '%s%s' % (content_digest(src), ext)
+        shared[src] = fname
+        plan.setdefault('%s/%s' % (SHARED_CACHE_DIR, fname), src)
+      # viewer loads `cache_folder + cache_name + '/' + file_name`
+      gd['group_data'][f]['file_name'] = '../%s/%s' % (
+        SHARED_CACHE_DIR, fname)
+  return plan
 
+def _link_file(src, dst):
+  '''
+  Hard link if possible (same file system), then symbolic link, then copy
+  '''
+  if os.path.lexists(dst):
+    os.remove(dst)
+  for link in (os.link, os.symlink):
+    try:
+      link(src, dst)
+      return dst
+    except (OSError, NotImplementedError, AttributeError) as e:
+      pass
+  shutil.copyfile(src = src, dst = dst)
+  return dst
 
+def start_viewer( tempdir, host="127.0.0.1", port=12355, ttl=None,
+  launch_browser=True ):
+  '''
+  Serve render directory `tempdir` as a session of the viewer server
+  of this process (see `ravebrainpy.utils.ViewerServer`). If the 
+  directory is already served and open in a viewer (e.g. re-rendered
+  with `RenderCache`), the viewer is asked to reload instead
+  '''
+  session = get_session(tempdir)
+  if session is None:
+    session = register_session(tempdir, ttl=ttl, host=host, port=port)
+  elif session.n_clients > 0:
+    session.send('reload', None)
+    return session.url
+  return show_url(session.url, launch_browser=launch_browser)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import warnings
+import numpy as np
+from ..utils import stopifnot
+from ._geom_abs import AbstractGeom
+from ._geom_datacube import DataCubeGeom
+
+def _as_matrix4x4(m):
+  m = np.asarray(m, dtype=np.float64)
+  if m.size == 12:
+    m = np.append(m.flatten(), [0,0,0,1])
+  stopifnot(m.size == 16, msg='Transform must be a 4x4 matrix')
+  return m.reshape((4,4))
+
+def cube_vox2ras(Torig, dim):
+  '''
+  Voxel-to-tkrRAS transform of a cached (re-oriented) data cube
+
+  `import_freesurfer` re-orients volumes so that the cube axes follow
+  RAS (see `reorient_volume`). `Torig` still describes the original
+  voxel order, so the permutation and flips are folded back in here.
+
+  Returns
+  -------
+  A 4x4 numpy array mapping cube index (i, j, k) to tkrRAS
+  '''
+  Torig = _as_matrix4x4(Torig)
+  # For each RAS axis, the (signed, 1-based) voxel axis it follows
+  rot = Torig[:3,:3]
+  axes = np.argmax(np.abs(rot), axis=1)
+  stopifnot(len(set(axes.tolist())) == 3,
+    msg='Torig must be (close to) a permutation of the voxel axes')
+  order_index = (axes + 1) * np.sign(rot[np.arange(3), axes]).astype(int)
+
+  # reoriented index -> original index
+  perm = np.zeros((4,4))
+  perm[3,3] = 1
+  for r, o in enumerate(order_index):
+    a = abs(o) - 1
+    if o > 0:
+      perm[a, r] = 1
+    else:
+      perm[a, r] = -1
+      perm[a, 3] = dim[r] - 1
+  return np.matmul(Torig, perm)
+
+def get_cube(volume):
+  '''
+  Obtain the 3D array held by `BrainVolume`, `DataCubeGeom`, or array
+  '''
+  if hasattr(volume, '_object'):
+    # BrainVolume
+    volume = volume._object
+  if isinstance(volume, DataCubeGeom):
+    return volume.get_cube()
+  cube = np.asarray(volume)
+  stopifnot(cube.ndim == 3, msg='volume must be a 3D array')
+  return cube
+
+def sample_volume(volume, points, Torig, fill=np.nan, dtype=np.float32):
+  '''
+  Vectorized trilinear sampling of a volume at tkrRAS points
+
+  Parameters
+  ----------
+  volume : BrainVolume, DataCubeGeom, or 3D array (re-oriented cube)
+  points : (N, 3) array of tkrRAS coordinates
+  Torig : 4x4 voxel-to-tkrRAS matrix of the original volume, usually
+          `Brain._Torig`
+  fill : value for points that fall outside of the volume
+
+  Returns
+  -------
+  Numpy array of length N
+  '''
+  cube = get_cube(volume)
+  points = np.asarray(points, dtype=np.float64)
+  if points.ndim == 1:
+    points = points.reshape((1, -1))
+  stopifnot(points.ndim == 2 and points.shape[1] == 3,
+    msg='points must be a (N, 3) array')
+
+  dim = cube.shape
+  ras2vox = np.linalg.inv(cube_vox2ras(Torig, dim))
+  ijk = np.matmul(points, ras2vox[:3,:3].T) + ras2vox[:3,3]
+
+  # cubes loaded from cache are in Fortran order; use strides so that
+  # no copy is made for either memory layout
+  flat = cube.ravel(order='K')
+  strides = np.array(cube.strides) // cube.itemsize
+
+  upper = np.array(dim) - 1
+  valid = np.all((ijk >= 0) & (ijk <= upper), axis=1)
+  # clip so that the 8 corners stay in bound at the upper faces
+  i0 = np.clip(np.floor(ijk).astype(np.int64), 0, np.maximum(upper - 1, 0))
+  frac = np.clip(ijk - i0, 0, 1).astype(dtype)
+  step = (np.array(dim) > 1) * strides
+
+  base = i0 @ strides
+  fx, fy, fz = frac[:,0], frac[:,1], frac[:,2]
+  gx, gy, gz = 1 - fx, 1 - fy, 1 - fz
+  sx, sy, sz = step
+
+  def _at(offset):
+    return flat[base + offset].astype(dtype, copy=False)
+
+  re = (
+    _at(0) * gx * gy * gz +
+    _at(sx) * fx * gy * gz +
+    _at(sy) * gx * fy * gz +
+    _at(sx + sy) * fx * fy * gz +
+    _at(sz) * gx * gy * fz +
+    _at(sx + sz) * fx * gy * fz +
+    _at(sy + sz) * gx * fy * fz +
+    _at(sx + sy + sz) * fx * fy * fz
+  )
+  if not np.all(valid):
+    re = re.astype(np.result_type(dtype, type(fill)), copy=False)
+    re[~valid] = fill
+  return re
+
+def _surface_vertices(surface):
+  if isinstance(surface, AbstractGeom):
+    stopifnot(surface.geom_type == 'free',
+      msg='Surface geometry must be a FreeGeom')
+    surface = surface.get_vertices()
+  return np.asarray(surface, dtype=np.float64)
+
+def vol2surf(volume, white, pial=None, Torig=None, depths=[0.5],
+  reduce='mean', fill=np.nan):
+  '''
+  Project volume values to surface vertices
+
+  Samples `volume` at `white + depth * (pial - white)` for each of the
+  `depths` (0 is white matter surface, 1 is pial), i.e. along the
+  surface normal within the cortical ribbon.
+
+  Parameters
+  ----------
+  volume : BrainVolume, DataCubeGeom, or 3D array (re-oriented cube)
+  white, pial : FreeGeom or (N, 3) vertex arrays in tkrRAS. If `pial`
+                is None, `white` is sampled directly and `depths`
+                is ignored
+  Torig : 4x4 voxel-to-tkrRAS matrix, usually `Brain._Torig`
+  depths : fractions of cortical thickness to sample at
+  reduce : 'mean', 'max', 'min', 'median', or None to return all
+           depths as an (N, len(depths)) array
+
+  Returns
+  -------
+  Numpy array with one value per vertex; can be passed to
+  `FreeGeom.set_value` to paint the overlay as vertex colors
+  '''
+  stopifnot(Torig is not None, msg='Torig is required to map voxels')
+  white = _surface_vertices(white)
+  if pial is None:
+    return sample_volume(volume, white, Torig, fill=fill)
+
+  pial = _surface_vertices(pial)
+  stopifnot(white.shape == pial.shape,
+    msg='white and pial surfaces must have the same vertices')
+
+  depths = np.asarray(depths, dtype=np.float64).reshape((-1, 1, 1))
+  # (D, N, 3) -> (D*N, 3), sample all depths in one pass
+  points = white + depths * (pial - white)
+  n_depth, n_vert = points.shape[0], points.shape[1]
+  re = sample_volume(volume, points.reshape((-1, 3)), Torig, fill=fill)
+  re = re.reshape((n_depth, n_vert)).T
+
+  if reduce is None:
+    return re
+  reducers = {
+    'mean' : np.nanmean,
+    'max' : np.nanmax,
+    'min' : np.nanmin,
+    'median' : np.nanmedian
+  }
+  stopifnot(reduce in reducers,
+    msg='reduce must be one of %s' % ', '.join(reducers.keys()))
+  if n_depth == 1:
+    return re[:,0]
+  with warnings.catch_warnings():
+    # all-NaN rows (outside of the volume) are expected
+    warnings.simplefilter('ignore', category=RuntimeWarning)
+    return reducers[reduce](re, axis=1)
@@ -1,2 +1,5 @@
 from __future__ import absolute_import
-from ._import_fs import import_freesurfer
+from ._import_fs import import_freesurfer, subject_lock
+from ._cohort import import_cohort, discover_subjects, read_manifest
+from ._maintenance import audit_cache, collect_garbage, find_cache_dirs
+from ._maintenance import scan_cache_dir, verify_entry
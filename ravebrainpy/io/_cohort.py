@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import contextlib
+import multiprocessing
+
+from ..utils import json_dumps, json_loads, normalize_path, stopifnot
+from ._import_fs import import_freesurfer, ravebrainpy_data_ver
+
+# Completed subjects are appended to this file under `subjects_dir`
+MANIFEST_FILE = '.ravebrainpy-import.jsonl'
+# Environment variables limiting numeric thread pools of workers
+THREAD_VARIABLES = (
+  'OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+  'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS'
+)
+
+def discover_subjects(subjects_dir):
+  '''
+  FreeSurfer subjects (directories with `surf` or `mri`) under
+  `subjects_dir`, sorted by name
+  '''
+  subjects_dir = normalize_path(subjects_dir)
+  re = []
+  for name in sorted(os.listdir(subjects_dir)):
+    path = os.path.join(subjects_dir, name)
+    if name.startswith('.') or not os.path.isdir(path):
+      continue
+    if os.path.isdir(os.path.join(path, 'surf')) or \
+      os.path.isdir(os.path.join(path, 'mri')):
+      re.append(name)
+  return re
+
+def read_manifest(path):
+  '''
+  Latest manifest record of each subject (dictionary by subject)
+  '''
+  re = {}
+  if not os.path.exists(path):
+    return re
+  with open(path, 'r', encoding='utf-8') as f:
+    for line in f:
+      line = line.strip()
+      if line == '':
+        continue
+      try:
+        record = json_loads(line)
+      except Exception as e:
+        # a line cut off by an interrupted run
+        continue
+      re[record['subject']] = record
+  return re
+
+def _append_manifest(path, record):
+  # one short line per write, appends are not interleaved
+  with open(path, 'a', encoding='utf-8') as f:
+    f.write(json_dumps(record) + '\n')
+    f.flush()
+
+def _bytes_since(path, since):
+  total = 0
+  if not os.path.isdir(path):
+    return total
+  for fn in os.listdir(path):
+    try:
+      st = os.stat(os.path.join(path, fn))
+    except OSError as e:
+      continue
+    if st.st_mtime >= since:
+      total += st.st_size
+  return total
+
+def _import_subject(task):
+  subject, fspath, force, lock_timeout, verbose = task
+  start = time.time()
+  record = {
+    'subject' : subject,
+    'path' : fspath,
+    'ravebrainpy_data_ver' : ravebrainpy_data_ver,
+    'pid' : os.getpid()
+  }
+  try:
+    if verbose:
+      import_freesurfer(subject, fspath, force = force,
+        lock_timeout = lock_timeout)
+    else:
+      with open(os.devnull, 'w') as devnull, \
+        contextlib.redirect_stdout(devnull):
+        import_freesurfer(subject, fspath, force = force,
+          lock_timeout = lock_timeout)
+    record['status'] = 'ok'
+  except Exception as e:
+    record['status'] = 'error'
+    record['error'] = '%s: %s' % (type(e).__name__, e)
+  record['seconds'] = time.time() - start
+  record['bytes'] = _bytes_since(os.path.join(fspath, 'RAVEpy'), start)
+  record['time'] = time.time()
+  return record
+
+@contextlib.contextmanager
+def _thread_limits(threads, current=False):
+  # spawned workers inherit the environment at start-up, before numpy
+  # is imported; thread pools already loaded in this process (`current`)
+  # can only be limited with threadpoolctl
+  if threads is None:
+    yield
+    return
+  old = dict([(k, os.environ.get(k, None)) for k in THREAD_VARIABLES])
+  for k in THREAD_VARIABLES:
+    os.environ[k] = str(threads)
+  limits = contextlib.nullcontext()
+  if current:
+    try:
+      from threadpoolctl import threadpool_limits
+      limits = threadpool_limits(limits = threads)
+    except ImportError:
+      pass
+  try:
+    with limits:
+      yield
+  finally:
+    for k, v in old.items():
+      if v is None:
+        os.environ.pop(k, None)
+      else:
+        os.environ[k] = v
+
+def _format_bytes(n):
+  for unit in ('B', 'KB', 'MB', 'GB'):
+    if n < 1024:
+      return '%.1f %s' % (n, unit)
+    n /= 1024.0
+  return '%.1f TB' % n
+
+def import_cohort(subjects_dir, subjects=None, workers=1, threads=1,
+  manifest=None, resume=True, force=False, lock_timeout=None,
+  verbose=False, log=None):
+  '''
+  Import many FreeSurfer subjects in parallel
+
+  Each subject is imported by one worker process at a time (see
+  `subject_lock`); completed subjects are recorded in a manifest, so
+  an interrupted run skips them when started again.
+
+  Parameters
+  ----------
+  subjects_dir : directory of FreeSurfer subjects (`SUBJECTS_DIR`)
+  subjects : subject names, default is all subjects found by
+             `discover_subjects`
+  workers : number of worker processes; 1 imports in this process
+  threads : numeric threads per worker (OpenMP/BLAS), None for no limit;
+            with `workers=1`, thread pools numpy has already started
+            are limited only if `threadpoolctl` is installed
+  manifest : manifest path, default is `.ravebrainpy-import.jsonl` in
+             `subjects_dir`
+  resume : skip subjects the manifest lists as imported with the current
+           cache format (`ravebrainpy_data_ver`)
+  force : re-create all caches (implies `resume=False`)
+  lock_timeout : seconds to wait for a subject locked by another import
+  verbose : show the output of `import_freesurfer`
+  log : function called with progress lines, default writes to stderr
+
+  Returns
+  -------
+  Summary dictionary: subjects imported, failed and skipped, seconds,
+  subjects per minute, bytes written, and the records of this run
+  '''
+  subjects_dir = normalize_path(subjects_dir)
+  stopifnot(os.path.isdir(subjects_dir),
+    msg = 'subjects_dir %s is not a directory' % subjects_dir)
+  if log is None:
+    log = lambda s: print(s, file=sys.stderr, flush=True)
+  if manifest is None:
+    manifest = os.path.join(subjects_dir, MANIFEST_FILE)
+  if subjects is None:
+    subjects = discover_subjects(subjects_dir)
+  # each subject once
+  subjects = list(dict.fromkeys(subjects))
+
+  skipped = []
+  if resume and not force:
+    done = read_manifest(manifest)
+    for s in subjects:
+      r = done.get(s, None)
+      if r is not None and r.get('status', '') == 'ok' and \
+        r.get('ravebrainpy_data_ver', 0) >= ravebrainpy_data_ver:
+        skipped.append(s)
+  todo = [s for s in subjects if not s in skipped]
+  if len(skipped):
+    log('Skipping %d subject(s) already imported (see %s)' % (
+      len(skipped), manifest))
+
+  tasks = [(s, os.path.join(subjects_dir, s), force, lock_timeout,
+    verbose) for s in todo]
+  records = []
+  start = time.time()
+  n_bytes = 0
+
+  def collect(record):
+    records.append(record)
+    _append_manifest(manifest, record)
+    nonlocal n_bytes
+    n_bytes += record['bytes']
+    elapsed = time.time() - start
+    n = len(records)
+    eta = elapsed / n * (len(tasks) - n)
+    log('[%d/%d] %-24s %-5s %7.1fs %10s  (eta %.0fs)%s' % (
+      n, len(tasks), record['subject'], record['status'],
+      record['seconds'], _format_bytes(record['bytes']), eta,
+      '' if record['status'] == 'ok' else '  ' + record['error']))
+
+  workers = max(1, min(int(workers), len(tasks)))
+  if workers == 1:
+    with _thread_limits(threads, current = True):
+      for task in tasks:
+        collect(_import_subject(task))
+  elif len(tasks):
+    ctx = multiprocessing.get_context('spawn')
+    with _thread_limits(threads):
+      pool = ctx.Pool(processes=workers)
+    try:
+      # one subject per task; unordered so progress follows completion
+      for record in pool.imap_unordered(_import_subject, tasks, 1):
+        collect(record)
+    finally:
+      pool.terminate()
+      pool.join()
+
+  elapsed = time.time() - start
+  n_ok = len([r for r in records if r['status'] == 'ok'])
+  summary = {
+    'subjects_dir' : subjects_dir,
+    'manifest' : manifest,
+    'imported' : n_ok,
+    'failed' : len(records) - n_ok,
+    'skipped' : len(skipped),
+    'seconds' : elapsed,
+    'subjects_per_minute' : n_ok / elapsed * 60 if elapsed > 0 else 0.0,
+    'bytes_written' : n_bytes,
+    'workers' : workers,
+    'records' : records
+  }
+  log('Imported %d, failed %d, skipped %d subject(s) in %.1fs: '
+    '%.2f subjects/min, %s written (%s/s)' % (
+    summary['imported'], summary['failed'], summary['skipped'], elapsed,
+    summary['subjects_per_minute'], _format_bytes(n_bytes),
+    _format_bytes(n_bytes / elapsed if elapsed > 0 else 0)))
+  return summary
@@ -8,10 +8,13 @@ from .. import IDENTITY4X4, SURFACE_TYPES
 from ..utils import read_from_file, stopifnot, digest_file, file_exists
 from ..utils import as_dict, unlink, from_json, to_json, make_dirs
 from ..utils import json_cache, check_digestfile, normalize_path
+from ..utils import stage, timed, profiled, FileLock
 from ..core import GeomGroup, FreeGeom, DataCubeGeom
 # from ravebrainpy.utils import *
 # from ravebrainpy.core import *
 ravebrainpy_data_ver = 1
+# advisory lock file under `RAVEpy`, see `subject_lock`
+LOCK_FILE = '.lock'
 
 # fspath = '/Users/beauchamplab/rave_data/others/three_brain/YCQ/'
 # subject_code = 'YCQ'
@@ -95,10 +98,8 @@ def _import_fs_T1(subject_code, fspath):
   volume_shape = list(volume.shape)
   volume = volume.flatten('F').tolist()
   
-  # recache
-  unlink(cache_volume)
-  unlink(cache_digest)
-  
+  # recache (`json_cache` replaces the cache and its digest, with the
+  # source information, atomically; no need to remove them first)
   DataCubeGeom(
     name = 'T1 (%s)' % subject_code,
     value = volume,
@@ -106,24 +107,17 @@ def _import_fs_T1(subject_code, fspath):
     half_size = [x/2.0 for x in volume_shape],
     group = group_volume,
     position = [0,0,0],
-    cache_file = cache_volume
+    cache_file = cache_volume,
+    digest_header = {
+      'digest_origin' : file_digest,
+      'Norig' : Norig.tolist(),
+      'Torig' : Torig.tolist(),
+      'source_name' : t1_name,
+      'shape' : volume_shape,
+      'ravebrainpy_data_ver' : ravebrainpy_data_ver
+    }
   )
   
-  # generate file_digest
-  json_digest = digest_file(file=cache_volume, length=20)
-  
-  # add additional information to cache_digest
-  dinfo = from_json(from_file=cache_digest)
-  dinfo['digest'] = json_digest
-  dinfo['digest_origin'] = file_digest
-  dinfo['Norig'] = Norig.tolist()
-  dinfo['Torig'] = Torig.tolist()
-  dinfo['source_name'] = t1_name
-  dinfo['shape'] = volume_shape
-  dinfo['ravebrainpy_data_ver'] = ravebrainpy_data_ver
-  
-  to_json(dinfo, to_file=cache_digest)
-  
   # Add to common.digest
   common_file = os.path.join(rave_path, 'common.pydigest')
   if file_exists(common_file):
@@ -211,30 +205,26 @@ def _import_fs_surf(subject_code, fspath, surf_type, hemisphere):
     import nibabel
     tmp = nibabel.freesurfer.io.read_geometry(
       surf_path,read_metadata=False)
-    vertex = tmp[0][:,:3].tolist()
-    face = tmp[1][:,:3].tolist()
-  
-  unlink(cache_surf)
+    # arrays are validated and cached as they are, see `check_mesh`
+    vertex = tmp[0][:,:3]
+    face = tmp[1][:,:3]
   
+  # source information is written with the cache, see `json_cache`
   FreeGeom(
     name = 'FreeSurfer %s Hemisphere - %s (%s)' % (
       full_hemisphere, surf_type, subject_code,
     ), position = [0,0,0], cache_file = cache_surf, 
-    group = surf_group, layer = [8], vertex = vertex, face = face)
-  
-  # Add file_digest, Norig, Torig to cache_digest
-  dinfo = from_json(from_file=cache_digest)
-  dinfo['digest'] = digest_file(cache_surf)
-  dinfo['digest_origin'] = file_digest
-  dinfo['surface_format'] = 'fs'
-  dinfo['hemisphere'] = hemisphere
-  dinfo['ravebrainpy_data_ver'] = ravebrainpy_data_ver
-  dinfo['n_vertices'] = len(vertex)
-  dinfo['n_faces'] = len(face)
-  dinfo['is_surface'] = True
-  dinfo['is_fs_surface'] = True
-  
-  to_json(dinfo, to_file=cache_digest)
+    group = surf_group, layer = [8], vertex = vertex, face = face,
+    digest_header = {
+      'digest_origin' : file_digest,
+      'surface_format' : 'fs',
+      'hemisphere' : hemisphere,
+      'ravebrainpy_data_ver' : ravebrainpy_data_ver,
+      'n_vertices' : len(vertex),
+      'n_faces' : len(face),
+      'is_surface' : True,
+      'is_fs_surface' : True
+    })
   return True
 
 def _import_fs_curv(subject_code, fspath, curv_name, hemisphere):
@@ -295,8 +285,6 @@ def _import_fs_curv(subject_code, fspath, curv_name, hemisphere):
     tmp = nibabel.freesurfer.io.read_morph_data(surf_path)
     curv = tmp.tolist()
   
-  unlink(cache_surf)
-  
   # Check with fs vertex_count
   pial_info = from_json(from_file=os.path.join(
     rave_path, '%s_fs_%sh_pial.json.pydigest' % (
@@ -317,27 +305,43 @@ def _import_fs_curv(subject_code, fspath, curv_name, hemisphere):
     'n_points' : len(curv),
     'range' : [min(curv), max(curv)],
     'value' : curv
-  }})
-  
-  # Add file_digest, Norig, Torig to cache_digest
-  dinfo = from_json(from_file=cache_digest)
-  dinfo['digest'] = digest_file(cache_surf)
-  dinfo['digest_origin'] = file_digest
-  dinfo['curve_format'] = 'fs'
-  dinfo['curve_name'] = curv_name
-  dinfo['hemisphere'] = hemisphere
-  dinfo['ravebrainpy_data_ver'] = ravebrainpy_data_ver
-  dinfo['n_points'] = len(curv)
-  dinfo['is_sulc'] = True
-  dinfo['is_fs_sulc'] = True
-  
-  to_json(dinfo, to_file=cache_digest)
+  }}, digest_header = {
+    'digest_origin' : file_digest,
+    'curve_format' : 'fs',
+    'curve_name' : curv_name,
+    'hemisphere' : hemisphere,
+    'ravebrainpy_data_ver' : ravebrainpy_data_ver,
+    'n_points' : len(curv),
+    'is_sulc' : True,
+    'is_fs_sulc' : True
+  })
   return True
 
 
-def import_freesurfer(subject_code, fspath, force=False):
-  
+def subject_lock(fspath, timeout=None):
+  '''
+  Advisory lock on the cache directory (`RAVEpy`) of a FreeSurfer
+  subject, held by `import_freesurfer` while it checks and writes caches
+
+  Example: `with subject_lock(fspath): ...`
+  '''
+  return FileLock(os.path.join(normalize_path(fspath), 'RAVEpy', LOCK_FILE),
+    timeout = timeout)
+
+@profiled('import_freesurfer')
+@timed('import_freesurfer')
+def import_freesurfer(subject_code, fspath, force=False, lock_timeout=None):
+  '''
+  Import (cache) FreeSurfer T1, surfaces and curvature files of a 
+  subject into `fspath/RAVEpy`. Concurrent imports of the same subject
+  (threads or processes) wait for each other; `lock_timeout` is the 
+  maximum number of seconds to wait, default is forever
+  '''
   fspath = normalize_path(fspath)
+  with subject_lock(fspath, timeout = lock_timeout):
+    return _import_freesurfer(subject_code, fspath, force = force)
+
+def _import_freesurfer(subject_code, fspath, force=False):
   
   curvatures = ['sulc']
   
@@ -345,15 +349,20 @@ def import_freesurfer(subject_code, fspath, force=False):
     rave_path = os.path.join(fspath, 'RAVEpy')
     if file_exists(rave_path):
       print('Clean previous files')
-      cached_files = os.listdir(rave_path)
-      sel=[len(re.findall(r'pydigest$', x)) > 0 for x in cached_files]
-      cached_files = [x for x,y in zip(cached_files, sel) if y]
-      for f in cached_files:
-        unlink(os.path.join(rave_path, f))
+      # remove imported caches with their digests; value caches created 
+      # by users are kept (see `collect_garbage`)
+      from ._maintenance import scan_cache_dir
+      for entry in scan_cache_dir(rave_path):
+        if entry['category'] == 'value':
+          continue
+        for p in (entry['data_path'], entry['digest_path']):
+          if p is not None:
+            unlink(p)
   
   print('-------------------- Load T1 volume --------------------')
   try:
-    cached = _import_fs_T1(subject_code, fspath)
+    with stage('import.T1', subject = subject_code):
+      cached = _import_fs_T1(subject_code, fspath)
     if not cached:
       print('No need to update')
   except Exception as e:
@@ -365,8 +374,12 @@ def import_freesurfer(subject_code, fspath, force=False):
   for surf_type in SURFACE_TYPES:
     print('### ' + surf_type)
     try:
-      cached1 = _import_fs_surf(subject_code, fspath, surf_type, 'l')
-      cached2 = _import_fs_surf(subject_code, fspath, surf_type, 'r')
+      with stage('import.surf', subject = subject_code, 
+        surf_type = surf_type, hemisphere = 'l'):
+        cached1 = _import_fs_surf(subject_code, fspath, surf_type, 'l')
+      with stage('import.surf', subject = subject_code, 
+        surf_type = surf_type, hemisphere = 'r'):
+        cached2 = _import_fs_surf(subject_code, fspath, surf_type, 'r')
       if not cached1 and not cached2:
         print('No need to update')
     except Exception as e:
@@ -376,8 +389,12 @@ def import_freesurfer(subject_code, fspath, force=False):
   for curv in curvatures:
     print('### ' + curv)
     try:
-      cached1 = _import_fs_curv(subject_code, fspath, curv, 'l')
-      cached2 = _import_fs_curv(subject_code, fspath, curv, 'r')
+      with stage('import.curv', subject = subject_code, curv = curv,
+        hemisphere = 'l'):
+        cached1 = _import_fs_curv(subject_code, fspath, curv, 'l')
+      with stage('import.curv', subject = subject_code, curv = curv,
+        hemisphere = 'r'):
+        cached2 = _import_fs_curv(subject_code, fspath, curv, 'r')
       if not cached1 and not cached2:
         print('No need to update')
     except Exception as e:
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .. import SURFACE_TYPES
+from ..utils import from_json, digest_file, normalize_path, stopifnot
+from ..utils import FileLock, read_binary, digest_arrays
+from ..utils._atomic import TEMP_MARKER
+from ..utils._workspace import _parse_bytes, _remove
+from ._import_fs import LOCK_FILE
+from ._cohort import MANIFEST_FILE
+
+DIGEST_EXT = '.pydigest'
+COMMON_FILE = 'common' + DIGEST_EXT
+# Cache categories reported by `audit_cache`
+CACHE_CATEGORIES = ('volume', 'surface', 'curvature', 'value', 'common',
+  'temporary', 'other')
+# Temporary files younger than this may belong to a running writer
+TEMPORARY_MIN_AGE = 3600
+
+def _parse_age(x):
+  '''
+  Parse age such as 3600, '90s', '12h' or '30d' to seconds
+  '''
+  if x is None:
+    return None
+  if isinstance(x, (int, float, )):
+    return float(x)
+  m = re.match(r'^\s*([0-9.]+)\s*([smhdw]?)\s*$', str(x).lower())
+  stopifnot(m is not None, msg = 'Cannot parse age %s' % x)
+  unit = { '' : 1, 's' : 1, 'm' : 60, 'h' : 3600, 'd' : 86400,
+    'w' : 604800 }[m.group(2)]
+  return float(m.group(1)) * unit
+
+def find_cache_dirs(path):
+  '''
+  Cache directories under `path`: `path/RAVEpy` of a FreeSurfer subject,
+  `path` itself if it holds caches, or `RAVEpy` of each subject in a
+  subjects directory
+  '''
+  path = normalize_path(path)
+  if os.path.isdir(os.path.join(path, 'RAVEpy')):
+    return [os.path.join(path, 'RAVEpy')]
+  if not os.path.isdir(path):
+    return []
+  files = os.listdir(path)
+  if any([f.endswith(DIGEST_EXT) for f in files]):
+    return [path]
+  re = []
+  for f in sorted(files):
+    d = os.path.join(path, f, 'RAVEpy')
+    if os.path.isdir(d):
+      re.append(d)
+  return re
+
+def _is_value_cache(base, files):
+  # `FreeGeom.set_value` and `DataCubeGeom.set_value` write
+  # <cache>__<variable>.json next to the cache <cache>.json
+  stem, ext = os.path.splitext(base)
+  start = stem.find('__')
+  while start > 0:
+    if stem[:start] + ext in files:
+      return True
+    start = stem.find('__', start + 1)
+  return False
+
+def _category(name, info, files=()):
+  '''
+  Category of cache file `name`, from its digest information `info`
+  (None if missing), or its name. `files` are the file names in the
+  same directory
+  '''
+  if TEMP_MARKER in name:
+    return 'temporary'
+  if name == COMMON_FILE:
+    return 'common'
+  base = name[:-len(DIGEST_EXT)] if name.endswith(DIGEST_EXT) else name
+  if info is not None:
+    if info.get('is_surface', False):
+      return 'surface'
+    if info.get('is_sulc', False):
+      return 'curvature'
+    if 'fs_volume_files' in info or 'shape' in info:
+      return 'volume'
+  if _is_value_cache(base, files):
+    return 'value'
+  stem = os.path.splitext(base)[0]
+  if stem.endswith('_t1'):
+    return 'volume'
+  m = re.match(r'^.*_fs_[lr]h_(.+)$', stem)
+  if m is not None:
+    return 'surface' if m.group(1) in SURFACE_TYPES else 'curvature'
+  return 'other'
+
+def scan_cache_dir(path):
+  '''
+  List cache entries in `path`, one per cache file with its digest
+
+  Returns
+  -------
+  List of dictionaries: name, category, data_path, digest_path (None if
+  missing), size (bytes of both files) and mtime
+  '''
+  path = normalize_path(path)
+  files = set(os.listdir(path))
+  entries = []
+  for fn in sorted(files):
+    if fn in (LOCK_FILE, MANIFEST_FILE) or fn == COMMON_FILE:
+      continue
+    if fn.endswith(DIGEST_EXT) and fn[:-len(DIGEST_EXT)] in files:
+      # listed with its data file
+      continue
+    is_digest = fn.endswith(DIGEST_EXT) and not TEMP_MARKER in fn
+    data_name = fn[:-len(DIGEST_EXT)] if is_digest else fn
+    digest_name = fn if is_digest else fn + DIGEST_EXT
+    entry = {
+      'name' : data_name,
+      'data_path' : os.path.join(path, data_name) \
+        if data_name in files else None,
+      'digest_path' : os.path.join(path, digest_name) \
+        if digest_name in files else None
+    }
+    size = 0
+    mtime = 0
+    for p in (entry['data_path'], entry['digest_path']):
+      if p is None:
+        continue
+      try:
+        st = os.stat(p)
+      except OSError as e:
+        continue
+      size += st.st_size
+      mtime = max(mtime, st.st_mtime)
+    entry['size'] = size
+    entry['mtime'] = mtime
+    info = None
+    if entry['digest_path'] is not None and not TEMP_MARKER in fn:
+      try:
+        info = from_json(from_file=entry['digest_path'])
+      except Exception as e:
+        info = None
+    entry['category'] = _category(fn, info, files)
+    entries.append(entry)
+  if COMMON_FILE in files:
+    p = os.path.join(path, COMMON_FILE)
+    st = os.stat(p)
+    entries.append({
+      'name' : COMMON_FILE, 'data_path' : None, 'digest_path' : p,
+      'size' : st.st_size, 'mtime' : st.st_mtime, 'category' : 'common'
+    })
+  return entries
+
+def verify_entry(entry):
+  '''
+  Check cache data against its digest
+
+  Returns
+  -------
+  None if valid, otherwise the reason (string)
+  '''
+  try:
+    info = from_json(from_file=entry['digest_path'])
+  except Exception as e:
+    return 'unreadable digest'
+  expected = info.get('digest', None)
+  if not isinstance(expected, str):
+    return 'digest missing'
+  data_path = entry['data_path']
+  if info.get('format', None) == 'binary':
+    try:
+      header, arrays = read_binary(data_path)
+    except Exception as e:
+      return 'unreadable data'
+    header.pop('arrays', None)
+    header.pop('format_version', None)
+    candidates = [digest_arrays(arrays, header, length=len(expected))]
+    if len(header) == 0:
+      candidates.append(digest_arrays(arrays, None, length=len(expected)))
+    return None if expected in candidates else 'digest mismatch'
+  # JSON caches record the digest of their serialized content, which is
+  # also the digest of the file
+  if digest_file(data_path, length=len(expected)) != expected:
+    return 'digest mismatch'
+  return None
+
+def audit_cache(path, verify=True, workers=4):
+  '''
+  Audit cache directories
+
+  Parameters
+  ----------
+  path : cache directory, FreeSurfer subject or subjects directory (see
+         `find_cache_dirs`)
+  verify : check cache data against digests (reads every cache file)
+  workers : number of threads verifying digests
+
+  Returns
+  -------
+  Dictionary with bytes and counts per category, orphans (data without
+  digest or digest without data), corrupt entries (with the reason),
+  temporary files left by interrupted writers, and all entries
+  '''
+  entries = []
+  dirs = find_cache_dirs(path)
+  for d in dirs:
+    entries.extend(scan_cache_dir(d))
+  categories = dict([(c, { 'count' : 0, 'bytes' : 0 })
+    for c in CACHE_CATEGORIES])
+  for e in entries:
+    categories[e['category']]['count'] += 1
+    categories[e['category']]['bytes'] += e['size']
+  temporary = [e for e in entries if e['category'] == 'temporary']
+  orphans = [e for e in entries if e['category'] not in (
+    'temporary', 'common') and (
+    e['data_path'] is None or e['digest_path'] is None)]
+  corrupt = []
+  if verify:
+    checked = [e for e in entries if e['category'] not in (
+      'temporary', 'common') and e['data_path'] is not None and
+      e['digest_path'] is not None]
+    with ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+      reasons = list(pool.map(verify_entry, checked))
+    for e, reason in zip(checked, reasons):
+      if reason is not None:
+        corrupt.append(dict(e, reason=reason))
+  return {
+    'path' : normalize_path(path),
+    'cache_dirs' : dirs,
+    'total_bytes' : sum([e['size'] for e in entries]),
+    'categories' : categories,
+    'orphans' : orphans,
+    'corrupt' : corrupt,
+    'temporary' : temporary,
+    'verified' : verify,
+    'entries' : entries
+  }
+
+def _remove_entry(entry):
+  removed = True
+  for p in (entry['data_path'], entry['digest_path']):
+    if p is not None:
+      removed = _remove(p) and removed
+  return removed
+
+def collect_garbage(path, orphans=True, corrupt=False, temporary=True,
+  value_max_age=None, value_budget=None, dry_run=False, workers=4,
+  lock_timeout=None):
+  '''
+  Remove unused cache files
+
+  Parameters
+  ----------
+  path : cache directory, FreeSurfer subject or subjects directory
+  orphans : remove data without digest and digests without data
+  corrupt : also remove caches that fail digest verification (they are
+            re-created by the next import or render)
+  temporary : remove temporary files older than an hour, left behind
+              by interrupted writers
+  value_max_age : remove value caches (`FreeGeom.set_value`) not
+                  written for this long, e.g. '30d' or seconds (access
+                  times are not used: audits read every file)
+  value_budget : then remove the oldest value caches until they fit in
+                 this many bytes per directory, e.g. '1G'
+  dry_run : only report what would be removed
+  lock_timeout : seconds to wait for a running import of a subject
+
+  Returns
+  -------
+  Dictionary: removed entries, removed bytes (per category) and whether
+  it was a dry run
+  '''
+  max_age = _parse_age(value_max_age)
+  budget = _parse_bytes(value_budget)
+  now = time.time()
+  removed = []
+  for d in find_cache_dirs(path):
+    # imports write under this lock, do not remove their files midway
+    with FileLock(os.path.join(d, LOCK_FILE), timeout=lock_timeout):
+      report = audit_cache(d, verify=corrupt, workers=workers)
+      selected = {}
+      if orphans:
+        for e in report['orphans']:
+          selected[e['name']] = e
+      if corrupt:
+        for e in report['corrupt']:
+          selected[e['name']] = e
+      if temporary:
+        for e in report['temporary']:
+          if now - e['mtime'] >= TEMPORARY_MIN_AGE:
+            selected[e['name']] = e
+      values = [e for e in report['entries'] if e['category'] == 'value'
+        and not e['name'] in selected]
+      if max_age is not None:
+        for e in values:
+          if now - e['mtime'] > max_age:
+            selected[e['name']] = e
+        values = [e for e in values if not e['name'] in selected]
+      if budget is not None:
+        values.sort(key=lambda e: e['mtime'])
+        total = sum([e['size'] for e in values])
+        for e in values:
+          if total <= budget:
+            break
+          selected[e['name']] = e
+          total -= e['size']
+      for e in selected.values():
+        if dry_run or _remove_entry(e):
+          removed.append(e)
+  by_category = {}
+  for e in removed:
+    by_category[e['category']] = by_category.get(e['category'], 0) + \
+      e['size']
+  return {
+    'path' : normalize_path(path),
+    'dry_run' : dry_run,
+    'removed' : removed,
+    'removed_bytes' : sum([e['size'] for e in removed]),
+    'removed_bytes_by_category' : by_category
+  }
@@ -177,3 +177,401 @@ class TestGeoms(TestCase):
     s = c.SphereGeom(name='s1', position=[1,2,3], radius=3)
     s.to_dict()
     pass
+
+  def test_compact_geom(self):
+    from ravebrainpy.core._bundle import _Packer, _Unpacker
+    gp = c.GeomGroup(name='test*compact', layer=[0,1])
+    for cls, compact_cls in ((c.SphereGeom, c.CompactSphereGeom),
+      (c.ElectrodeGeom, c.CompactElectrodeGeom)):
+      a = cls(name='e1', position=[1,2,3], group=gp)
+      b = compact_cls(name='e1', position=[1,2,3], group=gp)
+      self.assertFalse(hasattr(b, '__dict__'))
+      self.assertDictEqual(a.to_dict(), b.to_dict())
+      self.assertIs(b.keyframes, c.CompactGeom(name='e2').keyframes)
+      for g in (a, b):
+        g.set_value(name='v', value=[1.0, 3.0], time_stamp=[0, 1])
+        g.set_value(name='d', value=['x', 'y'], time_stamp=[0, 1])
+        g.layer = set([1, 3])
+      self.assertIsInstance(b.keyframes['v'], c.CompactKeyFrame)
+      self.assertDictEqual(a.to_dict(), b.to_dict())
+      self.assertEqual(b._layer, 2 | 8)
+      self.assertEqual(b.animation_value_range('v'), [1.0, 3.0])
+      self.assertListEqual(b.animation_value_names('d'),
+        a.animation_value_names('d'))
+      # removing all keyframes falls back to the shared empty mapping
+      rev = b.revision
+      b.set_value(name='v', value=[])
+      b.set_value(name='d', value=[])
+      self.assertEqual(len(b.keyframes), 0)
+      self.assertIsNone(b._keyframes)
+      self.assertGreater(b.revision, rev)
+    # slotted objects are saved in bundles
+    packer = _Packer()
+    ref = packer.pack(b)
+    index = { 'objects' : packer.objects }
+    obj = _Unpacker(index, packer.arrays).unpack(ref)
+    self.assertDictEqual(obj.to_dict(), b.to_dict())
+
+  def test_free_geom_mesh(self):
+    import numpy as np
+    vertex = np.array([[0,0,0], [1,0,0], [0,1,0], [0,0,1]],
+      dtype=np.float32)
+    face = np.array([[0,1,2], [0,1,3], [0,2,3]], dtype=np.int32)
+    v, f = c.check_mesh(vertex, face)
+    self.assertIs(v, vertex)
+    self.assertIs(f, face)
+    v, f = c.check_mesh(vertex.tolist(), face.tolist())
+    self.assertEqual(v.dtype, np.float64)
+    self.assertEqual(f.shape, (3, 3))
+    for bad in (
+      (vertex[:, :2], face),
+      (np.where(vertex == 1, np.nan, vertex), face),
+      (vertex, face + 1),
+      (vertex, face - 1),
+      (vertex, face + 0.5),
+      (vertex.astype(str), face)):
+      self.assertRaises(Exception, c.check_mesh, *bad)
+
+    gp = c.GeomGroup(name='test*free')
+    tf = pu.tempfile(ext='.json')
+    g = c.FreeGeom(name='mesh', group=gp, vertex=vertex.astype(np.float64),
+      face=face, cache_file=tf)
+    cached = pu.from_json(from_file=tf)
+    self.assertListEqual(cached['free_vertices_mesh'], vertex.tolist())
+    self.assertListEqual(cached['free_faces_mesh'], face.tolist())
+    # same cache (digest) as nested lists
+    re = pu.json_cache(tf, { 'free_vertices_mesh' : vertex.tolist(),
+      'free_faces_mesh' : face.tolist() })
+    self.assertFalse(re['is_new_cache'])
+    np.testing.assert_array_equal(g.get_vertices(), vertex)
+    g2 = c.FreeGeom(name='mesh2', group=gp, vertex=vertex, face=face)
+    self.assertListEqual(g2.get_data('free_faces_mesh2'), face.tolist())
+
+    # vertex values, the same time points are kept for all vertices
+    t = [i / 100 for i in range(100)]
+    value = [[math.sin(x + k) for k in range(4)] for x in t]
+    kf = g.set_value(value=value, time_stamp=t, name='sin', decimate=10)
+    self.assertEqual(len(kf._time), 10)
+    self.assertListEqual([kf._time[0], kf._time[-1]], [0, 0.99])
+    cached = pu.from_json(from_file=kf._cache_path)
+    self.assertEqual(len(cached['free_vertex_colors_sin_mesh']['value']), 10)
+
+class TestVol2Surf(TestCase):
+  
+  def test_sample_linear(self):
+    import numpy as np
+    from ravebrainpy.io._import_fs import reorient_volume
+    # conformed FreeSurfer orientation (LIA)
+    Torig = np.array([[-1,0,0,8],[0,0,1,-8],[0,-1,0,8],[0,0,0,1]])
+    ijk = np.stack(np.meshgrid(*[np.arange(16)] * 3, indexing='ij'))
+    ras = np.einsum('ij,jklm->iklm', Torig[:3,:3], ijk)
+    ras = ras + Torig[:3,3].reshape((3,1,1,1))
+    volume = ras[0] * 2 + ras[1] * 3 - ras[2]
+    cube = np.asfortranarray(reorient_volume(volume, Torig))
+    
+    pts = np.array([[0,0,0], [1.5,-2.25,3.1], [-6.5,4,0.2]])
+    v = c.sample_volume(cube, pts, Torig)
+    np.testing.assert_allclose(v, pts @ [2,3,-1], atol=1e-4)
+    
+    # outside of the volume
+    self.assertTrue(np.isnan(c.sample_volume(cube, [100,0,0], Torig)[0]))
+    
+    # depths between white and pial
+    white = pts
+    pial = pts + [1,0,0]
+    v = c.vol2surf(cube, white, pial, Torig=Torig, depths=[0,1], 
+      reduce=None)
+    self.assertEqual(v.shape, (3, 2))
+    np.testing.assert_allclose(v[:,1] - v[:,0], [2,2,2], atol=1e-4)
+    v = c.vol2surf(cube, white, pial, Torig=Torig, depths=[0,1])
+    np.testing.assert_allclose(v, pts @ [2,3,-1] + 1, atol=1e-4)
+  
+  def test_datacube_cube(self):
+    import numpy as np
+    gp = c.GeomGroup(name='test*cube')
+    value = np.arange(24).reshape((2,3,4))
+    cube = c.DataCubeGeom(name='cube', group=gp, value=value)
+    np.testing.assert_array_equal(cube.get_cube(), value)
+    # dimension and values are taken from one read of the cache file
+    path = pu.tempfile(ext='.json')
+    c.DataCubeGeom(name='cube2', group=gp, value=value, cache_file=path)
+    cube2 = c.DataCubeGeom(name='cube2', group=c.GeomGroup(name='cube2'),
+      cache_file=path)
+    np.testing.assert_array_equal(cube2.get_cube(), value)
+  
+  def test_datacube_overlay(self):
+    import numpy as np
+    gp = c.GeomGroup(name='test*cube')
+    cube = c.DataCubeGeom(name='cube', group=gp, 
+      value=np.zeros((4,5,6)), cache_file=pu.tempfile(ext='.json'))
+    value = np.zeros((4,5,6,3))
+    value[1,2,3,:] = [-3, 1, 5]
+    kf = cube.set_value(value=value, time_stamp=[0, 0.5, 1], 
+      name='stat', threshold=2)
+    self.assertTrue(kf.cached)
+    
+    finfo = gp.group_data['datacube_overlay_stat_cube']
+    self.assertTrue(finfo['is_binary'])
+    self.assertIn('datacube_overlay_stat_cube', gp.cached_items)
+    header, arrays = pu.read_binary(kf._cache_path)
+    self.assertListEqual(arrays['index'].tolist(), [1 + 2*4 + 3*20])
+    self.assertEqual(arrays['value'].dtype, np.uint8)
+    self.assertEqual(arrays['value'].shape, (1, 3))
+    np.testing.assert_allclose(
+      pu.dequantize(arrays['value'], header)[0], [-3, 1, 5], atol=0.05)
+    
+    # dimension of a cube loaded from cache is checked too
+    cached = c.DataCubeGeom(name='cube', group=c.GeomGroup(name='cube'),
+      cache_file=cube.cache_file)
+    with self.assertRaises(Exception):
+      cached.set_value(value=np.zeros((4,5,7)), name='stat')
+    
+    cmap = c.ColorMap('stat', geoms = [cube])
+    self.assertListEqual(cmap.value_range, [-3, 5])
+    self.assertListEqual(cmap.time_range, [0, 1])
+
+class TestBrain(TestCase):
+  
+  def _make_subject(self, root):
+    import os
+    rave_path = os.path.join(root, 'RAVEpy')
+    pu.make_dirs(rave_path)
+    pu.to_json({'Torig' : [[-1,0,0,2],[0,0,1,-2],[0,-1,0,2],[0,0,0,1]]},
+      to_file = os.path.join(rave_path, 'common.pydigest'))
+    c.DataCubeGeom(name = 'T1 (S)', group = c.GeomGroup('Volume - T1 (S)'),
+      value = [[[0.1 * (i + j + k) for k in range(4)] for j in range(4)]
+        for i in range(4)], dim = [4,4,4], half_size = [2,2,2],
+      cache_file = os.path.join(rave_path, 'S_t1.json'))
+    for h, hemi in zip('lr', ['Left', 'Right']):
+      c.FreeGeom(name = 'FreeSurfer %s Hemisphere - pial (S)' % hemi, 
+        group = c.GeomGroup('Surface - pial (S)'),
+        vertex = [[0,0,0], [1,0,0], [0,1,0]], face = [[0,1,2]],
+        cache_file = os.path.join(rave_path, 'S_fs_%sh_pial.json' % h))
+      pu.to_json({'value' : [0,0,0]}, to_file = os.path.join(
+        rave_path, 'S_fs_%sh_sulc.json' % h))
+  
+  def test_lazy_brain(self):
+    import tempfile
+    # nothing is touched in lazy mode
+    brain = c.Brain('S', path = '/path/not/exists', lazy = True)
+    self.assertListEqual(brain.surface_types, ['pial'])
+    self.assertListEqual(brain.volume_types, ['T1'])
+    with self.assertRaises(Exception):
+      brain.surfaces.get('pial')
+    self.assertListEqual(brain.surface_types, [])
+    # failed items are skipped when rendering
+    self.assertEqual(len(brain.get_geometries()), 1)
+    self.assertListEqual(brain.volume_types, [])
+    
+    with tempfile.TemporaryDirectory('ravebrainpytest') as root:
+      self._make_subject(root)
+      brain = c.Brain('S', path = root, lazy = True)
+      self.assertFalse(brain.surfaces.is_loaded('pial'))
+      self.assertFalse(brain.volumes.is_loaded('T1'))
+      self.assertEqual(brain.Torig[0][3], 2)
+      # pending values are loaded when popped
+      surface = brain.surfaces.pop('pial')
+      self.assertTrue(isinstance(surface, c.BrainSurface))
+      brain.add_surface(surface)
+      
+      geoms = brain.get_geometries()
+      self.assertEqual(len(geoms), 4)
+      self.assertTrue(brain.surfaces.is_loaded('pial'))
+      self.assertTrue(brain.volumes.is_loaded('T1'))
+      
+      eager = c.Brain('S', path = root)
+      self.assertListEqual(
+        [g.to_dict() for g in eager.get_geometries()],
+        [g.to_dict() for g in geoms])
+  
+  def test_bundle(self):
+    import os
+    import shutil
+    import tempfile
+    with tempfile.TemporaryDirectory('ravebrainpytest') as root:
+      self._make_subject(root)
+      brain = c.Brain('S', path = root)
+      path = brain.save_bundle(os.path.join(root, 'S.bundle'))
+      cube_path = os.path.join(root, 'RAVEpy', 'S_t1.json')
+      cube_digest = pu.digest_file(cube_path)
+      # original caches are gone, bundle must be self-contained
+      shutil.rmtree(os.path.join(root, 'RAVEpy'))
+      
+      loaded = c.Brain.load_bundle(path)
+      self.assertEqual(str(loaded), str(brain))
+      self.assertListEqual(loaded.Torig, brain.Torig)
+      self.assertListEqual(
+        [g.to_dict()['name'] for g in loaded.get_geometries()],
+        [g.to_dict()['name'] for g in brain.get_geometries()])
+      self.assertEqual(
+        loaded.volumes['T1']._object.get_cube().shape, (4, 4, 4))
+      for g in loaded.get_geometries():
+        for nm in g.group.cached_items:
+          finfo = g.group.group_data[nm]
+          self.assertTrue(os.path.exists(finfo['absolute_path']))
+      # re-created caches have the same content
+      cube = loaded.volumes['T1']._object
+      self.assertEqual(pu.digest_file(cube.cache_file), cube_digest)
+  
+  def test_synthetic_benchmark(self):
+    import os
+    import tempfile
+    from ravebrainpy.benchmarks import make_subject, icosphere, run_benchmarks
+    vertices, faces = icosphere(2)
+    self.assertEqual(vertices.shape, (162, 3))
+    self.assertEqual(faces.shape, (320, 3))
+    with tempfile.TemporaryDirectory('ravebrainpytest') as root:
+      out = os.path.join(root, 'results.json')
+      re = run_benchmarks(out = out, root = root, subdivisions = 2, 
+        volume_dim = 16, contacts = (10, ), repeat = 1, verbose = False)
+      self.assertTrue(os.path.exists(out))
+      names = [r['name'] for r in re['results']]
+      self.assertListEqual(names, [
+        'import_core', 'import_freesurfer_cold', 'import_freesurfer_warm', 'brain_init',
+        'render', 'render_electrodes'])
+      self.assertIn('import.surf', re['results'][1]['stages'])
+      self.assertEqual(re['results'][-1]['params']['contacts'], 10)
+      self.assertListEqual([r['params']['class'] for r in re['geom_memory']],
+        ['ElectrodeGeom', 'CompactElectrodeGeom'] * 2)
+      brain = c.Brain('synthetic', path = os.path.join(root, 'synthetic'))
+      self.assertListEqual(brain.surface_types, ['pial'])
+      self.assertListEqual(brain.volume_types, ['T1'])
+  
+  def test_concurrent_import(self):
+    import os
+    import threading
+    import tempfile
+    from ravebrainpy.benchmarks import make_subject
+    from ravebrainpy.io import import_freesurfer, subject_lock
+    with tempfile.TemporaryDirectory('ravebrainpytest') as root:
+      fspath = make_subject(root, subdivisions = 2, volume_dim = 16)
+      errors = []
+      def worker():
+        try:
+          import_freesurfer('synthetic', fspath)
+        except Exception as e:
+          errors.append(e)
+      threads = [threading.Thread(target=worker) for i in range(4)]
+      for t in threads:
+        t.start()
+      for t in threads:
+        t.join()
+      self.assertListEqual(errors, [])
+      rave_path = os.path.join(fspath, 'RAVEpy')
+      files = os.listdir(rave_path)
+      self.assertFalse(any(['.tmp-' in f for f in files]))
+      for f in files:
+        if f.endswith('.json') or f.endswith('.pydigest'):
+          pu.from_json(from_file = os.path.join(rave_path, f))
+      brain = c.Brain('synthetic', path = fspath)
+      self.assertListEqual(brain.surface_types, ['pial'])
+      # other threads (or processes) time out while the lock is held
+      def timeout_worker():
+        try:
+          import_freesurfer('synthetic', fspath, lock_timeout = 0.1)
+        except Exception as e:
+          errors.append(e)
+      with subject_lock(fspath):
+        t = threading.Thread(target=timeout_worker)
+        t.start()
+        t.join()
+      self.assertEqual(len(errors), 1)
+  
+  def test_import_cohort(self):
+    import os
+    import tempfile
+    from ravebrainpy.benchmarks import make_subject
+    from ravebrainpy.io import import_cohort, discover_subjects, read_manifest
+    with tempfile.TemporaryDirectory('ravebrainpytest') as root:
+      for s in ('A', 'B', 'C'):
+        make_subject(root, subject_code = s, subdivisions = 2, 
+          volume_dim = 16)
+      os.makedirs(os.path.join(root, 'not_a_subject'))
+      self.assertListEqual(discover_subjects(root), ['A', 'B', 'C'])
+      
+      logs = []
+      summary = import_cohort(root, subjects = ['A'], log = logs.append)
+      self.assertEqual(summary['imported'], 1)
+      self.assertTrue(summary['bytes_written'] > 0)
+      self.assertTrue('subjects/min' in logs[-1])
+      
+      summary = import_cohort(root, workers = 2, log = logs.append)
+      self.assertEqual(summary['skipped'], 1)
+      self.assertEqual(summary['imported'], 2)
+      self.assertEqual(set(read_manifest(summary['manifest']).keys()), 
+        set(['A', 'B', 'C']))
+      for s in ('B', 'C'):
+        self.assertTrue(os.path.exists(os.path.join(
+          root, s, 'RAVEpy', '%s_fs_lh_pial.json' % s)))
+      
+      summary = import_cohort(root, force = True, log = logs.append)
+      self.assertEqual(summary['imported'], 3)
+  
+  def test_cache_maintenance(self):
+    import os
+    import time
+    import tempfile
+    from ravebrainpy.benchmarks import make_subject
+    from ravebrainpy.io import import_freesurfer, audit_cache, collect_garbage
+    with tempfile.TemporaryDirectory('ravebrainpytest') as root:
+      fspath = make_subject(root, subdivisions = 2, volume_dim = 16)
+      import_freesurfer('synthetic', fspath)
+      rave_path = os.path.join(fspath, 'RAVEpy')
+      pial = os.path.join(rave_path, 'synthetic_fs_lh_pial.json')
+      self.assertTrue(pu.check_digestfile(pial))
+      
+      report = audit_cache(fspath)
+      self.assertListEqual(report['orphans'], [])
+      self.assertListEqual(report['corrupt'], [])
+      self.assertEqual(report['categories']['surface']['count'], 2)
+      self.assertEqual(report['categories']['curvature']['count'], 2)
+      self.assertEqual(report['categories']['volume']['count'], 1)
+      
+      # value caches of a surface, one of them unused for a long time
+      brain = c.Brain('synthetic', path = fspath)
+      lh = brain.surfaces['pial'].left_hemisphere
+      n = len(lh.get_vertices())
+      lh.set_value(value = [list(range(n))], time_stamp = [0], name = 'old')
+      lh.set_value(value = [list(range(n))], time_stamp = [0], name = 'new')
+      old = os.path.join(rave_path, 'synthetic_fs_lh_pial__old.json')
+      self.assertTrue(os.path.exists(old))
+      past = time.time() - 86400 * 40
+      for p in (old, old + '.pydigest'):
+        os.utime(p, (past, past))
+      with open(os.path.join(rave_path, 'stray.json.pydigest'), 'w') as f:
+        f.write('{}')
+      with open(os.path.join(rave_path, 'synthetic_fs_rh_sulc.json'), 'a') as f:
+        f.write(' ')
+      
+      report = audit_cache(fspath, workers = 2)
+      self.assertEqual(report['categories']['value']['count'], 2)
+      self.assertEqual(len(report['orphans']), 1)
+      self.assertEqual(report['corrupt'][0]['name'], 
+        'synthetic_fs_rh_sulc.json')
+      
+      # subject codes may contain '__'
+      from ravebrainpy.io._maintenance import _category
+      self.assertEqual(_category('sub__01_fs_lh_pial.json', 
+        { 'is_surface' : True }), 'surface')
+      self.assertEqual(_category('sub__01_fs_lh_pial.json', None), 
+        'surface')
+      self.assertEqual(_category('sub__01_fs_lh_pial__v.json', None, 
+        ['sub__01_fs_lh_pial.json']), 'value')
+      
+      re = collect_garbage(fspath, value_max_age = '30d', dry_run = True)
+      self.assertEqual(len(re['removed']), 2)
+      self.assertTrue(os.path.exists(old))
+      re = collect_garbage(fspath, value_max_age = '30d', corrupt = True)
+      self.assertEqual(set([e['name'] for e in re['removed']]), set([
+        'stray.json', 'synthetic_fs_lh_pial__old.json', 
+        'synthetic_fs_rh_sulc.json']))
+      self.assertFalse(os.path.exists(old + '.pydigest'))
+      self.assertTrue(re['removed_bytes_by_category']['value'] > 0)
+      re = collect_garbage(fspath, value_budget = 0)
+      self.assertEqual([e['category'] for e in re['removed']], ['value'])
+      
+      # force removes imported caches and re-creates them
+      import_freesurfer('synthetic', fspath, force = True)
+      report = audit_cache(fspath)
+      self.assertEqual(report['categories']['curvature']['count'], 2)
+      self.assertListEqual(report['orphans'] + report['corrupt'], [])
@@ -57,13 +57,217 @@ class TestUtils(TestCase):
       )
       pass
     
+  def test_json_backend(self):
+    backends = ['json']
+    try:
+      import orjson
+      backends.append('orjson')
+    except ImportError:
+      pass
+    old = pyutils.get_json_backend()
+    x = { 'v' : np.array([0.1, np.nan], dtype=np.float32) }
+    digests = set()
+    try:
+      for backend in backends:
+        pyutils.set_json_backend(backend)
+        d = dict(self._d)
+        d['s'] = set([1])
+        d['f'] = np.float32(1.5)
+        self.assertDictEqual(
+          pyutils.from_json(pyutils.to_json(d)),
+          dict(self.todict(), s = [1], f = 1.5))
+        # caches written by the standard library can be read back
+        self.assertTrue(np.isnan(pyutils.from_json('{"a": NaN}')['a']))
+        digests.add(pyutils.digest(x))
+      self.assertEqual(len(digests), 1)
+    finally:
+      pyutils.set_json_backend(old)
+    
   def test_digest(self):
     s = pyutils.digest(123, length=10)
     self.assertTrue(isinstance(s, str))
     self.assertTrue(len(s) == 10)
+    with tempfile.TemporaryDirectory('ravebrainpytest') as root:
+      m = np.arange(6).reshape((2, 3))
+      for matrix in ('rowmajor', 'colmajor'):
+        path = os.path.join(root, '%s.json' % matrix)
+        pyutils.json_cache(path, m, matrix = matrix)
+        self.assertEqual(pyutils.content_digest(path),
+          pyutils.digest_file(path, mode = 'rb'))
+
+  def test_binary(self):
+    x = np.array([[0, 1.5, np.nan], [3, -1, 2]])
+    q, header = pyutils.quantize(x, dtype='uint8')
+    self.assertEqual(q.dtype, np.uint8)
+    self.assertListEqual(header['value_range'], [-1, 3])
+    back = pyutils.dequantize(q, header)
+    self.assertTrue(np.isnan(back[0, 2]))
+    np.testing.assert_allclose(back[~np.isnan(x)], x[~np.isnan(x)], 
+      atol=header['scale'])
+    
+    with tempfile.TemporaryDirectory('ravebrainpytest') as tmpdir:
+      path = os.path.join(tmpdir, 'test.bin')
+      pyutils.write_binary(path, {'q' : q, 'idx' : np.arange(3)}, header)
+      for mmap in (True, False):
+        h, arrays = pyutils.read_binary(path, mmap=mmap)
+        np.testing.assert_array_equal(arrays['q'], q)
+        np.testing.assert_array_equal(arrays['idx'], np.arange(3))
+        self.assertEqual(h['dtype'], 'uint8')
+
+  
+  def test_workspace(self):
+    import time
+    import subprocess
+    import sys
+    with tempfile.TemporaryDirectory('ravebrainpytest') as root:
+      ws = pyutils.Workspace(root=root, budget='2K')
+      paths = []
+      for i in range(3):
+        path = ws.new_path(prefix='render_', evictable=True)
+        os.makedirs(os.path.join(path, 'sub'))
+        with open(os.path.join(path, 'sub', 'data'), 'wb') as f:
+          f.write(b'0' * 1000)
+        paths.append(path)
+      ws.touch(paths[0])
+      ws.pin(paths[1])
+      # paths[2] is least recently used and not pinned
+      self.assertEqual(ws.evict(), [paths[2]])
+      self.assertEqual(ws.evict(budget=0), [paths[0]])
+      self.assertTrue(os.path.exists(paths[1]))
+      stats = ws.stats()
+      self.assertEqual(stats['evicted'], 2)
+      self.assertEqual(stats['evictable_bytes'], 1000)
+      
+      # entries of crashed processes are removed on start-up
+      proc = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                            stdout=subprocess.PIPE)
+      dead_pid = proc.stdout.decode().strip()
+      orphan = os.path.join(root, 'file_orphan')
+      os.makedirs(os.path.join(orphan, 'a'))
+      with open(os.path.join(root, '.procs', dead_pid), 'w') as f:
+        f.write('file_orphan\nassets\n')
+      ws2 = pyutils.Workspace(root=root)
+      self.assertFalse(os.path.exists(orphan))
+      self.assertEqual(ws2.stats()['recovered'], 1)
+      
+      ws.close()
+      self.assertFalse(os.path.exists(paths[1]))
+      ws2.close()
+  
+  def test_unlink(self):
+    with tempfile.TemporaryDirectory('ravebrainpytest') as root:
+      path = os.path.join(root, 'a')
+      os.makedirs(os.path.join(path, 'b'))
+      with open(os.path.join(path, 'b', 'c'), 'w') as f:
+        f.write('c')
+      self.assertFalse(pyutils.unlink(path, recursive=False))
+      self.assertTrue(pyutils.unlink(path))
+      self.assertFalse(os.path.exists(path))
   
+  def test_profile(self):
+    import pstats
+    
+    @pyutils.profiled('outer')
+    def outer(path):
+      # nested entry points are part of the outer profile
+      return pyutils.json_cache(path, self._d, recache=True)
+    
+    with tempfile.TemporaryDirectory('ravebrainpytest') as root:
+      reports = os.path.join(root, 'profiles')
+      outer(os.path.join(root, 'off.json'))
+      self.assertFalse(os.path.exists(reports))
+      old = pyutils.set_profile('cpu,mem', directory=reports, top=5)
+      try:
+        outer(os.path.join(root, 'on.json'))
+      finally:
+        pyutils.set_profile(old['modes'], directory=old['directory'],
+          top=old['top'])
+      files = sorted(os.listdir(reports))
+      self.assertEqual(len(files), 2)
+      self.assertTrue(files[0].startswith('outer-'))
+      prof = [f for f in files if f.endswith('.prof')][0]
+      stats = pstats.Stats(os.path.join(reports, prof))
+      self.assertTrue(any([fn[2] == 'json_cache' for fn in stats.stats]))
+      mem = [f for f in files if f.endswith('.mem.txt')][0]
+      with open(os.path.join(reports, mem), 'r') as f:
+        self.assertTrue(f.readline().startswith('outer:'))
+    self.assertEqual(pyutils.get_profile()['modes'], old['modes'])
+    with self.assertRaises(Exception):
+      pyutils.set_profile('gpu')
+
+  def test_atomic_write(self):
+    import threading
+    with tempfile.TemporaryDirectory('ravebrainpytest') as root:
+      path = os.path.join(root, 'a.json')
+      pyutils.json_dump({'a' : 1}, path)
+      # failed writes keep the previous file and leave no temporary file
+      with self.assertRaises(TypeError):
+        pyutils.json_dump({'a' : object()}, path)
+      self.assertEqual(pyutils.from_json(from_file=path), {'a' : 1})
+      self.assertListEqual(os.listdir(root), ['a.json'])
+      
+      re = pyutils.json_cache(os.path.join(root, 'b.json'), self._d)
+      self.assertTrue(re['is_new_cache'])
+      self.assertListEqual(sorted(os.listdir(root)), 
+        ['a.json', 'b.json', 'b.json.pydigest'])
+      # valid caches are kept
+      mtime = os.path.getmtime(os.path.join(root, 'b.json'))
+      re = pyutils.json_cache(os.path.join(root, 'b.json'), self._d)
+      self.assertFalse(re['is_new_cache'])
+      self.assertEqual(os.path.getmtime(os.path.join(root, 'b.json')), mtime)
+      # header is written with the data, or alone if only it changed
+      for origin in ('x', 'y'):
+        re = pyutils.json_cache(os.path.join(root, 'b.json'), self._d,
+          digest_header = { 'digest_origin' : origin })
+        self.assertFalse(re['is_new_cache'])
+        info = pyutils.from_json(
+          from_file = os.path.join(root, 'b.json.pydigest'))
+        self.assertEqual(info['digest_origin'], origin)
+        self.assertTrue(pyutils.check_digestfile(os.path.join(root, 'b.json')))
+      
+      lock = pyutils.FileLock(os.path.join(root, '.lock'))
+      events = []
+      def worker():
+        with pyutils.FileLock(lock.path):
+          events.append('worker')
+      with lock:
+        # re-entrant within a thread
+        with lock:
+          self.assertTrue(lock.locked)
+        t = threading.Thread(target=worker)
+        t.start()
+        t.join(0.3)
+        self.assertListEqual(events, [])
+        events.append('main')
+      t.join()
+      self.assertListEqual(events, ['main', 'worker'])
+      self.assertFalse(lock.locked)
+      errors = []
+      def timeout_worker():
+        try:
+          pyutils.FileLock(lock.path, timeout=0.1).acquire()
+        except Exception as e:
+          errors.append(e)
+      with lock:
+        t = threading.Thread(target=timeout_worker)
+        t.start()
+        t.join()
+      self.assertEqual(len(errors), 1)
 
 # class TestRenderer(TestCase):
 #   def test_path(self):
 #     s = ravebrainpy.core.render_threejsbrain()
 #     self.assertTrue(isinstance(s, str))
+  
+  def test_lazy_imports(self):
+    from ravebrainpy.benchmarks import check_import, IMPORT_BUDGET
+    self.assertTrue(pyutils.is_dataframe(self._d['c']))
+    self.assertFalse(pyutils.is_dataframe(self._d['b']))
+    self.assertFalse(pyutils.is_dataframe({ 'A' : [1] }))
+    self.assertEqual(pyutils.json_dumps(self._d['c'], dataframe='column'),
+      '{"A":[1.0,1.2],"B":[2.0,2.3],"C":[3.0,3.4]}' if 
+      pyutils.get_json_backend() == 'orjson' else 
+      '{"A": [1.0, 1.2], "B": [2.0, 2.3], "C": [3.0, 3.4]}')
+    # fresh interpreters, generous budget for slow test machines
+    re = check_import(budget=IMPORT_BUDGET * 4, repeat=2)
+    self.assertListEqual(re['loaded'], [])
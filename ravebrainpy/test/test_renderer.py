@@ -21,3 +21,412 @@ class TestRenderer(TestCase):
     self.assertTrue(isinstance(s, str))
     if False:
       c.start_viewer(s)
+  
+  def test_dedup_cache(self):
+    import os
+    import tempfile
+    with tempfile.TemporaryDirectory('ravebrainpytest') as root:
+      brains = []
+      for subject in ['S1', 'S2', 'S3']:
+        gp = c.GeomGroup(name = 'Surface - pial (%s)' % subject)
+        # template mesh shared by all subjects
+        hemis = [
+          c.FreeGeom(name = 'Standard 141 %s Hemisphere - pial' % h, 
+            group = gp, vertex = [[0,0,0], [1,0,0], [0,1,0]], 
+            face = [[0,1,2]], cache_file = os.path.join(
+              root, 'std141_%sh_pial.json' % h[0].lower()))
+          for h in ['Left', 'Right']
+        ]
+        brain = c.Brain(subject)
+        brain.add_surface(c.BrainSurface(
+          subject_code = subject, surface_type = 'pial', 
+          mesh_type = 'std.141', left_hemisphere = hemis[0], 
+          right_hemisphere = hemis[1]))
+        brains.append(brain)
+      
+      s = c.render_brains(brains)
+      data_path = os.path.join(s, 'lib', 'threebrain_data-0')
+      self.assertEqual(len(os.listdir(os.path.join(data_path, '_shared'))), 2)
+      
+      with open(os.path.join(s, 'data.json'), 'r') as f:
+        content = f.read()
+      for brain in brains:
+        self.assertTrue('"%s"' % brain.subject_code in content)
+      self.assertTrue('../_shared/' in content)
+  
+  def test_shared_assets(self):
+    import os
+    s1 = c.render_threejsbrain(geoms=[])
+    s2 = c.render_threejsbrain(geoms=[])
+    js = os.path.join('dipterixThreeBrain-1.0.1', 'main.js')
+    for s in (s1, s2):
+      self.assertTrue(os.path.exists(os.path.join(s, 'lib', js)))
+      self.assertFalse(os.path.exists(os.path.join(s, 'lib', js + '.map')))
+    self.assertEqual(
+      os.path.realpath(os.path.join(s1, 'lib', js)),
+      os.path.realpath(os.path.join(s2, 'lib', js)))
+    
+    s = c.render_threejsbrain(geoms=[], debug=True, copy_assets=True)
+    self.assertTrue(os.path.exists(os.path.join(s, 'lib', js + '.map')))
+    self.assertFalse(os.path.islink(os.path.join(s, 'lib', js)))
+    
+    # dangling links are re-created
+    from ravebrainpy.core._assets import link_assets
+    lib = os.path.join(s1, 'lib')
+    dst = os.path.join(lib, 'dipterixThreeBrain-1.0.1')
+    os.unlink(dst)
+    os.symlink(os.path.join(lib, 'not-exists'), dst)
+    link_assets(lib)
+    self.assertTrue(os.path.exists(os.path.join(lib, js)))
+  
+  def test_route_cache(self):
+    import os
+    import threading
+    import urllib.request
+    import urllib.error
+    from ravebrainpy.utils._port import HTTPServer
+    gp = c.GeomGroup(name='test*route')
+    gp.set_group_data(name='dset', value=[1,2,3], cache_if_not_exists=True)
+    s = c.render_threejsbrain(geoms=[c.BlankGeom(gp)], cache_files='route')
+    data_path = os.path.join(s, 'lib', 'threebrain_data-0')
+    self.assertFalse(os.path.exists(os.path.join(data_path, 'test_route')))
+    
+    httpd = HTTPServer(s, ('127.0.0.1', 0))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+      url = 'http://127.0.0.1:%d/' % httpd.server_address[1]
+      with urllib.request.urlopen(
+        url + 'lib/threebrain_data-0/test_route/dset') as r:
+        self.assertEqual(pu.from_json(r.read().decode()), {'dset' : [1,2,3]})
+      with self.assertRaises(urllib.error.HTTPError):
+        urllib.request.urlopen(url + '.routes.json')
+    finally:
+      httpd.shutdown()
+      httpd.server_close()
+  
+  def test_server_headers(self):
+    import os
+    import gzip
+    import threading
+    import http.client
+    from ravebrainpy.utils._port import HTTPServer
+    gp = c.GeomGroup(name='test*headers')
+    gp.set_group_data(name='dset', value=list(range(100)),
+                      cache_if_not_exists=True)
+    s = c.render_threejsbrain(geoms=[c.BlankGeom(gp)], cache_files='route',
+                              compress_data=True)
+    digest = pu.from_json(from_file=gp.group_data['dset']['path'] +
+                          '.pydigest')['digest']
+    
+    httpd = HTTPServer(s, ('127.0.0.1', 0))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    # one keep-alive connection for all requests
+    conn = http.client.HTTPConnection('127.0.0.1', httpd.server_address[1])
+    def get(path, **headers):
+      conn.request('GET', path, headers=headers)
+      r = conn.getresponse()
+      return r, r.read()
+    try:
+      r, body = get('/lib/threebrain_data-0/test_headers/dset')
+      self.assertEqual(r.status, 200)
+      self.assertEqual(r.getheader('ETag'), '"%s"' % digest)
+      r, body = get('/lib/threebrain_data-0/test_headers/dset',
+                    **{'If-None-Match' : '"%s"' % digest})
+      self.assertEqual(r.status, 304)
+      r, body = get('/lib/threebrain_data-0/test_headers/dset',
+                    Range='bytes=0-7')
+      self.assertEqual(r.status, 206)
+      with open(gp.group_data['dset']['path'], 'rb') as f:
+        self.assertEqual(body, f.read(8))
+      r, body = get('/lib/threebrain_data-0/test_headers/dset',
+                    Range='bytes=100000-')
+      self.assertEqual(r.status, 416)
+      r, body = get('/lib/threebrain_data-0/test_headers/dset',
+                    Range='bytes=0-7', **{'If-Range' : '"%s"' % digest})
+      self.assertEqual(r.status, 206)
+      
+      r, body = get('/data.json', **{'Accept-Encoding' : 'gzip'})
+      self.assertEqual(r.getheader('Content-Encoding'), 'gzip')
+      with open(os.path.join(s, 'data.json'), 'rb') as f:
+        self.assertEqual(gzip.decompress(body), f.read())
+      gz_etag = r.getheader('ETag')
+      r, body = get('/data.json')
+      self.assertIsNone(r.getheader('Content-Encoding'))
+      self.assertNotEqual(r.getheader('ETag'), gz_etag)
+      # weak entity tags do not validate ranges
+      r, body = get('/data.json', Range='bytes=0-7', 
+                    **{'If-Range' : r.getheader('ETag')})
+      self.assertEqual(r.status, 200)
+    finally:
+      conn.close()
+      httpd.shutdown()
+      httpd.server_close()
+  
+  def test_viewer_sessions(self):
+    import os
+    import urllib.request
+    import urllib.error
+    s1 = c.render_threejsbrain(geoms=[])
+    s2 = c.render_threejsbrain(geoms=[])
+    server = pu.ViewerServer(port=0)
+    try:
+      a = server.register(s1)
+      b = server.register(s2, token='fixed', ttl=60)
+      self.assertEqual(b.url, server.url + '/s/fixed/')
+      pu.stop_viewer_server()
+      sess = pu.register_session(s1, port=0)
+      self.assertIs(pu.get_session(s1), sess)
+      self.assertIs(pu.get_session(sess.token), sess)
+      pu.stop_viewer_server()
+      self.assertEqual(len(server.list_sessions()), 2)
+      for sess in (a, b):
+        with urllib.request.urlopen(sess.url + 'data.json') as r:
+          with open(os.path.join(sess.path, 'data.json'), 'rb') as f:
+            self.assertEqual(r.read(), f.read())
+      
+      # expired or closed sessions are no longer served
+      a.last_access -= 10
+      self.assertEqual(server.expire(max_idle=5), [a])
+      with self.assertRaises(urllib.error.HTTPError):
+        urllib.request.urlopen(a.url + 'data.json')
+      b.close()
+      self.assertEqual(server.list_sessions(), [])
+    finally:
+      server.shutdown()
+  
+  def test_session_events(self):
+    import time
+    import socket
+    import numpy as np
+    s = c.render_threejsbrain(geoms=[])
+    server = pu.ViewerServer(port=0)
+    try:
+      session = server.register(s)
+      sock = socket.create_connection(('127.0.0.1', server.port))
+      sock.sendall(('GET /s/%s/events HTTP/1.1\r\nHost: x\r\n\r\n' %
+                    session.token).encode())
+      stream = sock.makefile('rb')
+      self.assertTrue(stream.readline().startswith(b'HTTP/1.1 200'))
+      while session.n_clients == 0:
+        time.sleep(0.01)
+      
+      # 60 updates of 256 channels
+      names = ['e%d' % i for i in range(256)]
+      start = time.time()
+      for i in range(60):
+        session.update_values(dict(zip(names, np.random.rand(256))),
+                              value_range=[0, 1])
+      received = 0
+      while received < 60:
+        line = stream.readline()
+        if line.startswith(b'data: '):
+          msg = pu.json_loads(line[6:])
+          received += 1
+      self.assertLess(time.time() - start, 2)
+      self.assertEqual(msg['name'], 'update_values')
+      self.assertEqual(len(msg['value']['values']), 256)
+      self.assertEqual(msg['value']['value_range'], [0, 1])
+      
+      # closing the session ends the stream
+      session.close()
+      self.assertEqual(stream.read().strip(), b'')
+      sock.close()
+    finally:
+      server.shutdown()
+  
+  def test_incremental_render(self):
+    import os
+    cache = c.RenderCache()
+    gp = c.GeomGroup(name='test*incremental')
+    gp.set_group_data(name='dset', value=[1,2,3], cache_if_not_exists=True)
+    geoms = []
+    for i in range(50):
+      s = c.SphereGeom(name='e%d' % i, position=[i, 0, 0], group=gp)
+      s.set_value(name='v1', value=i)
+      geoms.append(s)
+    
+    s1 = c.render_threejsbrain(geoms=geoms, render_cache=cache)
+    self.assertEqual(cache.stats['geoms_changed'], 51)
+    self.assertEqual(cache.stats['files_written'], 1)
+    
+    # nothing changed except the global data container
+    s2 = c.render_threejsbrain(geoms=geoms, render_cache=cache)
+    self.assertEqual(s1, s2)
+    self.assertEqual(cache.stats['geoms_changed'], 1)
+    self.assertEqual(cache.stats['groups_changed'], 1)
+    self.assertEqual(cache.stats['files_written'], 0)
+    
+    geoms[3].set_value(name='v1', value=100)
+    c.render_threejsbrain(geoms=geoms, render_cache=cache)
+    self.assertEqual(cache.stats['geoms_changed'], 2)
+    data = pu.from_json(from_file=os.path.join(s1, 'data.json'))
+    e3 = [g for g in data['x']['geoms'] if g['name'] == 'e3'][0]
+    self.assertEqual(e3['keyframes']['v1']['value'], [100])
+    self.assertEqual(data['x']['settings']['color_maps']['v1']['value_range'],
+                     [0, 100])
+    
+    # in-place changes need `mark_dirty`
+    gp.position[0] = 5
+    gp.mark_dirty()
+    c.render_threejsbrain(geoms=geoms, render_cache=cache)
+    self.assertEqual(cache.stats['geoms_changed'], 51)
+  
+  def test_instrument(self):
+    import os
+    import tempfile
+    gp = c.GeomGroup(name='test*instrument')
+    gp.set_group_data(name='dset', value=[1,2,3], cache_if_not_exists=True)
+    geoms = [c.SphereGeom(name='s%d' % i, group=gp) for i in range(3)]
+    geoms[0].set_value(name='v1', value=1)
+    hooked = []
+    pu.add_hook(hooked.append)
+    try:
+      with tempfile.TemporaryDirectory('ravebrainpytest') as root:
+        path = os.path.join(root, 'report.jsonl')
+        with pu.Instrument(name='test', jsonl=path) as inst:
+          c.render_threejsbrain(geoms=geoms)
+        report = inst.report()
+        for nm in ('render', 'render.colormap', 'render.to_dict',
+                   'render.serialize', 'render.cache_files', 
+                   'render.assets', 'render.widget_data'):
+          self.assertTrue(nm in report['stages'], nm)
+        self.assertTrue(report['stages']['render']['peak_memory'] > 0)
+        self.assertEqual(set(report['payload']['geom'].keys()),
+                         set(['s0', 's1', 's2', '__blank__']))
+        self.assertTrue(report['payload']['group_cache']['test*instrument'] > 0)
+        with open(path, 'r') as f:
+          lines = [pu.json_loads(l) for l in f.readlines()]
+        self.assertEqual(len(lines), len(report['records']))
+        self.assertEqual(lines[0]['run'], 'test')
+    finally:
+      pu.remove_hook(hooked.append)
+    self.assertEqual(len(hooked), len(report['records']))
+    self.assertFalse(pu.instrumenting())
+  
+  def test_widget_data(self):
+    import os
+    import gzip
+    s = c.render_threejsbrain(geoms=[], compress_data=True)
+    data = pu.from_json(from_file=os.path.join(s, 'data.json'))
+    self.assertTrue('settings' in data['x'])
+    with gzip.open(os.path.join(s, 'data.json.gz'), 'rt') as f:
+      self.assertEqual(pu.from_json(f.read()), data)
+    with open(os.path.join(s, 'index.html'), 'r') as f:
+      self.assertTrue('"data_url": "data.json"' in f.read())
+    
+    s = c.render_threejsbrain(geoms=[], inline_data=True)
+    self.assertFalse(os.path.exists(os.path.join(s, 'data.json')))
+  
+  def test_content_store(self):
+    import os
+    import tempfile
+    import threading
+    import http.client
+    from ravebrainpy.utils._port import HTTPServer
+    with tempfile.TemporaryDirectory('ravebrainpytest') as root:
+      old = pu.set_store(os.path.join(root, 'store'))
+      try:
+        store = pu.get_store()
+        # same content in two groups is stored once
+        groups = []
+        for nm in ('test*store1', 'test*store2'):
+          gp = c.GeomGroup(name=nm)
+          pu.unlink(gp.cache_path)
+          gp.set_group_data(name='dset', value=list(range(100)),
+                            cache_if_not_exists=True)
+          groups.append(gp)
+        paths = [gp.group_data['dset']['path'] for gp in groups]
+        objs = [pu.store_object(p) for p in paths]
+        self.assertIsNotNone(objs[0])
+        self.assertEqual(objs[0], objs[1])
+        self.assertEqual(store.stats()['objects'], 1)
+        for p in paths:
+          with open(p, 'rb') as f:
+            self.assertEqual(pu.from_json(f.read()), 
+              {'dset' : list(range(100))})
+        
+        s = c.render_threejsbrain(
+          geoms=[c.BlankGeom(gp) for gp in groups], cache_files='route')
+        data = pu.from_json(from_file=os.path.join(s, 'data.json'))
+        fnames = [g['group_data']['dset']['file_name'] 
+          for g in data['x']['groups'] if 'dset' in g['group_data']]
+        rel = store.relpath(objs[0])
+        self.assertListEqual(fnames, ['../../../../../store/' + rel] * 2)
+        self.assertEqual(pu.from_json(from_file=os.path.join(
+          s, pu.ROUTE_FILE)), {})
+        
+        httpd = HTTPServer(s, ('127.0.0.1', 0))
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+        conn = http.client.HTTPConnection('127.0.0.1', 
+          httpd.server_address[1])
+        try:
+          conn.request('GET', '/store/' + rel)
+          r = conn.getresponse()
+          body = r.read()
+          self.assertEqual(r.status, 200)
+          self.assertTrue('immutable' in r.getheader('Cache-Control'))
+          self.assertEqual(r.getheader('ETag'), '"%s"' % 
+            os.path.splitext(os.path.basename(rel))[0])
+          self.assertEqual(pu.from_json(body), {'dset' : list(range(100))})
+          conn.request('GET', '/data.json')
+          r = conn.getresponse()
+          r.read()
+          self.assertEqual(r.getheader('Cache-Control'), 'no-cache')
+        finally:
+          conn.close()
+          httpd.shutdown()
+          httpd.server_close()
+      finally:
+        pu.set_store(old)
+    self.assertIsNone(pu.get_store())
+  
+  def test_decimate(self):
+    import os
+    import numpy as np
+    rng = np.random.default_rng(0)
+    t = (np.arange(2000) / 1000).tolist()
+    values = np.cumsum(rng.normal(size=(20, 2000)), axis=1)
+    geoms = []
+    for i in range(20):
+      s = c.SphereGeom(name='e%d' % i, position=[i, 0, 0])
+      s.set_value(name='hg', value=values[i].tolist(), time_stamp=t)
+      # few frames are kept as they are
+      s.set_value(name='label', value=['a', 'b'], time_stamp=[0, 1])
+      geoms.append(s)
+    geoms[0].set_value(name='short', value=[1, 2, 3], time_stamp=[0, 1, 2])
+    
+    cache = c.RenderCache()
+    s = c.render_threejsbrain(geoms=geoms, render_cache=cache,
+      decimate={ 'frames' : 200, 'method' : 'minmax' })
+    report = cache.stats['decimation']
+    self.assertListEqual(list(report.keys()), ['hg'])
+    self.assertEqual(report['hg']['series'], 20)
+    self.assertEqual(report['hg']['time_axes'], 1)
+    self.assertEqual(report['hg']['frames_before'], 2000)
+    self.assertEqual(report['hg']['frames_after'], 200)
+    self.assertGreater(report['hg']['max_abs_error'], 0)
+    data = pu.from_json(from_file=os.path.join(s, 'data.json'))
+    e0 = [g for g in data['x']['geoms'] if g['name'] == 'e0'][0]
+    kf = e0['keyframes']['hg']
+    self.assertEqual(len(kf['time']), 200)
+    self.assertListEqual([kf['time'][0], kf['time'][-1]], [0.0, 1.999])
+    # min/max per bin keeps the value range
+    self.assertAlmostEqual(min(kf['value']), values[0].min())
+    self.assertAlmostEqual(max(kf['value']), values[0].max())
+    # the geometries keep all frames
+    self.assertEqual(len(geoms[0].keyframes['hg']._time), 2000)
+    self.assertListEqual(geoms[0].keyframes['hg']._values,
+      values[0].tolist())
+    self.assertEqual(len(e0['keyframes']['short']['time']), 3)
+    
+    # LTTB, one frame per 50 ms; series share the time axis
+    idx, r = c.decimate_series(t, values, resolution=0.05)
+    self.assertEqual(idx.shape, (20, 40))
+    self.assertTrue((np.diff(idx, axis=1) > 0).all())
+    idx_shared, r = c.decimate_series(t, values, frames=40, shared=True)
+    self.assertEqual(idx_shared.shape, (1, 40))
+    self.assertRaises(Exception, c.render_threejsbrain, geoms=geoms,
+      decimate={ 'frames' : 100, 'method' : 'mean' })
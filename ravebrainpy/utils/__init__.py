@@ -1,12 +1,29 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 from ._port import port_occupied, open_browser, start_simple_server
-from ._port import stop_server, stop_all_servers
+from ._port import stop_server, stop_all_servers, ROUTE_FILE
+from ._port import ViewerServer, ViewerSession, get_viewer_server, show_url
+from ._port import register_session, list_sessions, expire_sessions
+from ._port import get_session
+from ._port import stop_viewer_server
 from ._funcs import as_dict, rand_string, spread_list, stopifnot
-from ._funcs import matmult4x4, inv4x4
+from ._funcs import is_dataframe
+from ._funcs import matmult4x4, inv4x4, LazyDict, Tracked
 from ._files import check_digestfile, digest, digest_file, file_exists
+from ._files import content_digest, store_object
 from ._files import from_json, json_cache, make_parent_dir, make_dirs
 from ._files import normalize_path, rand_string, read_from_file
 from ._files import tempdir, tempfile, to_json, unlink, write_to_file
+from ._atomic import atomic_open, replace_pair, temp_path, FileLock
+from ._store import ContentStore, get_store, set_store, STORE_PREFIX
+from ._store import CONTENT_DIR
+from ._workspace import Workspace, get_workspace, set_workspace
+from ._instrument import Instrument, instrumenting, stage, timed
+from ._instrument import record_stage, record_payload, add_hook, remove_hook
+from ._profile import profiled, get_profile, set_profile
+from ._json import json_dumps, json_dumpb, json_dump, json_loads
+from ._json import get_json_backend, set_json_backend
+from ._binary import binary_cache, read_binary, write_binary
+from ._binary import quantize, dequantize, digest_arrays
 
 __author__ = "Zhengjia Wang"
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import time
+import threading
+import contextlib
+
+from ._funcs import stopifnot, rand_string
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+try:
+  import msvcrt
+except ImportError:
+  msvcrt = None
+
+# Temporary files are hidden and carry this marker, so they can be told
+# apart from caches (and removed if a writer crashed)
+TEMP_MARKER = '.tmp-'
+
+def temp_path(path):
+  '''
+  Unique temporary path next to `path` (same directory, so it can be
+  moved into place with `os.replace`)
+  '''
+  d, base = os.path.split(path)
+  return os.path.join(d, '.%s%s%s' % (base, TEMP_MARKER, rand_string()))
+
+def _discard(path):
+  try:
+    os.remove(path)
+  except OSError as e:
+    pass
+
+@contextlib.contextmanager
+def atomic_open(path, mode='w', encoding=None):
+  '''
+  Write to a temporary file that replaces `path` once the block exits
+  without error; readers see either the old or the new file, never a
+  partially written one
+
+  Example: `with atomic_open(path, 'wb') as f: f.write(b'...')`
+  '''
+  stopifnot('w' in mode, msg = 'atomic_open only supports writing')
+  if not 'b' in mode and encoding is None:
+    encoding = 'utf-8'
+  tmp = temp_path(path)
+  f = open(tmp, mode, encoding=encoding)
+  try:
+    yield f
+    f.close()
+    os.replace(tmp, path)
+  except BaseException:
+    f.close()
+    _discard(tmp)
+    raise
+
+def replace_pair(data_tmp, path, digest_tmp, digest_path):
+  '''
+  Move a finished data file and its digest into place. The old digest
+  is removed first, so at no point does a digest describe other data
+  than the file next to it (a missing digest means "not cached")
+  '''
+  try:
+    if os.path.lexists(digest_path):
+      os.remove(digest_path)
+    os.replace(data_tmp, path)
+    os.replace(digest_tmp, digest_path)
+  except BaseException:
+    _discard(data_tmp)
+    _discard(digest_tmp)
+    raise
+
+
+# (path, thread) -> [file object, count], locks are re-entrant within
+# a thread
+_held = {}
+_held_lock = threading.Lock()
+
+class FileLock:
+  '''
+  Advisory inter-process lock on `path` (`flock` on POSIX, `msvcrt` on
+  Windows). Re-entrant within a thread. Other processes only respect it
+  if they use the same lock.
+
+  Parameters
+  ----------
+  path : lock file, created if missing
+  timeout : seconds to wait before raising an error; None waits forever
+  '''
+  def __init__(self, path, timeout=None, poll=0.05):
+    self.path = os.path.abspath(path)
+    self.timeout = timeout
+    self.poll = poll
+
+  @property
+  def _key(self):
+    return (self.path, threading.get_ident())
+
+  def _try_lock(self, f):
+    try:
+      if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+      elif msvcrt is not None:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError as e:
+      return False
+    return True
+
+  def acquire(self):
+    key = self._key
+    with _held_lock:
+      held = _held.get(key, None)
+      if held is not None:
+        held[1] += 1
+        return self
+    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+    f = open(self.path, 'a+')
+    start = time.monotonic()
+    while not self._try_lock(f):
+      if self.timeout is not None and \
+        time.monotonic() - start > self.timeout:
+        f.close()
+        stopifnot(False, msg = 'Timed out waiting for lock %s' % self.path)
+      time.sleep(self.poll)
+    with _held_lock:
+      _held[key] = [f, 1]
+    return self
+
+  def release(self):
+    key = self._key
+    with _held_lock:
+      held = _held.get(key, None)
+      if held is None:
+        return
+      held[1] -= 1
+      if held[1] > 0:
+        return
+      _held.pop(key)
+    f = held[0]
+    try:
+      if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+      elif msvcrt is not None:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    finally:
+      f.close()
+
+  @property
+  def locked(self):
+    '''
+    Whether this thread holds the lock
+    '''
+    return self._key in _held
+
+  def __enter__(self):
+    return self.acquire()
+
+  def __exit__(self, exc_type, exc, tb):
+    self.release()
+    return False
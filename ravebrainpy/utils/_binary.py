@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import json
+import struct
+import hashlib
+import math
+import numpy as np
+
+from ._funcs import stopifnot
+from ._files import make_parent_dir, normalize_path, from_json, to_json
+
+# File layout (little endian):
+#   4 bytes   magic 'RBPY'
+#   4 bytes   uint32, length of the JSON header in bytes
+#   n bytes   JSON header (utf-8), padded with spaces to 8-byte alignment
+#   ...       arrays, each starting at header['arrays'][name]['offset']
+#             (relative to the end of the header), Fortran order
+BINARY_MAGIC = b'RBPY'
+BINARY_VERSION = 1
+QUANTIZE_TYPES = ('uint8', 'uint16', 'float16', 'float32')
+# The largest integer code is reserved for NaN
+_NA_CODE = { 'uint8' : 255, 'uint16' : 65535 }
+
+def quantize(x, dtype='uint8', value_range=None):
+  '''
+  Quantize numeric array into compact types
+
+  Parameters
+  ----------
+  x : numeric array
+  dtype : one of 'uint8', 'uint16', 'float16', 'float32'
+  value_range : [min, max] used to scale integer types, default is the
+                range of finite values in `x`
+
+  Returns
+  -------
+  Tuple of quantized array and header (dict) needed to restore values
+  '''
+  stopifnot(dtype in QUANTIZE_TYPES,
+    msg = 'dtype must be one of %s' % ', '.join(QUANTIZE_TYPES))
+  x = np.asarray(x, dtype=np.float64)
+  finite = np.isfinite(x)
+  if value_range is None:
+    if finite.any():
+      value_range = [float(x[finite].min()), float(x[finite].max())]
+    else:
+      value_range = [0.0, 0.0]
+  value_range = [float(value_range[0]), float(value_range[1])]
+  header = {
+    'dtype' : dtype,
+    'value_range' : value_range,
+    'na_code' : _NA_CODE.get(dtype, None)
+  }
+  if dtype in ('float16', 'float32'):
+    return x.astype(dtype), header
+
+  na_code = _NA_CODE[dtype]
+  vmin, vmax = value_range
+  scale = (vmax - vmin) / (na_code - 1)
+  if scale <= 0:
+    scale = 1.0
+  q = np.rint((np.clip(x, vmin, vmax) - vmin) / scale)
+  q[~finite] = na_code
+  header['scale'] = scale
+  return q.astype(dtype), header
+
+def dequantize(q, header):
+  '''
+  Restore values quantized by `quantize`
+  '''
+  dtype = header.get('dtype', 'float32')
+  if dtype in ('float16', 'float32'):
+    return np.asarray(q, dtype=np.float32)
+  vmin = header['value_range'][0]
+  re = np.asarray(q, dtype=np.float32) * header['scale'] + vmin
+  re[np.asarray(q) == header['na_code']] = np.nan
+  return re
+
+def write_binary(path, arrays, header=None):
+  '''
+  Write numpy arrays together with a JSON header into one binary file
+
+  Returns
+  -------
+  The full header written to the file
+  '''
+  header = {} if header is None else dict(header)
+  info = {}
+  offset = 0
+  blobs = []
+  for name, arr in arrays.items():
+    arr = np.asarray(arr)
+    b = arr.astype(arr.dtype.newbyteorder('<'), copy=False).tobytes(order='F')
+    info[name] = {
+      'dtype' : arr.dtype.newbyteorder('<').str,
+      'shape' : list(arr.shape),
+      'offset' : offset,
+      'nbytes' : len(b)
+    }
+    blobs.append(b)
+    # keep each array 8-byte aligned so readers can view it in place
+    pad = (-len(b)) % 8
+    if pad:
+      blobs.append(b'\x00' * pad)
+    offset += len(b) + pad
+  header['arrays'] = info
+  header['format_version'] = BINARY_VERSION
+
+  hs = json.dumps(header).encode('utf-8')
+  hs += b' ' * ((-(len(hs) + 8)) % 8)
+
+  make_parent_dir(path)
+  with open(path, 'wb') as f:
+    f.write(BINARY_MAGIC)
+    f.write(struct.pack('<I', len(hs)))
+    f.write(hs)
+    for b in blobs:
+      f.write(b)
+  return header
+
+def read_binary(path, mmap=False):
+  '''
+  Read header and arrays written by `write_binary`
+
+  Returns
+  -------
+  Tuple of header (dict) and arrays (dict of numpy arrays). If `mmap` is
+  True, arrays are memory-mapped instead of loaded
+  '''
+  stopifnot(os.path.exists(path), msg='read_binary: file not found.')
+  with open(path, 'rb') as f:
+    stopifnot(f.read(4) == BINARY_MAGIC,
+      msg='read_binary: %s is not a ravebrainpy binary file' % path)
+    hlen = struct.unpack('<I', f.read(4))[0]
+    header = json.loads(f.read(hlen).decode('utf-8'))
+    start = 8 + hlen
+    arrays = {}
+    for name, info in header.get('arrays', {}).items():
+      count = int(np.prod(info['shape'])) if len(info['shape']) else 1
+      if mmap:
+        arr = np.memmap(path, dtype=info['dtype'], mode='r',
+          offset=start + info['offset'], shape=count)
+      else:
+        f.seek(start + info['offset'])
+        arr = np.frombuffer(f.read(info['nbytes']), dtype=info['dtype'])
+      arrays[name] = arr.reshape(info['shape'], order='F')
+  return header, arrays
+
+def digest_arrays(arrays, header=None, length=20):
+  m = hashlib.shake_128()
+  if header is not None:
+    m.update(json.dumps(header, sort_keys=True).encode('utf-8'))
+  for name in sorted(arrays.keys()):
+    arr = np.ascontiguousarray(arrays[name])
+    m.update(name.encode('utf-8'))
+    m.update(str((arr.dtype.str, arr.shape)).encode('utf-8'))
+    m.update(arr.reshape(-1).view(np.uint8))
+  return m.hexdigest(math.ceil(length / 2))
+
+def binary_cache(path, arrays, header=None, recache=False,
+  digest_path=None):
+  '''
+  Binary counterpart of `json_cache`: writes `arrays` to `path` unless
+  the digest of existing cache matches
+  '''
+  path = normalize_path(path)
+  if digest_path is None:
+    digest_path = path + '.pydigest'
+
+  d = digest_arrays(arrays, header)
+  if not recache and os.path.exists(path) and os.path.exists(digest_path):
+    try:
+      recache = from_json(from_file=digest_path).get('digest', '') != d
+    except Exception as e:
+      recache = True
+  else:
+    recache = True
+
+  if recache:
+    print('Creating cache data to - %s' % path)
+    write_binary(path, arrays, header)
+    to_json({ 'digest' : d, 'format' : 'binary' }, to_file=digest_path)
+
+  return {
+    'path'            : path,
+    'absolute_path'   : normalize_path(path),
+    'file_name'       : os.path.basename(path),
+    'is_new_cache'    : recache,
+    'is_cache'        : True,
+    'is_binary'       : True
+  }
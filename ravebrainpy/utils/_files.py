@@ -3,44 +3,59 @@
 import os
 import hashlib
 import math
-import json
-import tempfile as tpf
-import atexit
+import shutil
 
 
 from ._funcs import stopifnot, rand_string, as_dict
+from ._json import json_dumps, json_dumpb, json_dump, json_loads
+from ._workspace import get_workspace
+from ._profile import profiled
+from ._atomic import atomic_open, temp_path, replace_pair
+from ._store import get_store
 
 def unlink(path, recursive=True):
+  '''
+  Remove file or directory; non-empty directories are only removed if
+  `recursive` is True. Returns whether `path` no longer exists
+  '''
   removed = True
-  if os.path.exists(path):
+  if os.path.lexists(path):
     removed = False
-    if os.path.isfile(path):
+    if os.path.isfile(path) or os.path.islink(path):
       try:
         os.remove(path)
         removed = True
       except Exception as e:
         pass
     elif recursive:
+      shutil.rmtree(path, ignore_errors=True)
+      removed = not os.path.exists(path)
+    else:
       try:
-        os.removedirs(path)
+        os.rmdir(path)
         removed = True
       except Exception as e:
         pass
   return removed
 
 def tempdir(check=False):
-  d = os.path.join(tpf.gettempdir(), 'py3jsbrain')
+  '''
+  Root of the temporary workspace, see `Workspace`
+  '''
+  d = get_workspace().root
   if check:
     make_dirs(d)
   return normalize_path(d)
 
   
-def tempfile(prefix='file_', ext=''):
-  fname = '%s%s%s' % (prefix, rand_string(), ext)
-  path = os.path.join(tempdir(), fname)
-  atexit.register(unlink, path, False)
-  atexit.register(unlink, path, True)
-  return path
+def tempfile(prefix='file_', ext='', evictable=False):
+  '''
+  New path in the temporary workspace, removed when the process exits.
+  Set `evictable` for outputs that may be removed earlier once the 
+  workspace exceeds its byte budget (least recently used first)
+  '''
+  return get_workspace().new_path(prefix=prefix, ext=ext, 
+    evictable=evictable)
 
 def make_parent_dir(path):
   path = normalize_path(path)
@@ -58,7 +73,8 @@ def normalize_path(path):
   return os.path.abspath(path)
 
 def digest( data, length = 20 ):
-  m = hashlib.shake_128(to_json(data).encode("UTF-8"))
+  # same text as the cache files written by `json_cache`
+  m = hashlib.shake_128(json_dumpb(data, backend = 'json'))
   return m.hexdigest(math.ceil(length / 2))
 
 def digest_file( file, length = 20, mode = 'r' ):
@@ -72,6 +88,25 @@ def digest_file( file, length = 20, mode = 'r' ):
     mode=mode, op = _update_hash)
   return m.hexdigest(math.ceil(length / 2))
 
+def content_digest( path, length = 20 ):
+  '''
+  Digest of file content. Uses the 'digest' recorded in the '.pydigest'
+  file created by `json_cache` if it is not older than the file and is
+  marked as the digest of the file bytes ('file_digest'), otherwise the
+  file is hashed.
+  '''
+  digest_path = path + '.pydigest'
+  try:
+    if os.path.getmtime(digest_path) >= os.path.getmtime(path):
+      info = from_json(from_file=digest_path)
+      d = info.get('digest', None)
+      if info.get('file_digest', False) is True and \
+        isinstance(d, str) and len(d) >= length:
+        return d[:length]
+  except Exception as e:
+    pass
+  return digest_file(path, length = length, mode = 'rb')
+
 # # Almost the same speed, but more RAM
 # def digest_file2( file, length = 20 ):
 #   s = read_from_file(file, sep='')
@@ -80,7 +115,7 @@ def digest_file( file, length = 20, mode = 'r' ):
 
 def write_to_file( s, path ):
   make_parent_dir( path )
-  with open(path, 'w+', encoding='utf-8') as f:
+  with atomic_open(path, 'w', encoding='utf-8') as f:
     f.write( s )
   return None
 
@@ -108,32 +143,74 @@ def read_from_file( path, sep = None, ifnotfound=None,
 
 def to_json( x, dataframe = 'row', matrix = 'rowmajor', 
   to_file = None, **kwargs ):
-  s = json.dumps(as_dict(x, dataframe=dataframe, matrix=matrix))
+  s = json_dumps(x, dataframe=dataframe, matrix=matrix)
   if to_file is not None:
     write_to_file(s, to_file)
   return s
 
 def check_digestfile(path, checksum_file=None, key='digest', **kwargs):
-  # path = '/Users/beauchamplab/rave_data/data_dir/demo/YAB/fs/RAVEpy/YAB_t1.json'
+  '''
+  Whether the digest recorded under `key` in `checksum_file` (default is
+  `path + '.pydigest'`) matches the content of `path`
+  '''
   if checksum_file is None:
     checksum_file = path + '.pydigest'
   if not os.path.exists(checksum_file) or not os.path.exists(path):
     return False
   try:
     d = from_json(from_file=checksum_file)
-    vold = d['key']
+    vold = d[key]
+    kwargs.setdefault('length', len(vold))
     v = digest_file(path, **kwargs)
     return vold == v
   except Exception as e:
     return False
 
 
+def store_object(path, digest_path=None):
+  '''
+  Content store object (see `ContentStore`) that cache file `path`
+  refers to, or None if it is not stored there
+  '''
+  store = get_store()
+  if store is None:
+    return None
+  rel = store.relpath(path)
+  if rel is None:
+    if digest_path is None:
+      digest_path = path + '.pydigest'
+    try:
+      rel = from_json(from_file=digest_path).get('store_object', None)
+    except Exception as e:
+      return None
+  if not isinstance(rel, str):
+    return None
+  obj = os.path.join(store.root, *rel.split('/'))
+  if not os.path.exists(obj):
+    return None
+  return obj
+
+@profiled('json_cache')
 def json_cache( path, data, recache=False, use_digest=True, 
                 digest_header=None, digest_path=None, 
                 **kargs ):
+  '''
+  Write `data` to JSON file `path` unless the digest of existing cache 
+  (`path + '.pydigest'`) matches. If a content store is enabled (see 
+  `set_store`), the data is written once to the store and `path` 
+  becomes a reference to it. Cache files are written by the standard 
+  library whichever JSON backend is chosen, so digests do not change.
+  `digest_header` (dictionary) is written to the digest file together
+  with the data; if only the header has changed, the digest file is
+  replaced. The digest is also the digest of the file bytes only for 
+  `dataframe='row'` and `matrix='rowmajor'`; the digest file then has 
+  'file_digest' set to True (see `content_digest`)
+  '''
   path = normalize_path(path)
   if digest_path is None:
     digest_path = path + '.pydigest'
+  dataframe = kargs.get('dataframe', 'row')
+  matrix = kargs.get('matrix', 'rowmajor')
   digest_content = { 'digest' : 'Nah' }
   rewrite_digest = True
   if use_digest:
@@ -141,6 +218,8 @@ def json_cache( path, data, recache=False, use_digest=True,
       digest_content = digest_header.copy()
     
     digest_content['digest'] = digest(data)
+    digest_content['file_digest'] = dataframe == 'row' and \
+      matrix == 'rowmajor'
     digest_content['header_digest'] = digest(digest_content)
   
   cached_digest = {}
@@ -153,10 +232,11 @@ def json_cache( path, data, recache=False, use_digest=True,
       recache = True
     else:
       try:
-        cached_digest = from_json( digest_path )
+        cached_digest = from_json( from_file = digest_path )
         if cached_digest.get('digest', '') != digest_content['digest']:
           recache = True
-        else:
+        elif type(digest_header) is not dict or cached_digest.get(
+          'header_digest', '') == digest_content['header_digest']:
           rewrite_digest=False
       except Exception as e:
         recache = True
@@ -167,17 +247,38 @@ def json_cache( path, data, recache=False, use_digest=True,
   
   if recache or not os.path.exists( path ):
     print('Creating cache data to - %s' % path)
-    s = to_json( data, **kargs )
     # create dir
     make_parent_dir( path )
-    #os.makedirs( os.path.dirname(path), exist_ok=True)
-    # save to path
-    with open(path, 'w+') as f:
-      f.write(s)
+    # write data (and digest) to temporary files first, then move them
+    # into place together
+    data_tmp = temp_path(path)
+    store = get_store()
+    if store is not None and use_digest and dataframe == 'row' and \
+      matrix == 'rowmajor':
+      # `digest(data)` is the digest of the file content
+      key = digest_content['digest']
+      obj = store.put(key, os.path.splitext(path)[1],
+        lambda p: json_dump( data, p, backend = 'json' ))
+      store.reference(obj, data_tmp)
+      digest_content['store_object'] = store.relpath(obj)
+    else:
+      json_dump( data, data_tmp, dataframe=dataframe, matrix=matrix,
+        backend = 'json' )
+    if use_digest:
+      digest_tmp = temp_path(digest_path)
+      try:
+        to_json(digest_content, to_file = digest_tmp)
+      except BaseException:
+        unlink(data_tmp)
+        raise
+      replace_pair(data_tmp, path, digest_tmp, digest_path)
+    else:
+      os.replace(data_tmp, path)
     is_new_cache=True
-  
-  if use_digest and rewrite_digest:
-    # also check digest_content is changed?
+  elif use_digest and rewrite_digest:
+    # same data, new header
+    if 'store_object' in cached_digest:
+      digest_content['store_object'] = cached_digest['store_object']
     to_json(digest_content, to_file = digest_path)
   
   return {
@@ -199,8 +300,8 @@ def from_json(txt=None, from_file=None, **kwargs):
       'Either "txt" or "from_file" must be None')
     stopifnot(file_exists(from_file), msg='from_json: file not found.')
     
-    with open(from_file, 'r') as f:
-      re = json.load(f)
+    with open(from_file, 'rb') as f:
+      re = json_loads(f.read())
   else:
-    re = json.loads(txt)
+    re = json_loads(txt)
   return re
@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import sys
 import string 
 import random
+import itertools
+from collections.abc import MutableMapping
 import numpy as np
-import pandas as pd
 
 def stopifnot(*args, **kargs):
   msg = kargs.pop('msg', '(Error message not provided)')
@@ -21,6 +23,15 @@ def rand_string(length = 10):
   ltr = string.ascii_letters + string.digits
   return ''.join([random.sample(ltr, 1)[0] for x in range(length)])
 
+def is_dataframe(x):
+  '''
+  Whether `x` is a pandas data frame. Does not import pandas: if pandas
+  has not been imported, `x` cannot be a data frame
+  '''
+  pd = sys.modules.get('pandas', None)
+  DataFrame = getattr(pd, 'DataFrame', None)
+  return DataFrame is not None and isinstance(x, DataFrame)
+
 def as_dict( x, dataframe = 'row', matrix = 'rowmajor' ):
   if isinstance(x, (list, tuple,)):
     return [as_dict(item) for item in x]
@@ -36,13 +47,114 @@ def as_dict( x, dataframe = 'row', matrix = 'rowmajor' ):
       x = x.T
     return x.tolist()
   
-  if isinstance(x, pd.DataFrame):
+  if is_dataframe(x):
     if dataframe != 'row':
       return x.to_dict(orient='list')
     return x.to_dict(orient='records')
   
   return x
 
+# Shared counter so revisions are comparable across objects
+_revisions = itertools.count(1)
+
+class Tracked(object):
+  '''
+  Mixin that records a new revision number whenever an attribute is 
+  assigned, so renderers can tell what has changed since the last 
+  render. In-place changes (e.g. `obj.position[0] = 1`) must call 
+  `mark_dirty`. Attributes listed in `_untracked` are ignored.
+  Subclasses with `__slots__` must include '_revision'.
+  '''
+  __slots__ = ()
+  _untracked = ()
+  
+  def __setattr__(self, name, value):
+    object.__setattr__(self, name, value)
+    if name not in self._untracked:
+      object.__setattr__(self, '_revision', next(_revisions))
+  
+  def mark_dirty(self):
+    object.__setattr__(self, '_revision', next(_revisions))
+  
+  @property
+  def revision(self):
+    return getattr(self, '_revision', 0)
+
+class LazyDict(MutableMapping):
+  '''
+  Dictionary whose values can be registered as loaders (functions 
+  without arguments). Loaders are called on first access of the keys;
+  checking keys (`in`, `keys()`, `len()`) never triggers loading.
+  If a loader raises an error, the key is dropped and the error is 
+  raised to the caller.
+  '''
+  def __init__(self, *args, **kwargs):
+    self._data = dict(*args, **kwargs)
+    self._loaders = {}
+  
+  def set_loader(self, key, loader):
+    self._data.pop(key, None)
+    self._loaders[key] = loader
+  
+  def is_loaded(self, key):
+    return key in self._data
+  
+  def __getitem__(self, key):
+    if key in self._data:
+      return self._data[key]
+    loader = self._loaders.pop(key, None)
+    if loader is None:
+      raise KeyError(key)
+    try:
+      value = loader()
+    except Exception as e:
+      self._data.pop(key, None)
+      raise e
+    # the loader might have stored the value itself
+    if key not in self._data:
+      self._data[key] = value
+    return self._data[key]
+  
+  def __setitem__(self, key, value):
+    self._loaders.pop(key, None)
+    self._data[key] = value
+  
+  def __delitem__(self, key):
+    if key in self._loaders:
+      self._loaders.pop(key)
+      return
+    del self._data[key]
+  
+  def __contains__(self, key):
+    return key in self._data or key in self._loaders
+  
+  def __iter__(self):
+    for key in list(self._data.keys()):
+      yield key
+    for key in list(self._loaders.keys()):
+      if not key in self._data:
+        yield key
+  
+  def __len__(self):
+    return len(self._data) + len(
+      [k for k in self._loaders if not k in self._data])
+  
+  def pop(self, key, default=None):
+    if key in self._loaders:
+      # load pending value so it can be returned
+      self[key]
+    return self._data.pop(key, default)
+  
+  def values(self):
+    return [v for _, v in self.items()]
+  
+  def items(self):
+    return [(key, self[key]) for key in list(self)]
+  
+  def __repr__(self):
+    return 'LazyDict(loaded=%s, pending=%s)' % (
+      list(self._data.keys()), list(self._loaders.keys()))
+
 def spread_list(x, expected_length=[]):
   l = as_dict(x)
   x = []
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import threading
+import contextlib
+import functools
+import tracemalloc
+
+from ._json import json_dumps
+
+# Instruments collecting records, innermost last
+_active = []
+# Functions called with each record, see `add_hook`
+_hooks = []
+_lock = threading.RLock()
+# Stages currently running in each thread, innermost last (for the
+# peak memory of nested stages)
+_local = threading.local()
+
+def _frames():
+  if not hasattr(_local, 'frames'):
+    _local.frames = []
+  return _local.frames
+
+_NULL = contextlib.nullcontext()
+
+def instrumenting():
+  '''
+  Whether any `Instrument` or hook is listening; use it to skip
+  collecting details (e.g. payload sizes) that are otherwise not needed
+  '''
+  return len(_active) > 0 or len(_hooks) > 0
+
+def add_hook(fun):
+  '''
+  Call `fun(record)` for every stage and payload record, whether or not
+  an `Instrument` is active. Records are dictionaries, see `Instrument`
+  '''
+  with _lock:
+    if not fun in _hooks:
+      _hooks.append(fun)
+  return fun
+
+def remove_hook(fun):
+  with _lock:
+    if fun in _hooks:
+      _hooks.remove(fun)
+
+def _emit(record):
+  for inst in list(_active):
+    inst._add(record)
+  for fun in list(_hooks):
+    fun(record)
+
+def _memory_tracing():
+  return any([inst.memory for inst in _active]) and tracemalloc.is_tracing()
+
+class _Stage:
+  def __init__(self, name, meta):
+    self.name = name
+    self.meta = meta
+
+  def __enter__(self):
+    self.memory = _memory_tracing()
+    if self.memory:
+      current, peak = tracemalloc.get_traced_memory()
+      # the peak is reset for this stage; keep the parent's so far
+      frames = _frames()
+      if len(frames):
+        frames[-1].peak = max(frames[-1].peak, peak)
+      tracemalloc.reset_peak()
+      self.start_memory = current
+      self.peak = current
+    _frames().append(self)
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    wall = time.perf_counter() - self.start
+    frames = _frames()
+    if frames and frames[-1] is self:
+      frames.pop()
+    record = {
+      'type' : 'stage',
+      'stage' : self.name,
+      'wall' : wall,
+      'time' : time.time(),
+      'error' : None if exc_type is None else exc_type.__name__
+    }
+    if self.memory and tracemalloc.is_tracing():
+      self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+      record['peak_memory'] = self.peak - self.start_memory
+      if len(frames):
+        frames[-1].peak = max(frames[-1].peak, self.peak)
+    record.update(self.meta)
+    _emit(record)
+    return False
+
+def stage(name, **meta):
+  '''
+  Context manager timing a stage, e.g. `with stage('render.colormap'):`.
+  Does nothing unless `instrumenting()`. Keyword arguments are added
+  to the record
+  '''
+  if not instrumenting():
+    return _NULL
+  return _Stage(name, meta)
+
+def timed(name):
+  '''
+  Decorator running the function as stage `name`
+  '''
+  def decorator(fun):
+    @functools.wraps(fun)
+    def wrapper(*args, **kwargs):
+      with stage(name):
+        return fun(*args, **kwargs)
+    return wrapper
+  return decorator
+
+def record_stage(name, wall, **meta):
+  '''
+  Record a stage timed elsewhere (e.g. accumulated over a loop)
+  '''
+  if instrumenting():
+    record = { 'type' : 'stage', 'stage' : name, 'wall' : wall,
+      'time' : time.time(), 'error' : None }
+    record.update(meta)
+    _emit(record)
+
+def record_payload(kind, name, nbytes, **meta):
+  '''
+  Record payload size, e.g. `record_payload('geom', g.name, 1024)`
+  '''
+  if instrumenting():
+    record = { 'type' : 'payload', 'kind' : kind, 'name' : name,
+      'bytes' : int(nbytes), 'time' : time.time() }
+    record.update(meta)
+    _emit(record)
+
+
+class Instrument:
+  '''
+  Collect wall time, peak memory and payload sizes of the stages run
+  within `with Instrument() as inst:` (render, import, ...)
+
+  Parameters
+  ----------
+  name : label of this run, added to the report
+  memory : record peak memory of stages with `tracemalloc`; tracing
+           slows Python code down, so it can be turned off
+  jsonl : path to append records to as JSON lines when finished
+
+  Records are dictionaries:
+    {'type': 'stage', 'stage', 'wall' (seconds), 'peak_memory' (bytes),
+     'error', 'time', ...}
+    {'type': 'payload', 'kind' ('group', 'geom', ...), 'name', 'bytes',
+     'time', ...}
+  '''
+  def __init__(self, name=None, memory=True, jsonl=None):
+    self.name = name
+    self.memory = memory
+    self.jsonl = jsonl
+    self.records = []
+    self.wall = None
+    self._started_tracing = False
+
+  def _add(self, record):
+    self.records.append(record)
+
+  def __enter__(self):
+    if self.memory and not tracemalloc.is_tracing():
+      tracemalloc.start()
+      self._started_tracing = True
+    self._start = time.perf_counter()
+    with _lock:
+      _active.append(self)
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    self.wall = time.perf_counter() - self._start
+    with _lock:
+      if self in _active:
+        _active.remove(self)
+    if self._started_tracing:
+      tracemalloc.stop()
+      self._started_tracing = False
+    if self.jsonl is not None:
+      self.write_jsonl(self.jsonl)
+    return False
+
+  def report(self):
+    '''
+    Summary as a dictionary: stages (count, total and max wall time,
+    max peak memory), payload bytes by kind and name, and all records
+    '''
+    stages = {}
+    for r in self.records:
+      if r['type'] != 'stage':
+        continue
+      s = stages.setdefault(r['stage'], {
+        'count' : 0, 'wall' : 0.0, 'max_wall' : 0.0 })
+      s['count'] += 1
+      s['wall'] += r['wall']
+      s['max_wall'] = max(s['max_wall'], r['wall'])
+      if 'peak_memory' in r:
+        s['peak_memory'] = max(s.get('peak_memory', 0), r['peak_memory'])
+    payload = {}
+    for r in self.records:
+      if r['type'] != 'payload':
+        continue
+      p = payload.setdefault(r['kind'], {})
+      p[r['name']] = p.get(r['name'], 0) + r['bytes']
+    return {
+      'name' : self.name,
+      'wall' : self.wall,
+      'stages' : stages,
+      'payload' : payload,
+      'payload_bytes' : dict([(k, sum(v.values()))
+        for k, v in payload.items()]),
+      'records' : list(self.records)
+    }
+
+  def write_jsonl(self, path):
+    '''
+    Append records to `path`, one JSON object per line
+    '''
+    with open(path, 'a', encoding='utf-8') as f:
+      for r in self.records:
+        if self.name is not None:
+          r = dict(r, run=self.name)
+        f.write(json_dumps(r))
+        f.write('\n')
+    return path
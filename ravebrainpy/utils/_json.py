@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import json
+import numpy as np
+
+from ._funcs import stopifnot, is_dataframe
+from ._atomic import atomic_open
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+JSON_BACKENDS = ('orjson', 'json')
+
+# orjson if installed; RAVEBRAINPY_JSON_BACKEND overrides
+_backend = {
+  'name' : os.environ.get('RAVEBRAINPY_JSON_BACKEND',
+    'json' if orjson is None else 'orjson')
+}
+if _backend['name'] not in JSON_BACKENDS or (
+  _backend['name'] == 'orjson' and orjson is None):
+  _backend['name'] = 'json'
+
+def get_json_backend():
+  return _backend['name']
+
+def set_json_backend(name):
+  '''
+  Choose JSON backend: 'orjson' (default if installed) or 'json'
+  (standard library). Returns the previous backend.
+
+  Cache files and their digests are always written by the standard
+  library (see `json_cache`), so they do not depend on the backend.
+  '''
+  stopifnot(name in JSON_BACKENDS,
+    msg = 'JSON backend must be one of %s' % ', '.join(JSON_BACKENDS))
+  stopifnot(name != 'orjson' or orjson is not None,
+    msg = 'orjson is not installed')
+  old = _backend['name']
+  _backend['name'] = name
+  return old
+
+def _encode_default(x):
+  '''
+  Called by the encoders for objects they cannot serialize natively
+  '''
+  if isinstance(x, np.ndarray):
+    return x.tolist()
+  if isinstance(x, np.generic):
+    return x.item()
+  if isinstance(x, (set, frozenset, )):
+    return list(x)
+  if is_dataframe(x):
+    return x.to_dict(orient='records')
+  raise TypeError('Object of type %s is not JSON serializable' % (
+    type(x).__name__))
+
+def _encode_orjson(x):
+  if isinstance(x, np.ndarray) and x.dtype.kind in 'biuf':
+    # orjson only takes C-contiguous arrays of native byte order
+    arr = np.ascontiguousarray(x)
+    if arr.dtype.kind == 'f' and arr.dtype.itemsize == 2:
+      return arr.astype(np.float32)
+    return arr.astype(arr.dtype.newbyteorder('='), copy=False)
+  return _encode_default(x)
+
+def _prepare(x, dataframe = 'row', matrix = 'rowmajor'):
+  # options only apply to the top-level object, same as `as_dict`
+  if isinstance(x, (np.ndarray, np.matrix, )):
+    x = np.asarray(x)
+    if matrix != 'rowmajor':
+      x = x.T
+  elif is_dataframe(x) and dataframe != 'row':
+    x = x.to_dict(orient='list')
+  return x
+
+def json_dumpb(x, dataframe = 'row', matrix = 'rowmajor', backend = None):
+  '''
+  Serialize to JSON (utf-8 bytes). Numpy arrays, sets and pandas
+  data frames are encoded directly, without converting the whole
+  object tree with `as_dict` first. `backend` overrides the backend
+  chosen by `set_json_backend`
+  '''
+  x = _prepare(x, dataframe = dataframe, matrix = matrix)
+  if (backend or _backend['name']) == 'orjson':
+    return orjson.dumps(x, default = _encode_orjson,
+      option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+  return json.dumps(x, default = _encode_default).encode('utf-8')
+
+def json_dumps(x, dataframe = 'row', matrix = 'rowmajor'):
+  '''
+  Same as `json_dumpb`, but returns string
+  '''
+  x = _prepare(x, dataframe = dataframe, matrix = matrix)
+  if _backend['name'] == 'orjson':
+    return json_dumpb(x).decode('utf-8')
+  return json.dumps(x, default = _encode_default)
+
+def json_dump(x, path, dataframe = 'row', matrix = 'rowmajor',
+  backend = None):
+  '''
+  Serialize to file `path`. The standard library backend writes in
+  chunks instead of creating one large string. The file is replaced
+  atomically, readers never see partial JSON
+  '''
+  x = _prepare(x, dataframe = dataframe, matrix = matrix)
+  if (backend or _backend['name']) == 'orjson':
+    with atomic_open(path, 'wb') as f:
+      f.write(json_dumpb(x))
+  else:
+    with atomic_open(path, 'w', encoding='utf-8') as f:
+      json.dump(x, f, default = _encode_default)
+  return path
+
+def json_loads(s):
+  if _backend['name'] == 'orjson':
+    try:
+      return orjson.loads(s)
+    except orjson.JSONDecodeError:
+      # e.g. `NaN` written by the standard library
+      pass
+  if isinstance(s, (bytes, bytearray, )):
+    s = s.decode('utf-8')
+  return json.loads(s)
@@ -1,38 +1,590 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import webbrowser
 import http.server
+import json
+import posixpath
+import urllib.parse
+import email.utils
 import multiprocessing
+import threading
+import secrets
+import queue
 import os
 import socket
 import time
 import atexit
 
+from ._funcs import stopifnot
+from ._json import json_dumpb
+from ._workspace import get_workspace
+from ._store import get_store, STORE_PREFIX, CONTENT_DIR
+from ._store import IMMUTABLE_CACHE_CONTROL
+
 def port_occupied(port):
   with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
     return s.connect_ex(('localhost', port)) == 0
   return False
 
 
+# Route table written by the renderer: URL path (relative to the viewer
+# root) -> absolute path of the file to serve. Files starting with '.'
+# are never served, so the table itself is not reachable.
+ROUTE_FILE = '.routes.json'
+
+def load_routes(base_path):
+  path = os.path.join(base_path, ROUTE_FILE)
+  if not os.path.exists(path):
+    return {}
+  with open(path, 'r') as f:
+    routes = json.load(f)
+  return dict([(posixpath.normpath(k), v) for k, v in routes.items()])
+
+def _file_etag(path, fs):
+  '''
+  Strong ETag from the cache digest (`.pydigest` written by
+  `json_cache`) if it is newer than the file and is the digest of the
+  file bytes, otherwise a weak ETag from modification time and size
+  '''
+  digest_path = path + '.pydigest'
+  try:
+    if os.stat(digest_path).st_mtime >= fs.st_mtime:
+      with open(digest_path, 'r') as f:
+        info = json.load(f)
+      d = info.get('digest', None)
+      if info.get('file_digest', False) is True and \
+        isinstance(d, str) and len(d):
+        return '"%s"' % d
+  except (OSError, ValueError, AttributeError) as e:
+    pass
+  return 'W/"%x-%x"' % (int(fs.st_mtime * 1000), fs.st_size)
+
+def _parse_range(value, size):
+  '''
+  Parse a single-range `Range` header into (start, end) inclusive.
+  Returns None if the header should be ignored, or False if the range
+  cannot be satisfied
+  '''
+  if value is None or not value.startswith('bytes='):
+    return None
+  spec = value[6:].strip()
+  if ',' in spec or not '-' in spec:
+    # multipart ranges are not supported, send the whole file
+    return None
+  start, end = [x.strip() for x in spec.split('-', 1)]
+  try:
+    if start == '':
+      # suffix range: last n bytes
+      n = int(end)
+      if n <= 0:
+        return False
+      return (max(size - n, 0), size - 1)
+    start = int(start)
+    end = size - 1 if end == '' else min(int(end), size - 1)
+  except ValueError as e:
+    return None
+  if start >= size or start > end:
+    return False
+  return (start, end)
+
+class _RangeFile:
+  '''
+  Read-only view of bytes [start, start + length) of an opened file
+  '''
+  def __init__(self, f, start, length):
+    self._f = f
+    self._remaining = length
+    f.seek(start)
+  def read(self, n=-1):
+    if self._remaining <= 0:
+      return b''
+    if n is None or n < 0 or n > self._remaining:
+      n = self._remaining
+    b = self._f.read(n)
+    self._remaining -= len(b)
+    return b
+  def close(self):
+    self._f.close()
+
 class HTTPHandler(http.server.SimpleHTTPRequestHandler):
-  """This handler uses server.base_path instead of always using os.getcwd()"""
+  """This handler uses server.base_path instead of always using os.getcwd()
+
+  Connections are kept alive (HTTP/1.1). Files are served with ETags
+  (see `_file_etag`), precompressed `<file>.gz` variants are sent to
+  clients accepting gzip, and single byte ranges are honored.
+  Content-addressed files (content store under `/store/`, and
+  `CONTENT_DIR` of render directories) are sent as immutable.
+  """
+  protocol_version = 'HTTP/1.1'
+
   def translate_path(self, path):
-    path = http.server.SimpleHTTPRequestHandler.translate_path(self, path)
-    relpath = os.path.relpath(path, os.getcwd())
-    fullpath = os.path.join(self.server.base_path, relpath)
-    return fullpath
+    relpath = urllib.parse.unquote(urllib.parse.urlsplit(path).path)
+    trailing = '/' if relpath.endswith('/') else ''
+    relpath = posixpath.normpath(relpath.lstrip('/'))
+    base_path, routes = self.server.base_path, self.server.routes
+    parts = relpath.split('/', 2)
+    # /store/... is the content store, shared by all sessions
+    if parts[0] == STORE_PREFIX and len(parts) > 1:
+      store = get_store()
+      if store is None:
+        return os.path.join(os.sep, '.forbidden', '404')
+      base_path, routes = store.root, {}
+      relpath = '/'.join(parts[1:])
+    # /s/<token>/... is served from the directory of that session
+    if len(parts) >= 2 and parts[0] == SESSION_PREFIX:
+      session = self.server.get_session(parts[1])
+      if session is None:
+        return os.path.join(os.sep, '.forbidden', '404')
+      base_path, routes = session.path, session.routes
+      relpath = parts[2] if len(parts) > 2 else '.'
+    if base_path is None:
+      return os.path.join(os.sep, '.forbidden', '404')
+    # registered routes are served in place
+    if relpath in routes:
+      return routes[relpath]
+    parts = [p for p in relpath.split('/') if p != '.']
+    if any([p.startswith('.') for p in parts]):
+      return os.path.join(base_path, '.forbidden', '404')
+    return os.path.join(base_path, *parts) + trailing
+
+  def _accepts_gzip(self):
+    enc = self.headers.get('Accept-Encoding', '')
+    return any([e.split(';')[0].strip() == 'gzip' for e in enc.split(',')])
+
+  def _content_digest(self):
+    '''
+    Digest (file name) if the request is for a content-addressed file:
+    content store objects, or files under `CONTENT_DIR` of render
+    directories. These never change
+    '''
+    parts = urllib.parse.unquote(
+      urllib.parse.urlsplit(self.path).path).strip('/').split('/')
+    if len(parts) >= 2 and (parts[0] == STORE_PREFIX or 
+      parts[-2] == CONTENT_DIR):
+      return posixpath.splitext(parts[-1])[0]
+    return None
+
+  def send_head(self):
+    path = self.translate_path(self.path)
+    if os.path.isdir(path) or path.endswith('/'):
+      # redirects, index.html and directory listing
+      return http.server.SimpleHTTPRequestHandler.send_head(self)
+    try:
+      f = open(path, 'rb')
+    except OSError as e:
+      self.send_error(http.server.HTTPStatus.NOT_FOUND, "File not found")
+      return None
+    try:
+      fs = os.fstat(f.fileno())
+      content_digest = self._content_digest()
+      immutable = content_digest is not None
+      if immutable:
+        etag = '"%s"' % content_digest
+      else:
+        etag = _file_etag(path, fs)
+      ctype = self.guess_type(path)
+      encoding = None
+
+      # precompressed variant; ranges always refer to the identity body
+      range_header = self.headers.get('Range', None)
+      if range_header is None and self._accepts_gzip():
+        try:
+          gz = open(path + '.gz', 'rb')
+          gzfs = os.fstat(gz.fileno())
+          if gzfs.st_mtime >= fs.st_mtime:
+            f.close()
+            f, fs, encoding = gz, gzfs, 'gzip'
+            # different body, different entity tag
+            etag = etag[:-1] + '-gz"'
+          else:
+            gz.close()
+        except OSError as e:
+          pass
+
+      inm = self.headers.get('If-None-Match', None)
+      if inm is not None and etag in [
+        x.strip() for x in inm.split(',')] + ['*']:
+        f.close()
+        self.send_response(http.server.HTTPStatus.NOT_MODIFIED)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return None
+
+      size = fs.st_size
+      rng = _parse_range(range_header, size)
+      if rng is False:
+        f.close()
+        self.send_response(
+          http.server.HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.send_header('Content-Range', 'bytes */%d' % size)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return None
+      if rng is not None:
+        # weak entity tags cannot validate ranges (RFC 7233)
+        if_range = self.headers.get('If-Range', None)
+        if if_range is not None and (if_range != etag or 
+          etag.startswith('W/')):
+          rng = None
+
+      if rng is None:
+        self.send_response(http.server.HTTPStatus.OK)
+        length = size
+      else:
+        self.send_response(http.server.HTTPStatus.PARTIAL_CONTENT)
+        length = rng[1] - rng[0] + 1
+        self.send_header('Content-Range', 'bytes %d-%d/%d' % (
+          rng[0], rng[1], size))
+        f = _RangeFile(f, rng[0], length)
+      self.send_header('Content-type', ctype)
+      self.send_header('Content-Length', str(length))
+      self.send_header('Accept-Ranges', 'bytes')
+      self.send_header('ETag', etag)
+      self.send_header('Cache-Control',
+        IMMUTABLE_CACHE_CONTROL if immutable else 'no-cache')
+      self.send_header('Vary', 'Accept-Encoding')
+      self.send_header('Last-Modified',
+        email.utils.formatdate(fs.st_mtime, usegmt=True))
+      if encoding is not None:
+        self.send_header('Content-Encoding', encoding)
+      self.end_headers()
+      return f
+    except Exception as e:
+      f.close()
+      raise
+
+  def do_GET(self):
+    session = self._event_session()
+    if session is not None:
+      return self._serve_events(session)
+    return http.server.SimpleHTTPRequestHandler.do_GET(self)
+
+  def _event_session(self):
+    relpath = urllib.parse.urlsplit(self.path).path.strip('/').split('/')
+    if len(relpath) == 3 and relpath[0] == SESSION_PREFIX and \
+      relpath[2] == EVENT_PATH:
+      return self.server.get_session(relpath[1])
+    return None
+
+  def _serve_events(self, session):
+    # Server-sent events: one long response, each message is a
+    # 'data: <json>' block. The connection is closed afterwards
+    client = session.subscribe()
+    try:
+      self.close_connection = True
+      self.send_response(http.server.HTTPStatus.OK)
+      self.send_header('Content-Type', 'text/event-stream')
+      self.send_header('Cache-Control', 'no-cache')
+      self.send_header('Connection', 'close')
+      self.end_headers()
+      self.wfile.write(b'retry: 1000\n\n')
+      self.wfile.flush()
+      while True:
+        try:
+          messages = [client.get(timeout=EVENT_KEEPALIVE)]
+        except queue.Empty as e:
+          self.wfile.write(b': keep-alive\n\n')
+          self.wfile.flush()
+          continue
+        # send whatever is queued in one write
+        while True:
+          try:
+            messages.append(client.get_nowait())
+          except queue.Empty as e:
+            break
+        closed = None in messages
+        messages = [m for m in messages if m is not None]
+        if len(messages):
+          self.wfile.write(b''.join([b'data: ' + m + b'\n\n'
+            for m in messages]))
+          self.wfile.flush()
+        if closed:
+          break
+    except (BrokenPipeError, ConnectionResetError) as e:
+      pass
+    finally:
+      session.unsubscribe(client)
+
   def log_message(self, *args, **kwargs):
     pass
 
-class HTTPServer(http.server.HTTPServer):
-  """The main server, you pass in base_path which is the path you want to serve requests from"""
+class HTTPServer(http.server.ThreadingHTTPServer):
+  """The main server, you pass in base_path which is the path you want to serve requests from
+
+  Each request is handled in its own thread, so the viewer's parallel
+  requests (libraries, surfaces, volumes) do not wait on each other.
+  Additional directories can be mounted as sessions under
+  `/s/<token>/`, see `ViewerServer`. `base_path` can be None if only
+  sessions are served.
+  """
+  daemon_threads = True
   def __init__(self, base_path, server_address, RequestHandlerClass=HTTPHandler):
     self.base_path = base_path
-    http.server.HTTPServer.__init__(self, server_address, RequestHandlerClass)
+    self.routes = {} if base_path is None else load_routes(base_path)
+    self.sessions = {}
+    self._session_lock = threading.Lock()
+    http.server.ThreadingHTTPServer.__init__(self, server_address, RequestHandlerClass)
+
+  def get_session(self, token):
+    with self._session_lock:
+      session = self.sessions.get(token, None)
+      if session is None:
+        return None
+      if session.expired():
+        self.sessions.pop(token, None)
+        get_workspace().unpin(session.path)
+        return None
+    session.last_access = time.time()
+    return session
+
+
+# URL prefix of sessions: /s/<token>/
+SESSION_PREFIX = 's'
+# Server-sent event stream of a session: /s/<token>/events
+EVENT_PATH = 'events'
+# Seconds between keep-alive comments on idle event streams
+EVENT_KEEPALIVE = 15
+# Messages kept per client; the oldest are dropped if a client lags
+EVENT_QUEUE_SIZE = 256
+
+class ViewerSession:
+  """A render directory mounted on `ViewerServer`"""
+  def __init__(self, server, path, token, ttl=None):
+    self.server = server
+    self.path = os.path.abspath(path)
+    self.token = token
+    self.ttl = ttl
+    self.routes = load_routes(self.path)
+    self.created = time.time()
+    self.last_access = self.created
+    self._clients = []
+    self._client_lock = threading.Lock()
+
+  @property
+  def url(self):
+    return '%s/%s/%s/' % (self.server.url, SESSION_PREFIX, self.token)
+
+  def expired(self, now=None):
+    if self.ttl is None or len(self._clients):
+      # viewers listening to events keep the session alive
+      return False
+    if now is None:
+      now = time.time()
+    return now - self.last_access > self.ttl
+
+  def close(self):
+    self.server.unregister(self.token)
+
+  def subscribe(self):
+    client = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+    with self._client_lock:
+      self._clients.append(client)
+    return client
+
+  def unsubscribe(self, client):
+    with self._client_lock:
+      if client in self._clients:
+        self._clients.remove(client)
+
+  @property
+  def n_clients(self):
+    return len(self._clients)
+
+  def _broadcast(self, message):
+    with self._client_lock:
+      clients = list(self._clients)
+    for client in clients:
+      while True:
+        try:
+          client.put_nowait(message)
+          break
+        except queue.Full as e:
+          try:
+            client.get_nowait()
+          except queue.Empty as e:
+            pass
+
+  def send(self, name, value):
+    '''
+    Push message to connected viewers. The viewer calls its handler
+    `handle_<name>(value)`, the same handlers used by shiny messages
+    (e.g. 'display_data', 'camera', 'background', 'controllers')
+    '''
+    self.last_access = time.time()
+    self._broadcast(json_dumpb({ 'name' : name, 'value' : value }))
+    return self.n_clients
+
+  def update_values(self, values, name='Value', time_stamp=0,
+    data_type=None, value_range=None, colormap=None):
+    '''
+    Replace animation values of geometries in open viewers
+
+    Parameters
+    ----------
+    values : dict of geometry name -> value (number, string, or list
+             with one value per time stamp)
+    name : animation (keyframe) name
+    time_stamp : time stamp, or list of time stamps
+    data_type : 'continuous' or 'discrete', default is inferred by the
+                viewer
+    value_range : new display range, [min, max]
+    colormap : color map (`ColorMap` or its `to_dict()`) if the color
+               map has changed
+
+    Returns
+    -------
+    Number of connected viewers
+    '''
+    update = { 'name' : name, 'values' : values, 'time' : time_stamp }
+    if data_type is not None:
+      update['data_type'] = data_type
+    if value_range is not None:
+      update['value_range'] = [float(value_range[0]), float(value_range[1])]
+    if colormap is not None:
+      update['colormap'] = colormap.to_dict() if hasattr(
+        colormap, 'to_dict') else colormap
+    return self.send('update_values', update)
+
+  def to_dict(self):
+    return {
+      'token' : self.token,
+      'path' : self.path,
+      'url' : self.url,
+      'created' : self.created,
+      'last_access' : self.last_access,
+      'ttl' : self.ttl
+    }
+
+  def __repr__(self):
+    return '<ViewerSession %s: %s>' % (self.token, self.path)
+
+
+class ViewerServer:
+  """
+  One HTTP server per Python process, serving every render directory
+  as a session under `/s/<token>/`
+
+  The server runs in a daemon thread, so registering a render is a
+  dictionary insert: no process is forked and no port is scanned. If
+  `port` is in use, the operating system picks a free one.
+  """
+  def __init__(self, host='127.0.0.1', port=12355):
+    try:
+      self.httpd = HTTPServer(None, (host, port))
+    except OSError as e:
+      self.httpd = HTTPServer(None, (host, 0))
+    self.host = host
+    self.port = self.httpd.server_address[1]
+    self.url = 'http://%s:%d' % (host, self.port)
+    self._thread = threading.Thread(
+      target=self.httpd.serve_forever, daemon=True,
+      name='py-threeBrain-server-%d' % self.port)
+    self._thread.start()
+
+  def is_alive(self):
+    return self._thread.is_alive()
+
+  def register(self, path, token=None, ttl=None):
+    '''
+    Mount directory `path`; returns `ViewerSession`. Sessions not
+    accessed for `ttl` seconds expire (never if `ttl` is None)
+    '''
+    stopifnot(os.path.isdir(path), msg='%s is not a directory' % path)
+    if token is None:
+      token = secrets.token_urlsafe(9)
+    session = ViewerSession(self, path, token, ttl=ttl)
+    with self.httpd._session_lock:
+      self.httpd.sessions[token] = session
+    # served render directories are not evicted from the workspace
+    get_workspace().pin(session.path)
+    return session
+
+  def unregister(self, token):
+    with self.httpd._session_lock:
+      session = self.httpd.sessions.pop(token, None)
+    if session is None:
+      return False
+    # end event streams
+    session._broadcast(None)
+    get_workspace().unpin(session.path)
+    return True
+
+  def list_sessions(self):
+    with self.httpd._session_lock:
+      return list(self.httpd.sessions.values())
+
+  def expire(self, max_idle=None):
+    '''
+    Remove sessions that have expired, or that have not been accessed
+    for `max_idle` seconds. Returns the removed sessions
+    '''
+    now = time.time()
+    removed = []
+    with self.httpd._session_lock:
+      for token, session in list(self.httpd.sessions.items()):
+        if session.expired(now) or (
+          max_idle is not None and now - session.last_access > max_idle):
+          removed.append(self.httpd.sessions.pop(token))
+    for session in removed:
+      session._broadcast(None)
+      get_workspace().unpin(session.path)
+    return removed
+
+  def shutdown(self):
+    for session in self.list_sessions():
+      self.unregister(session.token)
+    self.httpd.shutdown()
+    self.httpd.server_close()
+
+
+_viewer_server = {}
+
+def get_viewer_server(host='127.0.0.1', port=12355):
+  '''
+  Return the viewer server of this process, starting it if needed
+  '''
+  server = _viewer_server.get('server', None)
+  if server is None or not server.is_alive():
+    server = ViewerServer(host, port)
+    _viewer_server['server'] = server
+  return server
+
+def register_session(path, token=None, ttl=None, host='127.0.0.1',
+  port=12355):
+  return get_viewer_server(host, port).register(path, token=token, ttl=ttl)
+
+def list_sessions():
+  server = _viewer_server.get('server', None)
+  if server is None:
+    return []
+  return server.list_sessions()
+
+def get_session(key):
+  '''
+  Find session by token or by its render directory; returns the most
+  recent match, or None
+  '''
+  for session in reversed(list_sessions()):
+    if key == session.token or (isinstance(key, str) and
+      os.path.abspath(key) == session.path):
+      return session
+  return None
+
+def expire_sessions(max_idle=None):
+  server = _viewer_server.get('server', None)
+  if server is None:
+    return []
+  return server.expire(max_idle=max_idle)
+
+def stop_viewer_server():
+  server = _viewer_server.pop('server', None)
+  if server is not None:
+    server.shutdown()
 
 
 def open_browser(url, protocol='http'):
-  webbrowser.open('%s://%s', (protocol, url), new=2)
+  import webbrowser
+  webbrowser.open('%s://%s' % (protocol, url), new=2)
 
 
 server_lists = {}
@@ -92,6 +644,16 @@ def detect_jupyter():
   
   return False
 
+def show_url(url, launch_browser=True):
+  if launch_browser:
+    if detect_jupyter():
+      import IPython
+      return IPython.display.IFrame(url, width="100%", height="500")
+    else:
+      import webbrowser
+      webbrowser.open(url, new=2)
+  return url
+
 def start_simple_server(host, port, path, launch_browser=True):
   serv = SimpleServer(host, port, path)
   serv.start()
@@ -100,14 +662,7 @@ def start_simple_server(host, port, path, launch_browser=True):
   time.sleep(1)
   
   url = 'http://%s:%d' % (serv.host, serv.port)
-  if launch_browser:
-    if detect_jupyter():
-      import IPython
-      return IPython.display.IFrame(url, width="100%", height="500")
-    else:
-      webbrowser.open(url, new=2)
-  
-  return url
+  return show_url(url, launch_browser=launch_browser)
   
   
 def stop_server(port):
@@ -124,5 +679,6 @@ def stop_server(port):
 def stop_all_servers():
   for k in list(server_lists.keys()):
     stop_server(k)
+  stop_viewer_server()
   
 
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import time
+import itertools
+import threading
+import functools
+
+from ._funcs import stopifnot
+
+PROFILE_MODES = ('cpu', 'mem')
+
+def _parse_modes(modes):
+  if modes is None or modes is False:
+    return ()
+  if isinstance(modes, str):
+    modes = [m.strip().lower() for m in modes.split(',')]
+  modes = tuple([m for m in modes if m not in ('', '0', 'off', 'none')])
+  if 'all' in modes or '1' in modes:
+    modes = PROFILE_MODES
+  stopifnot(all([m in PROFILE_MODES for m in modes]),
+    msg = 'Profile modes must be among %s' % ', '.join(PROFILE_MODES))
+  return modes
+
+_config = {
+  'modes' : _parse_modes(os.environ.get('RAVEBRAINPY_PROFILE', '')),
+  'directory' : os.environ.get('RAVEBRAINPY_PROFILE_DIR',
+    'ravebrainpy_profiles'),
+  'top' : int(os.environ.get('RAVEBRAINPY_PROFILE_TOP', 25))
+}
+_counter = itertools.count(1)
+# only the outermost profiled call is profiled (cProfile cannot be
+# nested), inner entry points show up in its output
+_local = threading.local()
+_lock = threading.Lock()
+
+def get_profile():
+  '''
+  Current profile settings: modes, directory and top (number of lines
+  in allocation reports)
+  '''
+  return dict(_config)
+
+def set_profile(modes=None, directory=None, top=None):
+  '''
+  Profile entry points (`import_freesurfer`, `Brain.__init__`,
+  `Brain.render`, `json_cache`) from now on; same as setting environment
+  variables `RAVEBRAINPY_PROFILE`, `RAVEBRAINPY_PROFILE_DIR` and
+  `RAVEBRAINPY_PROFILE_TOP` before start-up
+
+  Parameters
+  ----------
+  modes : 'cpu' (cProfile, `.prof` files readable by `pstats` or
+          snakeviz), 'mem' (tracemalloc, top allocations as text),
+          'cpu,mem', or None/'' to turn profiling off
+  directory : where the reports are written
+  top : number of allocation sites listed in memory reports
+
+  Returns
+  -------
+  Previous settings
+  '''
+  old = get_profile()
+  _config['modes'] = _parse_modes(modes)
+  if directory is not None:
+    _config['directory'] = directory
+  if top is not None:
+    _config['top'] = int(top)
+  return old
+
+def _report_path(name, ext):
+  directory = _config['directory']
+  os.makedirs(directory, exist_ok=True)
+  fname = '%s-%s-%d-%d%s' % (
+    name.replace('.', '_').replace(os.sep, '_'),
+    time.strftime('%Y%m%d-%H%M%S'), os.getpid(), next(_counter), ext)
+  return os.path.join(directory, fname)
+
+def _write_memory_report(path, name, wall, before, after, peak, top):
+  stats = after.compare_to(before, 'lineno')
+  with open(path, 'w', encoding='utf-8') as f:
+    f.write('%s: %.3f s, peak traced memory %.1f MiB\n' % (
+      name, wall, peak / 1024 ** 2))
+    f.write('Top %d allocation sites (size, net change, count):\n' % top)
+    for s in stats[:top]:
+      f.write('%s\n' % s)
+  return path
+
+def _run_profiled(name, fun, args, kwargs):
+  import cProfile
+  import tracemalloc
+  modes = _config['modes']
+  top = _config['top']
+  prof = None
+  started_tracing = False
+  before = None
+  if 'mem' in modes:
+    if not tracemalloc.is_tracing():
+      tracemalloc.start()
+      started_tracing = True
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+  if 'cpu' in modes:
+    prof = cProfile.Profile()
+    try:
+      prof.enable()
+    except ValueError as e:
+      # another profiler is active
+      prof = None
+  _local.depth = 1
+  start = time.perf_counter()
+  try:
+    return fun(*args, **kwargs)
+  finally:
+    wall = time.perf_counter() - start
+    if prof is not None:
+      prof.disable()
+    _local.depth = 0
+    with _lock:
+      if prof is not None:
+        prof.dump_stats(_report_path(name, '.prof'))
+      if before is not None:
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        if started_tracing:
+          tracemalloc.stop()
+        _write_memory_report(_report_path(name, '.mem.txt'),
+          name, wall, before, after, peak, top)
+
+def profiled(name):
+  '''
+  Decorator profiling the function as `name` when profiling is on (see
+  `set_profile`); otherwise the function is called directly
+  '''
+  def decorator(fun):
+    @functools.wraps(fun)
+    def wrapper(*args, **kwargs):
+      if not _config['modes'] or getattr(_local, 'depth', 0):
+        return fun(*args, **kwargs)
+      return _run_profiled(name, fun, args, kwargs)
+    return wrapper
+  return decorator
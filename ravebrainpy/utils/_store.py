@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import threading
+
+from ._atomic import temp_path
+
+# URL prefix the viewer server serves the store under (`/store/...`),
+# shared by all sessions so browsers can cache objects across them
+STORE_PREFIX = 'store'
+# Directory name of content-addressed files in render directories
+CONTENT_DIR = '_shared'
+# Store objects and content-addressed files never change, see
+# `HTTPHandler.send_head`
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+def _link_or_copy(src, dst):
+  for link in (os.link, os.symlink):
+    try:
+      link(src, dst)
+      return dst
+    except (OSError, NotImplementedError, AttributeError) as e:
+      pass
+  shutil.copyfile(src = src, dst = dst)
+  return dst
+
+class ContentStore:
+  '''
+  Content-addressed store of cache files shared by subjects and renders
+
+  Objects are stored once under `root/<d[:2]>/<digest><ext>`, where the
+  digest is the one `json_cache` computes from the data, and are never
+  modified. Cache files of subjects become references to the objects
+  (hard links, or symbolic links across file systems).
+
+  Parameters
+  ----------
+  root : store directory, created if missing
+  '''
+  def __init__(self, root):
+    self.root = os.path.abspath(root)
+    os.makedirs(self.root, exist_ok=True)
+
+  def object_path(self, digest, ext=''):
+    return os.path.join(self.root, digest[:2], '%s%s' % (digest, ext))
+
+  def relpath(self, path):
+    '''
+    Path of a store object relative to `root` ('/' separated), or None
+    if `path` is not in the store. References (symbolic links) are
+    followed
+    '''
+    path = os.path.realpath(path)
+    if os.path.dirname(os.path.dirname(path)) != os.path.realpath(
+      self.root):
+      return None
+    return '/'.join(path.split(os.sep)[-2:])
+
+  def has(self, digest, ext=''):
+    return os.path.exists(self.object_path(digest, ext))
+
+  def put(self, digest, ext, writer):
+    '''
+    Add object `digest` unless it exists; `writer(path)` writes its
+    content to a temporary path
+
+    Returns
+    -------
+    Path of the object
+    '''
+    obj = self.object_path(digest, ext)
+    if not os.path.exists(obj):
+      os.makedirs(os.path.dirname(obj), exist_ok=True)
+      tmp = temp_path(obj)
+      try:
+        writer(tmp)
+        # identical content if another process has won the race
+        os.replace(tmp, obj)
+      except BaseException:
+        if os.path.lexists(tmp):
+          os.remove(tmp)
+        raise
+    return obj
+
+  def reference(self, obj, path):
+    '''
+    Create `path` as a reference to object `obj` (hard link, symbolic
+    link, or copy if links are not supported)
+    '''
+    if os.path.lexists(path):
+      os.remove(path)
+    return _link_or_copy(obj, path)
+
+  def stats(self):
+    '''
+    Number and bytes of objects, and bytes referenced more than once by
+    hard links (saved)
+    '''
+    n = 0
+    total = 0
+    shared = 0
+    for a, dirs, files in os.walk(self.root):
+      for fn in files:
+        if fn.startswith('.'):
+          continue
+        try:
+          st = os.stat(os.path.join(a, fn))
+        except OSError as e:
+          continue
+        n += 1
+        total += st.st_size
+        # the object itself, plus one link per reference
+        shared += st.st_size * max(st.st_nlink - 2, 0)
+    return { 'root' : self.root, 'objects' : n, 'bytes' : total,
+      'saved_bytes' : shared }
+
+
+_store = {}
+_store_lock = threading.Lock()
+
+def get_store():
+  '''
+  Content store of this process, or None if disabled (default). Enable
+  with `set_store` or environment variable `RAVEBRAINPY_CACHE_STORE`
+  '''
+  with _store_lock:
+    if not 'store' in _store:
+      root = os.environ.get('RAVEBRAINPY_CACHE_STORE', '')
+      _store['store'] = ContentStore(root) if root != '' else None
+    return _store['store']
+
+def set_store(root):
+  '''
+  Use the content store at `root` (path or `ContentStore`) for new
+  caches, or disable the store if `root` is None. Returns the previous
+  store
+  '''
+  old = get_store()
+  if root is not None and not isinstance(root, ContentStore):
+    root = ContentStore(root)
+  with _store_lock:
+    _store['store'] = root
+  return old
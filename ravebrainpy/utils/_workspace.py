@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import re
+import time
+import shutil
+import atexit
+import threading
+import tempfile as tpf
+
+from ._funcs import stopifnot, rand_string
+
+# Each process lists the entries it creates in `<root>/.procs/<pid>`,
+# so entries left behind by crashed processes can be removed later
+PROC_DIR = '.procs'
+# Entries shared by all processes, never cleaned or evicted
+SHARED_ENTRIES = ('assets', )
+DEFAULT_BUDGET = 2 * 1024 ** 3
+
+def _parse_bytes(x):
+  '''
+  Parse byte size such as 1000000, '500M' or '2G'
+  '''
+  if x is None:
+    return None
+  if isinstance(x, (int, float, )):
+    return int(x)
+  m = re.match(r'^\s*([0-9.]+)\s*([kKmMgGtT]?)[bB]?\s*$', str(x))
+  stopifnot(m is not None, msg='Cannot parse byte size %s' % x)
+  unit = 1024 ** ' KMGT'.index(m.group(2).upper() or ' ')
+  return int(float(m.group(1)) * unit)
+
+def _pid_alive(pid):
+  if os.name == 'nt':
+    # os.kill would terminate the process on Windows; assume alive
+    return True
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError as e:
+    return False
+  except PermissionError as e:
+    pass
+  return True
+
+def _entry_size(path):
+  if os.path.islink(path) or not os.path.isdir(path):
+    try:
+      return os.lstat(path).st_size
+    except OSError as e:
+      return 0
+  total = 0
+  for a, dirs, files in os.walk(path):
+    for fn in files:
+      try:
+        total += os.lstat(os.path.join(a, fn)).st_size
+      except OSError as e:
+        pass
+  return total
+
+def _remove(path):
+  if os.path.isdir(path) and not os.path.islink(path):
+    shutil.rmtree(path, ignore_errors=True)
+  elif os.path.lexists(path):
+    try:
+      os.remove(path)
+    except OSError as e:
+      pass
+  return not os.path.lexists(path)
+
+
+class Workspace:
+  '''
+  Temporary workspace shared by ravebrainpy processes
+
+  Files and directories created by `new_path` are removed when the
+  process exits (one exit handler for all entries), or on start-up of
+  a later process if this one crashed. Entries created with
+  `evictable=True` (render outputs) are also removed, least recently
+  used first, once the workspace exceeds `budget` bytes; entries in
+  use can be protected with `pin`.
+
+  Parameters
+  ----------
+  root : workspace directory, default is environment variable
+         `RAVEBRAINPY_TEMP_DIR`, or 'py3jsbrain' under the system
+         temporary directory
+  budget : byte budget of evictable entries, e.g. 2**30 or '1G';
+           default is `RAVEBRAINPY_TEMP_BUDGET` or 2G
+  '''
+  def __init__(self, root=None, budget=None):
+    if root is None:
+      root = os.environ.get('RAVEBRAINPY_TEMP_DIR', None)
+    if root is None:
+      root = os.path.join(tpf.gettempdir(), 'py3jsbrain')
+    if budget is None:
+      budget = os.environ.get('RAVEBRAINPY_TEMP_BUDGET', DEFAULT_BUDGET)
+    self.root = os.path.abspath(root)
+    self.budget = _parse_bytes(budget)
+    self.pid = os.getpid()
+    self._lock = threading.RLock()
+    # name -> { 'evictable', 'last_used', 'size' }
+    self._entries = {}
+    # name -> number of pins
+    self._pinned = {}
+    self._stats = {
+      'created' : 0, 'evicted' : 0, 'evicted_bytes' : 0,
+      'recovered' : 0, 'recovered_bytes' : 0
+    }
+    self._registry = os.path.join(self.root, PROC_DIR, str(self.pid))
+    self.cleanup_orphans()
+    atexit.register(self.close)
+
+  def _name(self, path):
+    path = os.path.abspath(path)
+    if os.path.dirname(path) != self.root:
+      return None
+    return os.path.basename(path)
+
+  def new_path(self, prefix='file_', ext='', evictable=False):
+    '''
+    Reserve a new path in the workspace (nothing is created on disk)
+    '''
+    with self._lock:
+      name = '%s%s%s' % (prefix, rand_string(), ext)
+      while name in self._entries:
+        name = '%s%s%s' % (prefix, rand_string(), ext)
+      self._entries[name] = {
+        'evictable' : evictable,
+        'last_used' : time.time(),
+        'size' : None
+      }
+      self._stats['created'] += 1
+      os.makedirs(os.path.dirname(self._registry), exist_ok=True)
+      with open(self._registry, 'a') as f:
+        f.write(name + '\n')
+    return os.path.join(self.root, name)
+
+  def touch(self, path):
+    '''
+    Mark entry as used now; its size is re-computed on next eviction
+    '''
+    name = self._name(path)
+    with self._lock:
+      entry = self._entries.get(name, None)
+      if entry is not None:
+        entry['last_used'] = time.time()
+        entry['size'] = None
+
+  def pin(self, path):
+    '''
+    Protect entry from eviction (e.g. while a viewer serves it). Each
+    `pin` must be matched by an `unpin`
+    '''
+    name = self._name(path)
+    if name is not None:
+      with self._lock:
+        self._pinned[name] = self._pinned.get(name, 0) + 1
+
+  def unpin(self, path):
+    name = self._name(path)
+    with self._lock:
+      n = self._pinned.pop(name, 0) - 1
+      if n > 0:
+        self._pinned[name] = n
+
+  def remove(self, path):
+    name = self._name(path)
+    with self._lock:
+      self._entries.pop(name, None)
+      self._pinned.pop(name, None)
+    return _remove(path)
+
+  def _size(self, name, entry):
+    if entry['size'] is None:
+      entry['size'] = _entry_size(os.path.join(self.root, name))
+    return entry['size']
+
+  def evict(self, budget=None, keep=()):
+    '''
+    Remove least recently used evictable entries until they fit in
+    `budget` bytes (default is `self.budget`). Pinned entries and paths
+    in `keep` are not removed.
+
+    Returns
+    -------
+    List of removed paths
+    '''
+    budget = self.budget if budget is None else _parse_bytes(budget)
+    keep = set([self._name(p) for p in keep])
+    removed = []
+    with self._lock:
+      candidates = []
+      total = 0
+      for name, entry in self._entries.items():
+        if not entry['evictable']:
+          continue
+        path = os.path.join(self.root, name)
+        if not os.path.lexists(path):
+          continue
+        size = self._size(name, entry)
+        total += size
+        if not name in self._pinned and not name in keep:
+          candidates.append((entry['last_used'], name, size))
+      candidates.sort()
+      for last_used, name, size in candidates:
+        if total <= budget:
+          break
+        path = os.path.join(self.root, name)
+        _remove(path)
+        self._entries.pop(name, None)
+        total -= size
+        self._stats['evicted'] += 1
+        self._stats['evicted_bytes'] += size
+        removed.append(path)
+    return removed
+
+  def cleanup_orphans(self):
+    '''
+    Remove entries of processes that no longer exist (crashed without
+    running their exit handlers)
+
+    Returns
+    -------
+    List of removed paths
+    '''
+    proc_dir = os.path.join(self.root, PROC_DIR)
+    if not os.path.isdir(proc_dir):
+      return []
+    removed = []
+    for fn in os.listdir(proc_dir):
+      try:
+        pid = int(fn)
+      except ValueError as e:
+        continue
+      if pid == self.pid or _pid_alive(pid):
+        continue
+      registry = os.path.join(proc_dir, fn)
+      try:
+        with open(registry, 'r') as f:
+          names = [l.strip() for l in f.readlines()]
+      except OSError as e:
+        continue
+      for name in set(names):
+        if name in ('', '.', '..', PROC_DIR) or name in SHARED_ENTRIES \
+          or '/' in name or os.sep in name:
+          continue
+        path = os.path.join(self.root, name)
+        if os.path.lexists(path):
+          size = _entry_size(path)
+          if _remove(path):
+            self._stats['recovered'] += 1
+            self._stats['recovered_bytes'] += size
+            removed.append(path)
+      _remove(registry)
+    return removed
+
+  def stats(self):
+    '''
+    Workspace statistics (dictionary)
+    '''
+    with self._lock:
+      n_evictable = 0
+      evictable_bytes = 0
+      for name, entry in self._entries.items():
+        if entry['evictable'] and os.path.lexists(
+          os.path.join(self.root, name)):
+          n_evictable += 1
+          evictable_bytes += self._size(name, entry)
+      re = {
+        'root' : self.root,
+        'budget' : self.budget,
+        'entries' : len(self._entries),
+        'pinned' : len(self._pinned),
+        'evictable_entries' : n_evictable,
+        'evictable_bytes' : evictable_bytes
+      }
+      re.update(self._stats)
+    return re
+
+  def close(self):
+    '''
+    Remove all entries created by this process
+    '''
+    if os.getpid() != self.pid:
+      # forked child processes do not own the entries
+      return
+    with self._lock:
+      for name in list(self._entries.keys()):
+        _remove(os.path.join(self.root, name))
+      self._entries.clear()
+      self._pinned.clear()
+      _remove(self._registry)
+
+
+_workspace = {}
+
+def get_workspace():
+  '''
+  Workspace of this process, created on first use
+  '''
+  ws = _workspace.get('workspace', None)
+  if ws is None or ws.pid != os.getpid():
+    ws = Workspace()
+    _workspace['workspace'] = ws
+  return ws
+
+def set_workspace(root=None, budget=None):
+  '''
+  Replace the workspace of this process; entries created by the
+  previous workspace are removed
+  '''
+  old = _workspace.pop('workspace', None)
+  if old is not None:
+    old.close()
+  ws = Workspace(root=root, budget=budget)
+  _workspace['workspace'] = ws
+  return ws
@@ -18,6 +18,9 @@ setup(
   extras_require={
     'with_jupyter' : ['IPython']
   },
+  entry_points={
+    'console_scripts' : ['ravebrainpy=ravebrainpy._cli:main']
+  },
   include_package_data=True,
   zip_safe=False,
   test_suite='nose.collector',